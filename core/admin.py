@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Document, DocumentChunk
+from .models import Document, DocumentChunk, ScanRun
 
 
 @admin.register(Document)
@@ -13,4 +13,9 @@ class DocumentChunkAdmin(admin.ModelAdmin):
     list_display = ("document", "chunk_index")
     search_fields = ("document__file_name", "text")
 
+
+@admin.register(ScanRun)
+class ScanRunAdmin(admin.ModelAdmin):
+    list_display = ("directory", "project", "started_at", "finished_at")
+
 # Register your models here.
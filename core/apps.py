@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.core.exceptions import ImproperlyConfigured
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # A malformed CHUNK_PROFILES fails at startup instead of partway through every scan
+        from .chunking import chunk_profiles
+        try:
+            chunk_profiles()
+        except ValueError as e:
+            raise ImproperlyConfigured(f"CHUNK_PROFILES: {e}")
+        # Preloads dependencies and index shards in serving processes when WARMUP_ON_START is set
+        from .warmup import start_warmup
+        start_warmup()
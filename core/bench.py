@@ -0,0 +1,537 @@
+"""Offline throughput benchmarks against a local stand-in for the OpenAI API.
+
+``FakeOpenAIServer`` answers ``/v1/embeddings`` and ``/v1/chat/completions`` with deterministic
+vectors and canned text after a configurable latency, and can inject 429/500 errors so the gateway's
+retry path is exercised. ``generate_tree`` writes a synthetic share of text files, PDFs and images;
+``run_benchmarks`` times process startup, scans the tree through the real API views, then fills
+the database to each requested chunk count and times ``rebuild_index_from_db`` and ``/api/ask/``.
+Results are plain dicts (see ``RESULT_FORMAT``) that ``compare_results`` can diff against a
+stored baseline.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from django.conf import settings
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from .embeddings import bytes_from_vector, embedding_model
+from .llm import reset_clients
+from .models import ChunkBand, Document, DocumentChunk
+from .lazy import HEAVY_MODULES, optional_import
+from .vectorstore import available, rebuild_index_from_db, shard_cache
+
+RESULT_FORMAT = 'ragnetscanner-bench'
+RESULT_VERSION = 1
+
+_WORDS = (
+    "contract scope drawing revision site survey steel concrete beam column foundation schedule "
+    "invoice payment retention variation clause specification tender electrical plumbing hvac "
+    "inspection approval permit safety report minutes meeting budget estimate subcontractor "
+    "warranty handover defect snag facade roof slab excavation drainage landscaping"
+).split()
+
+
+def fake_vector(text: str, dim: int) -> List[float]:
+    # Deterministic per text so repeated inputs embed identically
+    seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+    np = optional_import('numpy')
+    if np is not None:
+        vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+        return (vec / (np.linalg.norm(vec) or 1.0)).tolist()
+    rng = random.Random(seed)
+    vec = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(x * x for x in vec) ** 0.5 or 1.0
+    return [x / norm for x in vec]
+
+
+class FakeOpenAIServer:
+    """Threaded HTTP server mimicking the embeddings and chat completions endpoints.
+
+    ``latency_ms`` (+ uniform ``jitter_ms``) is slept before every response; ``error_rate`` of the
+    requests fail, alternating between 429 with ``retry-after-ms`` and 500.
+    """
+
+    def __init__(self, dim: int = 256, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"embeddings": 0, "chat": 0, "errors": 0, "inputs": 0}
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # keep benchmark output clean
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = {}
+                status, payload, headers = server._respond(self.path, body)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _respond(self, path: str, body: Dict[str, Any]):
+        with self._lock:
+            delay = (self.latency_ms + self._rng.uniform(0, self.jitter_ms)) / 1000.0
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.stats["errors"] += 1
+                status = 429 if self.stats["errors"] % 2 else 500
+        if delay:
+            time.sleep(delay)
+        headers = {
+            "x-ratelimit-limit-requests": "1000000",
+            "x-ratelimit-remaining-requests": "999999",
+            "x-ratelimit-limit-tokens": "1000000000",
+            "x-ratelimit-remaining-tokens": "999999999",
+        }
+        if fail:
+            if status == 429:
+                headers["retry-after-ms"] = "20"
+            return status, {"error": {"message": "injected failure", "type": "server_error"}}, headers
+        if path.endswith("/embeddings"):
+            return 200, self._embeddings(body), headers
+        if path.endswith("/chat/completions"):
+            return 200, self._chat(body), headers
+        return 404, {"error": {"message": f"unknown path {path}"}}, headers
+
+    def _embeddings(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(inputs):
+            vec = fake_vector(str(text), self.dim)
+            value = base64.b64encode(bytes_from_vector(vec)).decode('ascii') if as_base64 else vec
+            data.append({"object": "embedding", "index": i, "embedding": value})
+        tokens = sum(len(str(t)) // 4 + 1 for t in inputs)
+        with self._lock:
+            self.stats["embeddings"] += 1
+            self.stats["inputs"] += len(inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", ""),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _chat(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.stats["chat"] += 1
+        prompt_tokens = len(json.dumps(body.get("messages") or [])) // 4 + 1
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "Synthetic benchmark answer."},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 4, "total_tokens": prompt_tokens + 4},
+        }
+
+
+# Synthetic trees
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _pdf_bytes(pages: Sequence[Sequence[str]]) -> bytes:
+    # Minimal PDF: one Helvetica text stream per page, enough for PdfReader.extract_text()
+    objects: List[bytes] = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(("<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{p} 0 R" for p in page_ids), len(pages))).encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for lines in pages:
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = ("BT /F1 10 Tf 12 TL 40 760 Td " + " ".join(f"({line}) '" for line in escaped) + " ET").encode('latin-1', 'replace')
+        content_id = len(objects) + 2
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {content_id} 0 R "
+                       f"/Resources << /Font << /F1 3 0 R >> >> >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _png_bytes(width: int, height: int, rng: random.Random) -> bytes:
+    # Noisy RGB so the file size scales with the pixel count like a photo or scan would
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    row = bytes(rng.getrandbits(8) for _ in range(width * 3))
+    raw = b"".join(b"\x00" + row[(y * 7) % len(row):] + row[:(y * 7) % len(row)] for y in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+def generate_tree(root: str, files: int = 200, seed: int = 0,
+                  text_share: float = 0.7, pdf_share: float = 0.15,
+                  image_sizes: Sequence[int] = (64, 512, 1536)) -> Dict[str, int]:
+    """Write ``files`` synthetic files under ``root``; the rest after text and PDFs are PNG images.
+
+    Text files range from a few lines to ~40 KB, PDFs from 1 to 5 pages, images cycle through
+    ``image_sizes`` (square, in pixels). Returns the number of files of each kind.
+    """
+    rng = random.Random(seed)
+    counts = {"text": 0, "pdf": 0, "image": 0, "bytes": 0}
+    for i in range(files):
+        folder = os.path.join(root, f"project{i % 7}", f"area{i % 3}")
+        os.makedirs(folder, exist_ok=True)
+        roll = rng.random()
+        if roll < text_share:
+            kind, path = "text", os.path.join(folder, f"notes_{i}.txt")
+            paragraphs = rng.choice((1, 4, 16, 64))
+            data = "\n\n".join(_sentence(rng, rng.randint(40, 100)) for _ in range(paragraphs)).encode('utf-8')
+        elif roll < text_share + pdf_share:
+            kind, path = "pdf", os.path.join(folder, f"spec_{i}.pdf")
+            pages = [[_sentence(rng, 12) for _ in range(40)] for _ in range(rng.randint(1, 5))]
+            data = _pdf_bytes(pages)
+        else:
+            kind, path = "image", os.path.join(folder, f"photo_{i}.png")
+            size = image_sizes[counts["image"] % len(image_sizes)]
+            data = _png_bytes(size, size, rng)
+        with open(path, 'wb') as f:
+            f.write(data)
+        counts[kind] += 1
+        counts["bytes"] += len(data)
+    return counts
+
+
+# Measurements
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.4999)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _sum_stage_seconds(breakdowns: Iterable[Dict[str, Any]]) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for breakdown in breakdowns:
+        for name, stage in (breakdown.get("stages") or {}).items():
+            totals[name] = totals.get(name, 0.0) + float(stage.get("seconds", 0.0))
+    return totals
+
+
+def bench_scan(client: Client, directory: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    resp = client.post(reverse('scan-directory'), data=json.dumps({"directory": directory, "project": "bench"}),
+                       content_type='application/json')
+    elapsed = time.perf_counter() - start
+    body = resp.json()
+    if resp.status_code != 200:
+        raise RuntimeError(f"scan failed: {body}")
+    chunks = body.get("chunks_added", 0)
+    stages = (body.get("timings") or {}).get("stages", {})
+    vision = stages.get("describe_image", {})
+    return {
+        "name": "scan",
+        "files": body.get("processed", 0),
+        "chunks": chunks,
+        "seconds": round(elapsed, 4),
+        "files_per_sec": round(body.get("processed", 0) / elapsed, 3) if elapsed else 0.0,
+        "chunks_per_sec": round(chunks / elapsed, 3) if elapsed else 0.0,
+        "embedding_failures": body.get("embedding_failures", 0),
+        "images": stages.get("image_prepare", {}).get("count", 0),
+        "vision_calls": vision.get("count", 0),
+        "vision_upload_bytes": vision.get("bytes", 0),
+        "stage_seconds": {k: round(v, 4) for k, v in _sum_stage_seconds([body.get("timings") or {}]).items()},
+    }
+
+
+def populate_chunks(target: int, dim: int, chunks_per_doc: int = 10, seed: int = 0, batch: int = 5000) -> int:
+    """Grow the database to ``target`` chunks of synthetic text and vectors. Returns chunks added."""
+    existing = DocumentChunk.objects.count()
+    model = embedding_model()
+    rng = random.Random(seed + existing)
+    added = 0
+    doc_number = Document.objects.count()
+    while existing + added < target:
+        take = min(batch, target - existing - added)
+        docs = []
+        for _ in range((take + chunks_per_doc - 1) // chunks_per_doc):
+            description = _sentence(rng, 20)
+            docs.append(Document(
+                file_path=f"/bench/doc_{doc_number}.txt", file_name=f"doc_{doc_number}.txt", file_type="text/plain",
+                project=f"project{doc_number % 7}", description=description,
+                description_embedding=bytes_from_vector(fake_vector(description, dim)),
+                description_embedding_model=model,
+            ))
+            doc_number += 1
+        Document.objects.bulk_create(docs, batch_size=1000)
+        rows = []
+        for doc in docs:
+            for index in range(chunks_per_doc):
+                if len(rows) >= take:
+                    break
+                text = _sentence(rng, 150)
+                rows.append(DocumentChunk(document=doc, chunk_index=index, text=text, embedding_model=model,
+                                          embedding=bytes_from_vector(fake_vector(text, dim))))
+        DocumentChunk.objects.bulk_create(rows, batch_size=1000)
+        added += len(rows)
+    return added
+
+
+_STARTUP_SCRIPT = '''
+import json, os, sys
+import django
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rag_netscanner_backend.settings")
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns  # imports every view module, like a worker's first request
+print(json.dumps([name for name in json.loads(sys.argv[1]) if name in sys.modules]))
+'''
+
+
+def bench_startup(runs: int = 5) -> Dict[str, Any]:
+    """Cold start of a fresh interpreter: ``django.setup()`` plus the URLconf and every view module."""
+    timings = []
+    heavy: List[str] = []
+    for _ in range(max(1, runs)):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT, json.dumps(HEAVY_MODULES)], cwd=str(settings.BASE_DIR),
+                              capture_output=True, text=True, check=True)
+        timings.append((time.perf_counter() - start) * 1000.0)
+        heavy = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {
+        "name": "startup",
+        "runs": len(timings),
+        "p50_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        # Heavy dependencies imported at startup; these should load on first use instead
+        "heavy_imports": heavy,
+    }
+
+
+def bench_index(chunks: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    built = rebuild_index_from_db()
+    return {"name": "rebuild_index", "chunks": chunks, "seconds": round(time.perf_counter() - start, 4), "faiss": bool(built)}
+
+
+def bench_ask(chunks: int, questions: int, seed: int = 0) -> Dict[str, Any]:
+    # One event loop for all questions, like an ASGI worker, so the pooled OpenAI client is reused
+    rng = random.Random(seed)
+    payloads = [json.dumps({"question": _sentence(rng, 8) + "?", "k": 5}) for _ in range(questions)]
+
+    async def ask_all():
+        client = AsyncClient()
+        timings = []
+        for payload in payloads:
+            start = time.perf_counter()
+            resp = await client.post(reverse('ask-question'), data=payload, content_type='application/json')
+            timings.append(((time.perf_counter() - start) * 1000.0, resp))
+        return timings
+
+    latencies: List[float] = []
+    breakdowns: List[Dict[str, Any]] = []
+    failures = 0
+    # The first question loads the index shards, like the first one after a deploy
+    shard_cache.clear()
+    for elapsed_ms, resp in asyncio.run(ask_all()):
+        latencies.append(elapsed_ms)
+        if resp.status_code != 200:
+            failures += 1
+            continue
+        breakdowns.append(resp.json().get("timings") or {})
+    stage_totals = _sum_stage_seconds(breakdowns)
+    return {
+        "name": "ask",
+        "chunks": chunks,
+        "requests": questions,
+        "failures": failures,
+        "first_ms": round(latencies[0], 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "stage_mean_ms": {k: round(v * 1000.0 / max(1, len(breakdowns)), 3) for k, v in stage_totals.items()},
+    }
+
+
+def _environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "faiss": available(),
+        "numpy": optional_import('numpy') is not None,
+        "database": settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+    }
+
+
+def run_benchmarks(workdir: Optional[str] = None, files: int = 200, sizes: Sequence[int] = (10_000, 100_000, 1_000_000),
+                   questions: int = 50, dim: int = 256, latency_ms: float = 50.0, jitter_ms: float = 20.0,
+                   error_rate: float = 0.0, seed: int = 0, backend: str = 'openai', log=None) -> Dict[str, Any]:
+    """Run the scan, index and ask benchmarks against the current database and return the results.
+
+    The database is cleared first and left populated; callers point Django at a throwaway database.
+    """
+    log = log or (lambda message: None)
+    own_tmp = None
+    if workdir is None:
+        own_tmp = tempfile.TemporaryDirectory(prefix="ragnet-bench-")
+        workdir = own_tmp.name
+    results: List[Dict[str, Any]] = []
+    config = {
+        "files": files, "sizes": list(sizes), "questions": questions, "dim": dim,
+        "latency_ms": latency_ms, "jitter_ms": jitter_ms, "error_rate": error_rate, "seed": seed,
+        "backend": backend,
+    }
+    log("Benchmarking startup...")
+    results.append(bench_startup())
+    try:
+        with FakeOpenAIServer(dim=dim, latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate, seed=seed) as server:
+            overrides = override_settings(
+                OPENAI_API_KEY="bench",
+                OPENAI_BASE_URL=server.base_url,
+                OPENAI_RPM_LIMIT=1_000_000,
+                OPENAI_TPM_LIMIT=1_000_000_000,
+                EMBEDDING_BACKEND=backend,
+                EMBEDDING_DIM=dim,
+                VECTOR_INDEX_DIR=os.path.join(workdir, "index"),
+            )
+            with overrides:
+                reset_clients()
+                try:
+                    client = Client()
+                    _clear()
+                    tree = os.path.join(workdir, "tree")
+                    log(f"Generating {files} files...")
+                    generate_tree(tree, files=files, seed=seed)
+                    log("Benchmarking scan...")
+                    results.append(bench_scan(client, tree))
+
+                    _clear()
+                    for size in sorted(sizes):
+                        log(f"Populating {size} chunks...")
+                        populate_chunks(size, dim, seed=seed)
+                        log(f"Benchmarking index rebuild and ask at {size} chunks...")
+                        results.append(bench_index(size))
+                        results.append(bench_ask(size, questions, seed=seed))
+                finally:
+                    reset_clients()
+            server_stats = dict(server.stats)
+    finally:
+        if own_tmp is not None:
+            own_tmp.cleanup()
+    return {
+        "format": RESULT_FORMAT,
+        "version": RESULT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": _environment(),
+        "config": config,
+        "server": server_stats,
+        "results": results,
+    }
+
+
+def _clear() -> None:
+    ChunkBand.objects.all().delete()
+    DocumentChunk.objects.all().delete()
+    Document.objects.all().delete()
+
+
+# Regression checks: metric -> True when higher is better
+_TRACKED = {
+    "startup": {"p50_ms": False},
+    "scan": {"files_per_sec": True, "chunks_per_sec": True},
+    "rebuild_index": {"seconds": False},
+    "ask": {"p50_ms": False, "p99_ms": False},
+}
+
+
+def _result_key(result: Dict[str, Any]):
+    return result.get("name"), (result.get("chunks") if result.get("name") not in ("scan", "startup") else None)
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """Describe every tracked metric that is more than ``tolerance`` worse than in ``baseline``."""
+    previous = {_result_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current.get("results", []):
+        old = previous.get(_result_key(result))
+        if old is None:
+            continue
+        for metric, higher_is_better in _TRACKED.get(result["name"], {}).items():
+            new_value, old_value = result.get(metric), old.get(metric)
+            if not new_value or not old_value:
+                continue
+            change = (old_value - new_value) / old_value if higher_is_better else (new_value - old_value) / old_value
+            if change > tolerance:
+                label = result["name"] + (f"@{result['chunks']}" if result["name"] not in ("scan", "startup") else "")
+                regressions.append(f"{label} {metric}: {old_value} -> {new_value} ({change:+.0%} worse)")
+    return regressions
@@ -0,0 +1,207 @@
+"""Compare chunking settings on a sample of real files (``manage.py chunk_eval``).
+
+Each candidate profile set re-chunks and embeds the same sample. It then answers the same
+synthetic questions by exact nearest-neighbour search over the chunks. A question is a sentence
+taken from a sampled file with some of its words dropped. A question counts as found for
+``doc_recall`` when one of the top ``k`` chunks comes from that file, and for ``passage_recall``
+when one of them contains the sentence's middle words. ``recommend`` picks the candidate with the
+fewest chunks whose passage recall is within a tolerance of the best.
+"""
+import heapq
+import random
+import re
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from django.conf import settings
+
+from .chunking import ChunkProfile, chunk_profiles, chunk_text, format_profiles, parse_profiles, strategy_for
+from .context import count_tokens
+from .embeddings import EmbeddingBackend, HashingEmbeddingBackend
+from .lazy import optional_import
+from .scanner import iter_scan_entries, read_text_from_file
+
+# The splitter scans used before format-aware chunking: ~1000 characters with 200 of overlap, any format
+LEGACY_PROFILE = ChunkProfile(250, 50)
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+|\n+')
+_WORD_RE = re.compile(r'\w+')
+_NEEDLE_WORDS = 6
+_EMBED_BATCH = 256
+
+
+class Sample(NamedTuple):
+    path: str
+    file_type: str
+    text: str
+
+
+class Query(NamedTuple):
+    sample: int
+    text: str
+    needle: str
+
+
+class Candidate(NamedTuple):
+    name: str
+    profiles: Dict[str, ChunkProfile]
+    # False chunks every format as plain text, like the legacy splitter
+    structured: bool = True
+
+
+def _words(text: str) -> str:
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+
+def load_corpus(directory: str, max_files: int = 200, seed: int = 0) -> List[Sample]:
+    """Up to ``max_files`` readable files under ``directory``, sampled at random."""
+    entries = list(iter_scan_entries(directory))
+    random.Random(seed).shuffle(entries)
+    corpus: List[Sample] = []
+    for entry in entries:
+        if len(corpus) >= max_files:
+            break
+        text = read_text_from_file(entry.path)
+        if text.strip():
+            corpus.append(Sample(entry.path, entry.file_type, text))
+    return corpus
+
+
+def make_queries(corpus: Sequence[Sample], count: int = 200, seed: int = 0, drop: float = 0.25) -> List[Query]:
+    """Up to ``count`` questions built from sentences of 8 to 40 words, spread over the files."""
+    rng = random.Random(seed)
+    pools = []
+    for i, sample in enumerate(corpus):
+        sentences = [s for s in _SENTENCE_RE.split(sample.text) if 8 <= len(_WORD_RE.findall(s)) <= 40]
+        if sentences:
+            rng.shuffle(sentences)
+            pools.append((i, sentences))
+    queries: List[Query] = []
+    depth = 0
+    while pools and len(queries) < count:
+        for i, sentences in pools:
+            if depth < len(sentences) and len(queries) < count:
+                words = _WORD_RE.findall(sentences[depth])
+                middle = (len(words) - _NEEDLE_WORDS) // 2
+                needle = " ".join(words[middle:middle + _NEEDLE_WORDS]).lower()
+                kept = [w for w in words if rng.random() >= drop] or words
+                queries.append(Query(i, " ".join(kept), needle))
+        depth += 1
+        pools = [(i, sentences) for i, sentences in pools if depth < len(sentences)]
+    return queries
+
+
+def default_candidates(scales: Sequence[float] = (0.5, 1.5, 2.0),
+                       extra: Sequence[str] = ()) -> List[Candidate]:
+    """The legacy splitter, the current ``CHUNK_PROFILES``, the current sizes scaled by each of
+    ``scales`` and each ``extra`` profile string applied over the current profiles."""
+    current = chunk_profiles()
+    candidates = [
+        Candidate("legacy", {name: LEGACY_PROFILE for name in current}, structured=False),
+        Candidate("current", current),
+    ]
+    for scale in scales:
+        scaled = {name: ChunkProfile(max(16, round(p.tokens * scale)), round(p.overlap * scale))
+                  for name, p in current.items()}
+        candidates.append(Candidate(f"x{scale:g}", scaled))
+    for spec in extra:
+        candidates.append(Candidate(spec, {**current, **parse_profiles(spec)}))
+    return candidates
+
+
+def _embed(backend: EmbeddingBackend, client, texts: List[str]) -> List[List[float]]:
+    vectors: List[List[float]] = []
+    for start in range(0, len(texts), _EMBED_BATCH):
+        vectors.extend(backend.embed(client, texts[start:start + _EMBED_BATCH]))
+    return vectors
+
+
+def _top_k(query_vectors: List[List[float]], chunk_vectors: List[List[float]], k: int) -> List[List[int]]:
+    np = optional_import("numpy")
+    if np is not None:
+        chunks = np.asarray(chunk_vectors, dtype='float32')
+        chunks /= np.maximum(np.linalg.norm(chunks, axis=1, keepdims=True), 1e-12)
+        queries = np.asarray(query_vectors, dtype='float32')
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = queries @ chunks.T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return [sorted(row.tolist(), key=lambda j, s=s: -s[j]) for row, s in zip(top, scores)]
+    return [heapq.nlargest(k, range(len(chunk_vectors)), key=lambda j, q=q: sum(a * b for a, b in zip(q, chunk_vectors[j])))
+            for q in query_vectors]
+
+
+def evaluate(corpus: Sequence[Sample], queries: Sequence[Query], candidate: Candidate, backend: EmbeddingBackend,
+             client=None, k: int = 5, max_chunks: Optional[int] = None) -> Dict[str, Any]:
+    """Chunk counts, tokens and recall of one candidate."""
+    started = time.perf_counter()
+    texts: List[str] = []
+    owners: List[int] = []
+    by_format: Dict[str, int] = {}
+    for i, sample in enumerate(corpus):
+        chunks = chunk_text(sample.text, sample.path, sample.file_type, max_chunks, candidate.profiles,
+                            None if candidate.structured else "text")
+        fmt = strategy_for(sample.path, sample.file_type)
+        by_format[fmt] = by_format.get(fmt, 0) + len(chunks)
+        texts.extend(chunks)
+        owners.extend([i] * len(chunks))
+    result: Dict[str, Any] = {
+        "name": candidate.name,
+        "profiles": format_profiles(candidate.profiles) if candidate.structured else "legacy",
+        "chunks": len(texts),
+        "tokens": sum(count_tokens(t) for t in texts),
+        "chunks_by_format": by_format,
+        "queries": len(queries),
+    }
+    doc_hits = passage_hits = 0
+    reciprocal_ranks = 0.0
+    if texts and queries:
+        chunk_words = [f" {_words(t)} " for t in texts]
+        ranked = _top_k(_embed(backend, client, [q.text for q in queries]), _embed(backend, client, texts), k)
+        for query, top in zip(queries, ranked):
+            doc_hits += any(owners[j] == query.sample for j in top)
+            for rank, j in enumerate(top, 1):
+                if owners[j] == query.sample and f" {query.needle} " in chunk_words[j]:
+                    passage_hits += 1
+                    reciprocal_ranks += 1.0 / rank
+                    break
+    total = max(1, len(queries))
+    result.update({
+        "doc_recall": round(doc_hits / total, 4),
+        "passage_recall": round(passage_hits / total, 4),
+        "mrr": round(reciprocal_ranks / total, 4),
+        "seconds": round(time.perf_counter() - started, 3),
+    })
+    return result
+
+
+def recommend(results: Sequence[Dict[str, Any]], tolerance: float = 0.01) -> Optional[Dict[str, Any]]:
+    """The structured candidate with the fewest chunks whose passage recall is within ``tolerance``
+    of the best candidate's."""
+    structured = [r for r in results if r["profiles"] != "legacy"]
+    if not structured:
+        return None
+    best = max(r["passage_recall"] for r in results)
+    eligible = [r for r in structured if r["passage_recall"] >= best - tolerance]
+    return min(eligible, key=lambda r: (r["chunks"], -r["passage_recall"])) if eligible else None
+
+
+def run_evaluation(directory: str, candidates: Sequence[Candidate], max_files: int = 200, queries: int = 200,
+                   k: int = 5, seed: int = 0, backend: Optional[EmbeddingBackend] = None, client=None,
+                   tolerance: float = 0.01) -> Dict[str, Any]:
+    """Evaluate ``candidates`` on a sample of ``directory``; ``backend`` defaults to local hashing embeddings."""
+    if backend is None:
+        backend = HashingEmbeddingBackend(int(getattr(settings, 'EMBEDDING_DIM', 512) or 512))
+    corpus = load_corpus(directory, max_files, seed)
+    questions = make_queries(corpus, queries, seed)
+    max_chunks = int(getattr(settings, 'SCAN_MAX_CHUNKS', 64) or 64)
+    results = [evaluate(corpus, questions, c, backend, client, k, max_chunks) for c in candidates]
+    best = recommend(results, tolerance)
+    return {
+        "files": len(corpus),
+        "queries": len(questions),
+        "k": k,
+        "embedding_model": backend.name,
+        "results": results,
+        "recommended": best["name"] if best else None,
+        "recommended_profiles": best["profiles"] if best else None,
+    }
@@ -0,0 +1,284 @@
+"""Format-aware chunking of extracted text.
+
+``chunk_text`` picks a strategy from the file's extension and type:
+
+- ``pdf``: pages (``read_text_from_file`` separates them with form feeds) are packed whole, several
+  short pages to a chunk; a page too long for one chunk starts a new chunk and is split by
+  paragraphs, lines and sentences.
+- ``markdown``: one section per heading. Pieces of a section that had to be split, and sections
+  packed after another one, carry their heading trail ("# Spec / ## Concrete") so they stay
+  findable on their own.
+- ``code``: top-level blocks (a definition with its body), split by lines when too long; the
+  block's first line is repeated on its continuation chunks.
+- ``csv``: rows packed under a repeated header line.
+- ``text``: paragraphs, then lines, sentences and words.
+
+Sizes are in tokens (``count_tokens``) and, with the overlap carried between consecutive chunks,
+configured per strategy (``CHUNK_PROFILES``). Structured formats default to no overlap since their
+boundaries already fall between sections.
+"""
+import os
+import re
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .context import count_tokens
+
+
+class ChunkProfile(NamedTuple):
+    tokens: int
+    overlap: int = 0
+
+
+STRATEGIES = ("pdf", "markdown", "code", "csv", "text")
+DEFAULT_PROFILES: Dict[str, ChunkProfile] = {
+    "pdf": ChunkProfile(400, 0),
+    "markdown": ChunkProfile(300, 0),
+    "code": ChunkProfile(300, 0),
+    "csv": ChunkProfile(300, 0),
+    "text": ChunkProfile(250, 25),
+}
+
+_CODE_EXTENSIONS = {
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".java", ".kt", ".scala", ".go", ".rs", ".c", ".h", ".cc", ".cpp",
+    ".hpp", ".cs", ".rb", ".php", ".swift", ".sh", ".bash", ".ps1", ".sql", ".lua", ".pl", ".r", ".m",
+}
+_TEXT_SEPARATORS = ("\n\n", "\n", ". ", " ")
+_CODE_SEPARATORS = ("\n\n", "\n", " ")
+_CSV_SEPARATORS = (",", " ")
+_HEADING_RE = re.compile(r'^(#{1,6})\s+\S')
+_FENCE_RE = re.compile(r'^\s*(```|~~~)')
+# Longest a text is assumed to be without counting its tokens; longer ones are split right away
+_CHARS_PER_TOKEN_MAX = 16
+
+
+def parse_profiles(value: str) -> Dict[str, ChunkProfile]:
+    """Parse ``"pdf=400:0,text=250:25"`` (overlap optional) into profiles. Raises ValueError."""
+    profiles: Dict[str, ChunkProfile] = {}
+    for item in (value or "").split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, spec = item.partition('=')
+        name = name.strip().lower()
+        if name not in STRATEGIES:
+            raise ValueError(f"Unknown chunking format {name!r}; expected one of {', '.join(STRATEGIES)}")
+        tokens, _, overlap = spec.partition(':')
+        try:
+            profile = ChunkProfile(int(tokens), int(overlap or 0))
+        except ValueError:
+            raise ValueError(f"Invalid chunk profile {item!r}; expected <format>=<tokens>[:<overlap>]")
+        if profile.tokens < 16 or not 0 <= profile.overlap < profile.tokens:
+            raise ValueError(f"Invalid chunk profile {item!r}; need tokens >= 16 and 0 <= overlap < tokens")
+        profiles[name] = profile
+    return profiles
+
+
+def format_profiles(profiles: Dict[str, ChunkProfile]) -> str:
+    return ",".join(f"{name}={profiles[name].tokens}:{profiles[name].overlap}" for name in STRATEGIES if name in profiles)
+
+
+def chunk_profiles() -> Dict[str, ChunkProfile]:
+    """``DEFAULT_PROFILES`` with the ``CHUNK_PROFILES`` setting applied."""
+    return {**DEFAULT_PROFILES, **parse_profiles(getattr(settings, 'CHUNK_PROFILES', '') or '')}
+
+
+def strategy_for(path: str, file_type: str = "") -> str:
+    ext = os.path.splitext(path)[1].lower()
+    file_type = (file_type or "").lower()
+    if ext == ".pdf" or file_type == "application/pdf":
+        return "pdf"
+    if ext in (".md", ".markdown") or file_type == "text/markdown":
+        return "markdown"
+    if ext in (".csv", ".tsv") or file_type in ("text/csv", "text/tab-separated-values"):
+        return "csv"
+    if ext in _CODE_EXTENSIONS or file_type in ("text/x-python", "text/javascript", "application/javascript"):
+        return "code"
+    return "text"
+
+
+class _Piece(NamedTuple):
+    text: str
+    tokens: int
+    # Prepended when the piece starts a chunk (heading trail, CSV header, block signature)
+    header: str = ""
+    # First piece of a section too long for one chunk: the section starts a new chunk
+    starts: bool = False
+
+
+def _split(text: str, size: int, separators: Sequence[str]) -> Iterator[Tuple[str, int]]:
+    """Pieces of at most ``size`` tokens, cut at the coarsest separator present.
+
+    Separators stay attached to the piece before them, so the pieces concatenate to ``text``.
+    """
+    # Trailing spaces aren't counted: the tokenizer joins them to the next word
+    tokens = None if len(text) > size * _CHARS_PER_TOKEN_MAX else count_tokens(text.rstrip(" "))
+    if tokens is not None and tokens <= size:
+        if text.strip():
+            yield text, tokens
+        return
+    for i, sep in enumerate(separators):
+        if sep in text:
+            parts = text.split(sep)
+            for j, part in enumerate(parts):
+                yield from _split(part + sep if j < len(parts) - 1 else part, size, separators[i + 1:])
+            return
+    # One run without separators (a hash, base64, minified code): cut it by characters
+    step = max(1, size * 2)
+    for start in range(0, len(text), step):
+        part = text[start:start + step]
+        yield part, count_tokens(part)
+
+
+def _pack(pieces: Iterable[_Piece], size: int, overlap: int) -> Iterator[str]:
+    """Greedily join pieces into chunks of up to ``size`` tokens.
+
+    The last pieces of a chunk, up to ``overlap`` tokens, are repeated at the start of the next.
+    """
+    header_tokens: Dict[str, int] = {}
+
+    def cost(header: str) -> int:
+        if header not in header_tokens:
+            header_tokens[header] = count_tokens(header) + 1 if header else 0
+        return header_tokens[header]
+
+    current: List[_Piece] = []
+    total = 0
+    for piece in pieces:
+        if current and (piece.starts or total + piece.tokens > size):
+            yield _join(current)
+            carry: List[_Piece] = []
+            carried = 0
+            for previous in reversed(current):
+                if carried + previous.tokens > overlap:
+                    break
+                carry.insert(0, previous)
+                carried += previous.tokens
+            current = carry
+            total = carried + (cost(carry[0].header) if carry else 0)
+            while current and (piece.starts or total + piece.tokens > size):
+                dropped = current.pop(0)
+                total -= dropped.tokens
+                if current:
+                    total += cost(current[0].header) - cost(dropped.header)
+                else:
+                    total = 0
+        if not current:
+            total = cost(piece.header)
+        current.append(piece)
+        total += piece.tokens
+    if current:
+        yield _join(current)
+
+
+def _join(pieces: List[_Piece]) -> str:
+    # Keep leading indentation (code continuation chunks)
+    body = "".join(p.text for p in pieces).lstrip("\r\n\f").rstrip()
+    header = pieces[0].header
+    return f"{header}\n{body}" if header and not body.startswith(header) else body
+
+
+def _sections(sections: Iterable[Tuple[str, str, str]], size: int, separators: Sequence[str]) -> Iterator[_Piece]:
+    """Pieces of ``(text, first_header, continuation_header)`` sections.
+
+    A section that fits is one piece; a longer one is split, starts a new chunk, and its pieces
+    after the first carry ``continuation_header``.
+    """
+    for text, first_header, continuation_header in sections:
+        if not text.strip():
+            continue
+        parts = _split(text, size, separators)
+        first = next(parts, None)
+        if first is None:
+            continue
+        following = next(parts, None)
+        yield _Piece(first[0], first[1], first_header, following is not None)
+        while following is not None:
+            yield _Piece(following[0], following[1], continuation_header)
+            following = next(parts, None)
+
+
+def _pdf_pieces(text: str, size: int) -> Iterator[_Piece]:
+    return _sections(((page.rstrip() + "\n\n", "", "") for page in text.split("\f")), size, _TEXT_SEPARATORS)
+
+
+def _markdown_sections(text: str) -> Iterator[Tuple[str, str, str]]:
+    trail: List[Tuple[int, str]] = []
+    lines: List[str] = []
+    in_fence = False
+
+    def emit():
+        ancestors = "\n".join(h for _, h in trail[:-1])
+        own = trail[-1][1] if trail else ""
+        full = "\n".join(h for _, h in trail)
+        return "".join(lines), ancestors if lines and own and lines[0].rstrip("\n") == own else full, full
+
+    for line in text.splitlines(keepends=True):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING_RE.match(line)
+        if match:
+            if lines:
+                yield emit()
+            level = len(match.group(1))
+            trail = [(lvl, h) for lvl, h in trail if lvl < level] + [(level, line.rstrip("\n"))]
+            lines = []
+        lines.append(line)
+    if lines:
+        yield emit()
+
+
+def _code_sections(text: str) -> Iterator[Tuple[str, str, str]]:
+    # A top-level block starts at an unindented line after a blank line
+    block: List[str] = []
+    blank = False
+    for line in text.splitlines(keepends=True):
+        if block and blank and line.strip() and not line[0].isspace():
+            yield _code_block(block)
+            block = []
+        blank = not line.strip()
+        block.append(line)
+    if block:
+        yield _code_block(block)
+
+
+def _code_block(lines: List[str]) -> Tuple[str, str, str]:
+    signature = next((line.rstrip() for line in lines if line.strip()), "")
+    return "".join(lines), "", signature[:200]
+
+
+def _csv_pieces(text: str, size: int) -> Iterator[_Piece]:
+    lines = text.splitlines(keepends=True)
+    if not lines:
+        return iter(())
+    header = lines[0].rstrip("\r\n")
+    return _sections(((row, header, header) for row in lines[1:]), size, _CSV_SEPARATORS)
+
+
+def _pieces(text: str, strategy: str, size: int) -> Iterator[_Piece]:
+    if strategy == "pdf":
+        return _pdf_pieces(text, size)
+    if strategy == "markdown":
+        return _sections(_markdown_sections(text), size, _TEXT_SEPARATORS)
+    if strategy == "code":
+        return _sections(_code_sections(text), size, _CODE_SEPARATORS)
+    if strategy == "csv":
+        return _csv_pieces(text, size)
+    return _sections([(text, "", "")], size, _TEXT_SEPARATORS)
+
+
+def chunk_text(text: str, path: str = "", file_type: str = "", limit: Optional[int] = None,
+               profiles: Optional[Dict[str, ChunkProfile]] = None, strategy: Optional[str] = None) -> List[str]:
+    """Split ``text`` extracted from ``path`` into at most ``limit`` chunks.
+
+    ``profiles`` defaults to ``chunk_profiles()``; ``strategy`` overrides the one picked from the
+    path and type. Splitting stops once ``limit`` chunks are produced.
+    """
+    if not text or not text.strip():
+        return []
+    strategy = strategy or strategy_for(path, file_type)
+    profile = (profiles or chunk_profiles()).get(strategy) or DEFAULT_PROFILES[strategy]
+    chunks = _pack(_pieces(text, strategy, profile.tokens), profile.tokens, profile.overlap)
+    return list(islice(chunks, limit) if limit else chunks)
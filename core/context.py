@@ -0,0 +1,119 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .lazy import NOT_LOADED, optional_import
+from .llm import estimate_tokens
+
+# Optional (counts fall back to a character-based estimate) and imported on first use
+tiktoken = NOT_LOADED
+_encoding = None
+
+
+def _get_encoding():
+    global tiktoken, _encoding
+    if _encoding is None:
+        if tiktoken is NOT_LOADED:
+            tiktoken = optional_import('tiktoken')
+        try:
+            _encoding = tiktoken.get_encoding('o200k_base') if tiktoken is not None else False
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text or ""))
+    return estimate_tokens(text)
+
+
+def _truncate_to_tokens(text: str, limit: int) -> str:
+    if limit <= 0:
+        return ""
+    enc = _get_encoding()
+    if enc is not None:
+        tokens = enc.encode(text)
+        return text if len(tokens) <= limit else enc.decode(tokens[:limit])
+    return text[:limit * 4]
+
+
+def context_budget() -> int:
+    return max(1, int(getattr(settings, 'ASK_CONTEXT_TOKENS', 3000) or 3000))
+
+
+def merge_overlap(first: str, second: str, max_overlap: int = 400, min_overlap: int = 16) -> str:
+    """Join two consecutive chunks, dropping the text the splitter repeated at the boundary.
+
+    Matches shorter than ``min_overlap`` are treated as coincidence rather than overlap.
+    """
+    limit = min(len(first), len(second), max_overlap)
+    for size in range(limit, min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+class _Passage:
+    __slots__ = ('file_name', 'indexes', 'text', 'score')
+
+    def __init__(self, file_name: str, index: int, text: str, score: float):
+        self.file_name = file_name
+        self.indexes = [index]
+        self.text = text
+        self.score = score
+
+    def header(self) -> str:
+        if len(self.indexes) == 1:
+            return f"[Score {self.score:.2f}] From {self.file_name}:"
+        return f"[Score {self.score:.2f}] From {self.file_name} (chunks {self.indexes[0]}-{self.indexes[-1]}):"
+
+
+def _passages(retrieved: Sequence[Tuple[object, float]]) -> List[_Passage]:
+    by_doc: Dict[int, List[Tuple[object, float]]] = {}
+    for chunk, score in retrieved:
+        by_doc.setdefault(chunk.document_id, []).append((chunk, score))
+    passages: List[_Passage] = []
+    for items in by_doc.values():
+        items.sort(key=lambda pair: pair[0].chunk_index)
+        current: Optional[_Passage] = None
+        for chunk, score in items:
+            if current is not None and chunk.chunk_index == current.indexes[-1] + 1:
+                current.text = merge_overlap(current.text, chunk.text)
+                current.indexes.append(chunk.chunk_index)
+                current.score = max(current.score, score)
+                continue
+            if current is not None and chunk.chunk_index == current.indexes[-1]:
+                continue
+            current = _Passage(chunk.document.file_name, chunk.chunk_index, chunk.text, score)
+            passages.append(current)
+    passages.sort(key=lambda p: p.score, reverse=True)
+    return passages
+
+
+def build_context(retrieved: Sequence[Tuple[object, float]], budget: Optional[int] = None) -> Tuple[str, int]:
+    """Pack retrieved ``(chunk, score)`` pairs into at most ``budget`` tokens of prompt context.
+
+    Adjacent chunks of a document are merged with their overlap trimmed; passages are added in
+    score order, the last one truncated to fit when enough room remains. Returns the context text
+    and its token count.
+    """
+    budget = budget or context_budget()
+    used = 0
+    parts: List[str] = []
+    for passage in _passages(retrieved):
+        header = passage.header()
+        # +2 covers the blank line between passages
+        cost = count_tokens(header) + count_tokens(passage.text) + 2
+        if used + cost <= budget:
+            parts.append(f"{header}\n{passage.text}")
+            used += cost
+            continue
+        room = budget - used - count_tokens(header) - 2
+        if room >= 64:
+            parts.append(f"{header}\n{_truncate_to_tokens(passage.text, room)}")
+            used = budget
+            break
+        # Otherwise a shorter, lower-scored passage may still fit
+    return "\n\n".join(parts), used
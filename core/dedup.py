@@ -0,0 +1,240 @@
+"""MinHash fingerprints and LSH banding for near-duplicate chunk detection.
+
+Each chunk gets a ``NUM_PERM``-value MinHash signature over word shingles. The signature is split
+into ``BANDS`` bands; chunks sharing any band key are candidates, and candidates whose estimated
+Jaccard similarity reaches ``DEDUP_THRESHOLD`` are treated as duplicates. With 8 bands of 8 rows,
+pairs above ~0.77 similarity collide with high probability. Duplicates are only matched within one
+project and contractor, since a duplicate is left out of the index that a filtered question searches.
+"""
+import hashlib
+import re
+import zlib
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .lazy import NOT_LOADED, optional_import
+
+np = NOT_LOADED  # numpy is optional (pure-Python fallback below) and imported on first use
+
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MASK32 = (1 << 32) - 1
+_MASK64 = (1 << 64) - 1
+_WORD_RE = re.compile(r'\w+')
+
+
+def _permutations() -> Tuple[List[int], List[int]]:
+    # Fixed seed so signatures stay comparable across processes and releases
+    a: List[int] = []
+    b: List[int] = []
+    for i in range(NUM_PERM):
+        digest = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a.append(int.from_bytes(digest[:8], 'little') % (_MERSENNE_PRIME - 1) + 1)
+        b.append(int.from_bytes(digest[8:], 'little') % _MERSENNE_PRIME)
+    return a, b
+
+
+_PERM_A, _PERM_B = _permutations()
+_np_perms = None
+
+
+def _numpy():
+    global np, _np_perms
+    if np is NOT_LOADED:
+        np = optional_import('numpy')
+    if np is not None and _np_perms is None:
+        _np_perms = (np.array(_PERM_A, dtype=np.uint64), np.array(_PERM_B, dtype=np.uint64))
+    return np
+
+
+def dedup_enabled() -> bool:
+    return bool(getattr(settings, 'DEDUP_ENABLED', True))
+
+
+def dedup_threshold() -> float:
+    return float(getattr(settings, 'DEDUP_THRESHOLD', 0.85))
+
+
+def _shingle_hashes(text: str) -> List[int]:
+    words = _WORD_RE.findall((text or "").lower())
+    if not words:
+        return []
+    if len(words) <= SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return [zlib.crc32(s.encode('utf-8')) for s in shingles]
+
+
+def minhash(text: str) -> Optional[array]:
+    """MinHash signature of ``text`` as ``NUM_PERM`` uint32 values, or None for text without words."""
+    hashes = _shingle_hashes(text)
+    if not hashes:
+        return None
+    if _numpy() is not None:
+        perm_a, perm_b = _np_perms
+        hv = np.array(hashes, dtype=np.uint64)
+        # uint64 wrap-around matches the explicit masking in the pure-Python branch
+        with np.errstate(over='ignore'):
+            phv = (np.outer(perm_a, hv) + perm_b[:, None]) % np.uint64(_MERSENNE_PRIME)
+        mins = (phv & np.uint64(_MASK32)).min(axis=1)
+        return array('I', mins.astype(np.uint32).tobytes())
+    sig = array('I')
+    for a, b in zip(_PERM_A, _PERM_B):
+        sig.append(min(((((a * h) & _MASK64) + b) & _MASK64) % _MERSENNE_PRIME & _MASK32 for h in hashes))
+    return sig
+
+
+def signature_bytes(sig: Optional[array]) -> bytes:
+    return sig.tobytes() if sig is not None else b""
+
+
+def signature_from_bytes(blob: bytes) -> Optional[array]:
+    if not blob or len(blob) != NUM_PERM * 4:
+        return None
+    sig = array('I')
+    sig.frombytes(bytes(blob))
+    return sig
+
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for x, y in zip(a, b) if x == y) / float(NUM_PERM)
+
+
+def band_keys(sig: Sequence[int]) -> List[int]:
+    """One signed 64-bit key per band; the band number is mixed in so keys never collide across bands."""
+    keys = []
+    for band in range(BANDS):
+        rows = array('I', sig[band * ROWS:(band + 1) * ROWS]).tobytes()
+        digest = hashlib.blake2b(bytes([band]) + rows, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def find_duplicates(signatures: Sequence[Optional[array]], project: str = "",
+                    contractor: str = "") -> List[Optional[Tuple[int, bytes]]]:
+    """Look up stored canonical chunks of documents in ``project`` and ``contractor`` that
+    near-duplicate each signature.
+
+    Returns, per input, ``(chunk_id, embedding_bytes)`` of the most similar canonical chunk that
+    has an embedding, or None.
+    """
+    from .embeddings import embedding_model
+    from .models import ChunkBand, DocumentChunk
+
+    results: List[Optional[Tuple[int, bytes]]] = [None] * len(signatures)
+    keys_by_pos: Dict[int, List[int]] = {
+        pos: band_keys(sig) for pos, sig in enumerate(signatures) if sig is not None
+    }
+    if not keys_by_pos:
+        return results
+    all_keys = {k for keys in keys_by_pos.values() for k in keys}
+    chunks_by_key: Dict[int, List[int]] = {}
+    for key, chunk_id in ChunkBand.objects.filter(key__in=all_keys).values_list('key', 'chunk_id'):
+        chunks_by_key.setdefault(key, []).append(chunk_id)
+    candidate_ids = {cid for ids in chunks_by_key.values() for cid in ids}
+    if not candidate_ids:
+        return results
+    # Only reuse vectors from the active embedding model
+    candidates = {
+        c['id']: c for c in DocumentChunk.objects.filter(
+            id__in=candidate_ids, duplicate_of__isnull=True, embedding_model=embedding_model(),
+            document__project=project, document__contractor=contractor,
+        ).exclude(embedding=b"").values('id', 'minhash', 'embedding')
+    }
+    threshold = dedup_threshold()
+    for pos, keys in keys_by_pos.items():
+        best: Optional[Tuple[float, int]] = None
+        for cid in {cid for k in keys for cid in chunks_by_key.get(k, [])}:
+            cand = candidates.get(cid)
+            cand_sig = signature_from_bytes(cand['minhash']) if cand else None
+            if cand_sig is None:
+                continue
+            score = similarity(signatures[pos], cand_sig)
+            if score >= threshold and (best is None or score > best[0]):
+                best = (score, cid)
+        if best is not None:
+            results[pos] = (best[1], bytes(candidates[best[1]]['embedding']))
+    return results
+
+
+def index_chunks(chunks) -> None:
+    """Write LSH band rows for canonical chunks that carry a signature."""
+    from .models import ChunkBand
+
+    rows = []
+    for chunk in chunks:
+        if chunk.duplicate_of_id is not None:
+            continue
+        sig = signature_from_bytes(chunk.minhash)
+        if sig is None:
+            continue
+        rows.extend(ChunkBand(chunk_id=chunk.id, key=key) for key in band_keys(sig))
+    if rows:
+        ChunkBand.objects.bulk_create(rows, batch_size=1000)
+
+
+def collapse_near_duplicates(retrieved: List[tuple]) -> List[tuple]:
+    """Drop retrieved ``(chunk, score)`` pairs that near-duplicate a higher-ranked one."""
+    threshold = dedup_threshold()
+    kept: List[tuple] = []
+    kept_sigs: List[array] = []
+    for chunk, score in retrieved:
+        sig = signature_from_bytes(chunk.minhash)
+        if sig is None:
+            sig = minhash(chunk.text)
+        if sig is not None and any(similarity(sig, other) >= threshold for other in kept_sigs):
+            continue
+        kept.append((chunk, score))
+        if sig is not None:
+            kept_sigs.append(sig)
+    return kept
+
+
+class PendingChunk:
+    """A chunk seen earlier in the current scan; its embedding may still be in flight."""
+
+    __slots__ = ('signature', 'embedding', 'chunk_id')
+
+    def __init__(self, signature: array, embedding):
+        self.signature = signature
+        self.embedding = embedding  # asyncio.Future resolving to float32 bytes (b"" on failure)
+        self.chunk_id: Optional[int] = None  # set once the chunk is stored
+
+
+class ScanDedupIndex:
+    """In-memory LSH over the chunks of one scan, so files processed side by side dedupe too.
+
+    Only used from the scan's event loop thread, so it needs no locking.
+    """
+
+    def __init__(self):
+        self._bands: Dict[int, List[PendingChunk]] = {}
+        self.threshold = dedup_threshold()
+
+    def match_or_add(self, sig: array, make_future) -> Tuple[PendingChunk, bool]:
+        """Return ``(entry, True)`` for a near-duplicate of an earlier chunk, else register ``sig`` as ``(entry, False)``."""
+        keys = band_keys(sig)
+        best: Optional[Tuple[float, PendingChunk]] = None
+        seen = set()
+        for key in keys:
+            for entry in self._bands.get(key, []):
+                if id(entry) in seen:
+                    continue
+                seen.add(id(entry))
+                score = similarity(sig, entry.signature)
+                if score >= self.threshold and (best is None or score > best[0]):
+                    best = (score, entry)
+        if best is not None:
+            return best[1], True
+        entry = PendingChunk(sig, make_future())
+        for key in keys:
+            self._bands.setdefault(key, []).append(entry)
+        return entry, False
@@ -0,0 +1,167 @@
+import asyncio
+import base64
+import math
+import re
+import threading
+import zlib
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .llm import estimate_tokens, get_gateway
+
+
+class EmbeddingBackend:
+    """Turns texts into vectors. ``name`` is stored with every vector the backend produces, so
+    vectors from different backends or models are never compared or indexed together."""
+
+    name = ""
+    # Whether ``embed`` needs an OpenAI client; local backends ignore the client argument
+    needs_client = False
+
+    def embed(self, client, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def aembed(self, client, texts: List[str]) -> List[List[float]]:
+        # CPU-bound by default; keep it off the event loop
+        return await asyncio.to_thread(self.embed, client, texts)
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    needs_client = True
+
+    def __init__(self, model: str):
+        self.name = model
+
+    def embed(self, client, texts: List[str]) -> List[List[float]]:
+        resp = get_gateway().call(client.embeddings, _token_estimate(texts), model=self.name, input=texts)
+        return [list(item.embedding) for item in resp.data]
+
+    async def aembed(self, client, texts: List[str]) -> List[List[float]]:
+        resp = await get_gateway().acall(client.embeddings, _token_estimate(texts), model=self.name, input=texts)
+        return [list(item.embedding) for item in resp.data]
+
+
+_WORD_RE = re.compile(r'\w+')
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """Local CPU embeddings: signed feature hashing of word unigrams and bigrams.
+
+    Terms are weighted by sublinear term frequency (1 + log tf) and the vector is L2-normalized,
+    so cosine similarity behaves like TF-weighted lexical overlap. No model files or network are
+    needed; quality is below a neural model but it is deterministic and fast.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = max(8, int(dim))
+        self.name = f"local-hashing-v1-{self.dim}"
+
+    def _vector(self, text: str) -> List[float]:
+        words = _WORD_RE.findall((text or "").lower())
+        counts: Dict[int, float] = {}
+        features = words + [a + " " + b for a, b in zip(words, words[1:])]
+        for feature in features:
+            h = zlib.crc32(feature.encode('utf-8'))
+            # Low bits pick the bucket, an independent higher bit the sign
+            slot = (h % self.dim) << 1 | (h >> 20) & 1
+            counts[slot] = counts.get(slot, 0.0) + 1.0
+        vec = [0.0] * self.dim
+        for slot, tf in counts.items():
+            weight = 1.0 + math.log(tf)
+            vec[slot >> 1] += -weight if slot & 1 else weight
+        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+        return [x / norm for x in vec]
+
+    def embed(self, client, texts: List[str]) -> List[List[float]]:
+        # Pure-Python hashing holds the GIL, so threads wouldn't speed this up
+        return [self._vector(t) for t in texts]
+
+
+_backend_lock = threading.Lock()
+_backends: Dict[Tuple[Any, ...], EmbeddingBackend] = {}
+
+
+def get_embedding_backend() -> EmbeddingBackend:
+    """Backend selected by ``EMBEDDING_BACKEND`` ("openai" or "hashing"), cached per configuration."""
+    kind = (getattr(settings, 'EMBEDDING_BACKEND', 'openai') or 'openai').lower()
+    if kind == 'hashing':
+        key: Tuple[Any, ...] = (kind, int(getattr(settings, 'EMBEDDING_DIM', 512) or 512))
+    elif kind == 'openai':
+        key = (kind, getattr(settings, 'OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small') or 'text-embedding-3-small')
+    else:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {kind!r}")
+    with _backend_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = HashingEmbeddingBackend(key[1]) if kind == 'hashing' else OpenAIEmbeddingBackend(key[1])
+            _backends[key] = backend
+        return backend
+
+
+def embedding_model() -> str:
+    # Identifier stored with vectors (DocumentChunk.embedding_model) and written to exports
+    return get_embedding_backend().name
+
+
+def _token_estimate(texts: List[str]) -> int:
+    return sum(estimate_tokens(t) for t in texts)
+
+
+def embed_texts(client, texts: List[str]) -> List[List[float]]:
+    if not texts:
+        return []
+    return get_embedding_backend().embed(client, texts)
+
+
+async def aembed_texts(client, texts: List[str]) -> List[List[float]]:
+    if not texts:
+        return []
+    return await get_embedding_backend().aembed(client, texts)
+
+
+def document_embedding_text(file_name: str, project: str, description: str) -> str:
+    # What the document-level vector represents; used at scan time and when backfilling
+    parts = [f"File: {file_name}"]
+    if project:
+        parts.append(f"Project: {project}")
+    if description:
+        parts.append(description)
+    return "\n".join(parts)
+
+
+def bytes_from_vector(vec: List[float]) -> bytes:
+    # Store as float32 bytes
+    return array('f', vec).tobytes()
+
+
+def vector_from_bytes(blob: bytes) -> List[float]:
+    arr = array('f')
+    arr.frombytes(blob)
+    return arr.tolist()
+
+
+def encode_embedding(blob: bytes) -> str:
+    # Portable form for exports: base64 of the raw float32 bytes
+    return base64.b64encode(bytes(blob)).decode('ascii')
+
+
+def decode_embedding(value: Any) -> Optional[bytes]:
+    """Parse an exported embedding (base64 float32 string or list of floats) into stored bytes.
+
+    Returns None when the value is missing or malformed.
+    """
+    if value is None or value == '' or value == []:
+        return None
+    try:
+        if isinstance(value, str):
+            blob = base64.b64decode(value, validate=True)
+            if not blob or len(blob) % 4:
+                return None
+            return blob
+        if isinstance(value, list):
+            return bytes_from_vector([float(x) for x in value])
+    except Exception:
+        return None
+    return None
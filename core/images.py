@@ -0,0 +1,142 @@
+"""Image preparation for vision descriptions.
+
+``prepare_image`` downscales an image to ``IMAGE_MAX_DIMENSION`` and re-encodes it as JPEG before
+it is base64-encoded into the vision request, and keys it by a SHA-256 of the downscaled pixels.
+``ImageDescriptionCache`` keys descriptions by that digest, so images the vision model would see
+identically (the same logo or screenshot saved many times, also in another lossless format or
+with other metadata) are described once: concurrent copies within a scan wait for the first, and
+later scans reuse the stored ``ImageDescription``. A perceptual hash would also match re-encoded
+copies, but it matches pages that merely share a layout too (forms, invoices), so it isn't used.
+
+Pillow is optional. Without it images are uploaded as they are (when the API accepts the format)
+and the cache key is a hash of the file's bytes, which still catches exact copies.
+"""
+import asyncio
+import base64
+import hashlib
+import io
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+try:
+    from PIL import Image, ImageOps  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # Pillow is optional; images are then sent unmodified
+
+from .models import ImageDescription
+
+# Formats the vision API accepts as-is
+UPLOADABLE = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+
+
+class PreparedImage(NamedTuple):
+    data_url: str
+    key: str  # "pixels:<sha256 hex>" or, without Pillow, "sha256:<hex>" of the file
+    original_bytes: int
+
+
+def image_settings():
+    max_dim = int(getattr(settings, 'IMAGE_MAX_DIMENSION', 1024) or 1024)
+    quality = int(getattr(settings, 'IMAGE_JPEG_QUALITY', 80) or 80)
+    return max_dim, quality
+
+
+def pixel_digest(image) -> str:
+    """SHA-256 of an RGB image's size and pixels."""
+    sha = hashlib.sha256(f"{image.width}x{image.height}:".encode('ascii'))
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+
+def _data_url(mime: str, data: bytes) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def _flatten(image):
+    # JPEG has no alpha; composite transparent images onto white so they don't turn black
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        return background
+    return image.convert("RGB")
+
+
+def prepare_image(path: str, mime: str) -> Optional[PreparedImage]:
+    """Downscaled JPEG data URL and cache key for ``path``, or None if it can't be sent."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if Image is None:
+        if mime not in UPLOADABLE:
+            return None
+        return PreparedImage(_data_url(mime, raw), "sha256:" + hashlib.sha256(raw).hexdigest(), len(raw))
+
+    max_dim, quality = image_settings()
+    try:
+        with Image.open(io.BytesIO(raw)) as image:
+            # JPEG can decode straight at a reduced scale, which is much faster for large photos
+            image.draft("RGB", (max_dim, max_dim))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dim, max_dim), Image.LANCZOS)
+            image = _flatten(image)
+            key = f"pixels:{pixel_digest(image)}"
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=quality, optimize=True)
+    except Exception:
+        # Unreadable or unsupported by Pillow; the API may still take the original
+        if mime not in UPLOADABLE:
+            return None
+        return PreparedImage(_data_url(mime, raw), "sha256:" + hashlib.sha256(raw).hexdigest(), len(raw))
+    data = out.getvalue()
+    # Small images can be smaller as they are than re-encoded
+    if mime in UPLOADABLE and len(raw) <= len(data):
+        return PreparedImage(_data_url(mime, raw), key, len(raw))
+    return PreparedImage(_data_url("image/jpeg", data), key, len(raw))
+
+
+def cache_enabled() -> bool:
+    return bool(getattr(settings, 'IMAGE_DESCRIPTION_CACHE', True))
+
+
+def _cached_description(key: str, mode: str) -> Optional[str]:
+    return ImageDescription.objects.filter(image_hash=key, mode=mode).values_list('description', flat=True).first()
+
+
+def _store_description(key: str, mode: str, description: str) -> None:
+    ImageDescription.objects.update_or_create(image_hash=key, mode=mode, defaults={"description": description})
+
+
+class ImageDescriptionCache:
+    """Per-scan coalescing in front of the ``ImageDescription`` table.
+
+    The first file with a given key runs ``describe``; copies seen while it runs await the same
+    future instead of calling the vision API. Only successful descriptions are stored and shared:
+    when the first attempt fails, one of the waiting copies describes its own image.
+    """
+
+    def __init__(self):
+        self._pending: Dict[tuple, asyncio.Future] = {}
+
+    async def get(self, key: str, mode: str, describe: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        slot = (key, mode)
+        while slot in self._pending:
+            shared = await self._pending[slot]
+            if shared:
+                return shared
+        future = asyncio.get_running_loop().create_future()
+        self._pending[slot] = future
+        description = None
+        try:
+            description = await sync_to_async(_cached_description, thread_sensitive=True)(key, mode)
+            if description is None:
+                description = await describe()
+                if description:
+                    await sync_to_async(_store_description, thread_sensitive=True)(key, mode, description)
+            return description
+        finally:
+            future.set_result(description)
+            if not description:
+                # Waiters resume after this, see the slot free and try again
+                del self._pending[slot]
@@ -0,0 +1,359 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .embeddings import (
+    bytes_from_vector,
+    decode_embedding,
+    document_embedding_text,
+    embed_texts,
+    embedding_model,
+    encode_embedding,
+    get_embedding_backend,
+)
+from .models import Document, DocumentChunk
+
+NDJSON_FORMAT = 'ragnetscanner-ndjson'
+NDJSON_VERSION = 1
+
+_DOC_FIELDS = ('file_name', 'file_type', 'contractor', 'project', 'size_bytes', 'modified_at', 'description', 'needs_embedding')
+
+
+def _batch_size() -> int:
+    return max(1, int(getattr(settings, 'IMPORT_BATCH_SIZE', 1000) or 1000))
+
+
+def _embed_batch_size() -> int:
+    return max(1, int(getattr(settings, 'EMBED_BATCH_SIZE', 256) or 256))
+
+
+def iter_ndjson(stream) -> Iterator[Dict[str, Any]]:
+    """Yield one JSON object per non-blank line, reading the stream incrementally."""
+    for lineno, raw in enumerate(stream, start=1):
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        line = raw.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            raise ValueError(f"Invalid JSON on line {lineno}: {exc}") from exc
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {lineno} is not a JSON object")
+        yield record
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except Exception:
+        return None
+
+
+class _Importer:
+    """Accumulates import records and writes them to the database in bulk batches."""
+
+    def __init__(self, client=None, batch_size: Optional[int] = None):
+        self.client = client
+        self.batch_size = batch_size or _batch_size()
+        self.model = embedding_model()
+        self.source_model: Optional[str] = None
+        self.source_dim: Optional[int] = None
+        # Dimension of vectors accepted so far; keeps the stored set homogeneous
+        self.dim: Optional[int] = None
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.pending_chunks = 0
+        self.stats = {
+            "created": 0,
+            "updated": 0,
+            "skipped": 0,
+            "chunks_written": 0,
+            "chunks_embedded": 0,
+            "chunks_reused": 0,
+            "embeddings_rejected": 0,
+        }
+
+    def add(self, record: Dict[str, Any]) -> None:
+        if record.get("type") == "header":
+            self.source_model = record.get("embedding_model") or None
+            try:
+                self.source_dim = int(record["embedding_dim"]) if record.get("embedding_dim") else None
+            except (TypeError, ValueError):
+                self.source_dim = None
+            return
+        fp = record.get("file_path")
+        if not fp:
+            self.stats["skipped"] += 1
+            return
+        previous = self.pending.pop(fp, None)
+        if previous is not None:
+            self.pending_chunks -= len(previous.get("chunks") or [])
+        self.pending[fp] = record
+        self.pending_chunks += len(record.get("chunks") or [])
+        if len(self.pending) >= self.batch_size or self.pending_chunks >= self.batch_size:
+            self.flush()
+
+    def _accept_vector(self, value, model: Optional[str], dim: Optional[int]) -> Optional[bytes]:
+        blob = decode_embedding(value)
+        if blob is None:
+            return None
+        # Vectors are only comparable when produced by the model used for queries
+        if model != self.model:
+            self.stats["embeddings_rejected"] += 1
+            return None
+        size = len(blob) // 4
+        expected = dim or self.dim
+        if expected is not None and size != expected:
+            self.stats["embeddings_rejected"] += 1
+            return None
+        if self.dim is None:
+            self.dim = size
+        return blob
+
+    def _chunk_rows(self, item: Dict[str, Any]) -> List[Dict[str, Any]]:
+        model = item.get("embedding_model") or self.source_model
+        try:
+            dim = int(item["embedding_dim"]) if item.get("embedding_dim") else self.source_dim
+        except (TypeError, ValueError):
+            dim = self.source_dim
+        rows: Dict[int, Dict[str, Any]] = {}
+        for idx, ch in enumerate(item.get("chunks") or []):
+            if not isinstance(ch, dict):
+                continue
+            try:
+                index = int(ch.get("index", idx))
+            except (TypeError, ValueError):
+                index = idx
+            rows[index] = {
+                "index": index,
+                "text": str(ch.get("text", "")),
+                "embedding": self._accept_vector(ch.get("embedding"), model, dim),
+            }
+        return [rows[i] for i in sorted(rows)]
+
+    def _embed_missing(self, rows: List[Dict[str, Any]]) -> None:
+        missing = [r for r in rows if r["embedding"] is None and r["text"].strip()]
+        if not missing or (self.client is None and get_embedding_backend().needs_client):
+            return
+        step = _embed_batch_size()
+        for start in range(0, len(missing), step):
+            part = missing[start:start + step]
+            try:
+                vectors = embed_texts(self.client, [r["text"] for r in part])
+            except Exception:
+                continue
+            for row, vec in zip(part, vectors):
+                if vec:
+                    row["embedding"] = bytes_from_vector(vec)
+                    self.stats["chunks_embedded"] += 1
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        items = self.pending
+        self.pending = {}
+        self.pending_chunks = 0
+
+        chunk_rows = {fp: self._chunk_rows(item) for fp, item in items.items()}
+        all_rows = [row for rows in chunk_rows.values() for row in rows]
+        reused = sum(1 for r in all_rows if r["embedding"] is not None)
+        # Network calls happen outside the transaction so the write lock is held briefly
+        self._embed_missing(all_rows)
+
+        now = timezone.now()
+        fields = {}
+        for fp, it in items.items():
+            fields[fp] = dict(
+                file_name=it.get("file_name", "") or "",
+                file_type=it.get("file_type", "application/octet-stream") or "application/octet-stream",
+                contractor=it.get("contractor", "") or "",
+                project=it.get("project", "") or "",
+                size_bytes=int(it.get("size_bytes", 0) or 0),
+                modified_at=_parse_datetime(it.get("modified_at")),
+                description=it.get("description", "") or "",
+                needs_embedding=any(r["embedding"] is None and r["text"].strip() for r in chunk_rows[fp]),
+            )
+
+        with transaction.atomic():
+            existing = {d.file_path: d for d in Document.objects.filter(file_path__in=list(items))}
+            to_update = []
+            to_create = []
+            for fp, values in fields.items():
+                doc = existing.get(fp)
+                if doc is None:
+                    to_create.append(Document(file_path=fp, **values))
+                    continue
+                for name, value in values.items():
+                    setattr(doc, name, value)
+                doc.updated_at = now
+                to_update.append(doc)
+            if to_update:
+                Document.objects.bulk_update(to_update, list(_DOC_FIELDS) + ['updated_at'], batch_size=500)
+            if to_create:
+                Document.objects.bulk_create(to_create, batch_size=500)
+            doc_ids = dict(Document.objects.filter(file_path__in=list(items)).values_list('file_path', 'id'))
+
+            DocumentChunk.objects.filter(document_id__in=list(doc_ids.values())).delete()
+            new_chunks = [
+                DocumentChunk(
+                    document_id=doc_ids[fp],
+                    chunk_index=row["index"],
+                    text=row["text"],
+                    embedding=row["embedding"] or b"",
+                    embedding_model=self.model if row["embedding"] else "",
+                )
+                for fp, rows in chunk_rows.items()
+                for row in rows
+            ]
+            DocumentChunk.objects.bulk_create(new_chunks, batch_size=500)
+
+        self.stats["created"] += len(to_create)
+        self.stats["updated"] += len(to_update)
+        self.stats["chunks_written"] += len(new_chunks)
+        self.stats["chunks_reused"] += reused
+
+
+class ImportFailed(ValueError):
+    """A record failed to parse; ``stats`` counts what the batches flushed before it wrote."""
+
+    def __init__(self, message: str, stats: Dict[str, int]):
+        super().__init__(message)
+        self.stats = stats
+
+
+def import_records(records: Iterable[Dict[str, Any]], client=None, batch_size: Optional[int] = None) -> Dict[str, int]:
+    """Import exported document records, reusing supplied embeddings where the model and dimension match.
+
+    Records are written in bulk batches; only chunks without a usable vector are sent to the
+    embedding API (and only when ``client`` is given). If a record fails to parse, the batch being
+    built is dropped and ``ImportFailed`` is raised; batches already flushed stay committed.
+    """
+    importer = _Importer(client=client, batch_size=batch_size)
+    try:
+        for record in records:
+            importer.add(record)
+    except ValueError as exc:
+        raise ImportFailed(str(exc), dict(importer.stats)) from exc
+    importer.flush()
+    return importer.stats
+
+
+def _stored_dimension() -> Optional[int]:
+    blob = (DocumentChunk.objects.filter(embedding_model=embedding_model()).exclude(embedding=b"")
+            .values_list('embedding', flat=True).first())
+    return len(blob) // 4 if blob else None
+
+
+def iter_export_ndjson(include_embeddings: bool = True, batch_size: Optional[int] = None) -> Iterator[str]:
+    """Yield the database as NDJSON lines: a header, then one document (with chunks) per line."""
+    header = {"type": "header", "format": NDJSON_FORMAT, "version": NDJSON_VERSION}
+    if include_embeddings:
+        header["embedding_model"] = embedding_model()
+        header["embedding_dim"] = _stored_dimension()
+    yield json.dumps(header) + "\n"
+
+    step = batch_size or _batch_size()
+    model = embedding_model()
+    doc_ids = list(Document.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(doc_ids), step):
+        ids = doc_ids[start:start + step]
+        chunk_fields = ['document_id', 'chunk_index', 'text'] + (['embedding', 'embedding_model'] if include_embeddings else [])
+        by_doc: Dict[int, List[Dict[str, Any]]] = {}
+        for ch in DocumentChunk.objects.filter(document_id__in=ids).order_by('document_id', 'chunk_index').values(*chunk_fields):
+            entry = {"index": ch["chunk_index"], "text": ch["text"]}
+            # The header names one model; vectors from any other are left for the importer to re-embed
+            if include_embeddings and ch["embedding"] and ch["embedding_model"] == model:
+                entry["embedding"] = encode_embedding(ch["embedding"])
+            by_doc.setdefault(ch["document_id"], []).append(entry)
+        for d in Document.objects.filter(id__in=ids).order_by('id'):
+            item = {
+                "file_path": d.file_path,
+                "file_name": d.file_name,
+                "file_type": d.file_type,
+                "contractor": d.contractor,
+                "project": d.project,
+                "size_bytes": d.size_bytes,
+                "modified_at": d.modified_at.isoformat() if d.modified_at else None,
+                "description": d.description,
+                "chunks": by_doc.get(d.id, []),
+            }
+            yield json.dumps(item) + "\n"
+
+
+def _stale_chunks(model: str) -> Q:
+    # Chunks without a vector, or with one from a different embedding model
+    return Q(embedding=b"") | ~Q(embedding_model=model)
+
+
+def flag_stale_embeddings() -> int:
+    """Flag documents whose chunks carry vectors from another embedding model (e.g. after switching
+    ``EMBEDDING_BACKEND``) so ``reembed_pending`` replaces them. Returns the number flagged."""
+    model = embedding_model()
+    stale = (DocumentChunk.objects.exclude(embedding=b"").exclude(embedding_model=model)
+             .values_list('document_id', flat=True).distinct())
+    return Document.objects.filter(id__in=stale, needs_embedding=False).update(needs_embedding=True)
+
+
+def reembed_pending(client, batch_size: Optional[int] = None) -> Dict[str, int]:
+    """Embed chunks stored without vectors, or with another model's vectors, for documents flagged
+    ``needs_embedding``.
+
+    A document's flag is cleared once all of its non-empty chunks have current vectors; failures
+    leave it set so the next run picks it up again.
+    """
+    step = batch_size or _embed_batch_size()
+    model = embedding_model()
+    stats = {"documents": 0, "chunks_embedded": 0, "chunks_failed": 0}
+    doc_ids = list(Document.objects.filter(needs_embedding=True).values_list('id', flat=True))
+    for doc_id in doc_ids:
+        pending = DocumentChunk.objects.filter(_stale_chunks(model), document_id=doc_id).only('id', 'text')
+        chunks = [c for c in pending if c.text.strip()]
+        failed = 0
+        for start in range(0, len(chunks), step):
+            part = chunks[start:start + step]
+            try:
+                vectors = embed_texts(client, [c.text for c in part])
+            except Exception:
+                failed += len(part)
+                continue
+            for chunk, vec in zip(part, vectors):
+                chunk.embedding = bytes_from_vector(vec)
+                chunk.embedding_model = model
+            DocumentChunk.objects.bulk_update(part, ['embedding', 'embedding_model'])
+            stats["chunks_embedded"] += len(part)
+        stats["chunks_failed"] += failed
+        if not failed:
+            Document.objects.filter(id=doc_id).update(needs_embedding=False)
+            stats["documents"] += 1
+    return stats
+
+
+def embed_document_descriptions(client, batch_size: Optional[int] = None) -> int:
+    """Backfill ``description_embedding`` for documents that have a description but no current vector."""
+    step = batch_size or _embed_batch_size()
+    model = embedding_model()
+    done = 0
+    while True:
+        docs = list(
+            Document.objects.filter(Q(description_embedding=b"") | ~Q(description_embedding_model=model))
+            .exclude(description="").only('id', 'file_name', 'project', 'description')[:step]
+        )
+        if not docs:
+            return done
+        try:
+            vectors = embed_texts(client, [document_embedding_text(d.file_name, d.project, d.description) for d in docs])
+        except Exception:
+            return done
+        for doc, vec in zip(docs, vectors):
+            doc.description_embedding = bytes_from_vector(vec)
+            doc.description_embedding_model = model
+        Document.objects.bulk_update(docs, ['description_embedding', 'description_embedding_model'])
+        done += len(docs)
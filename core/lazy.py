@@ -0,0 +1,37 @@
+"""Deferred imports of heavy dependencies.
+
+numpy, faiss, the OpenAI SDK, pypdf and tiktoken together take over a second to
+import. Modules only import them where they are used (or, for optional ones, keep ``NOT_LOADED``
+in the module global and call ``optional_import`` on first use), so ``manage.py`` commands, test
+runs and worker boots that never touch them don't pay for them. ``core.warmup`` imports them
+ahead of the first request in serving processes.
+"""
+import importlib
+import threading
+from typing import Any, Dict
+
+# Modules kept out of process startup; see tests and ``bench_startup``
+HEAVY_MODULES = ("openai", "httpx", "numpy", "faiss", "pypdf", "tiktoken")
+
+
+class _NotLoaded:
+    def __repr__(self) -> str:
+        return "NOT_LOADED"
+
+
+NOT_LOADED: Any = _NotLoaded()
+
+_lock = threading.Lock()
+_failed: Dict[str, bool] = {}
+
+
+def optional_import(name: str):
+    """The module ``name``, or None when it isn't installed (remembered, so it is only tried once)."""
+    if _failed.get(name):
+        return None
+    try:
+        return importlib.import_module(name)
+    except Exception:
+        with _lock:
+            _failed[name] = True
+        return None
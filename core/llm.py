@@ -0,0 +1,420 @@
+import asyncio
+import random
+import re
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from .metrics import record_tokens
+
+if TYPE_CHECKING:  # the SDK (and httpx) are imported when the first client is created; see core.lazy
+    import httpx
+    from openai import AsyncOpenAI, OpenAI
+
+_lock = threading.Lock()
+_client: "Optional[OpenAI]" = None
+# httpx async pools are bound to the event loop that opened them, so keep one client per loop,
+# together with the generator that closes it when the loop shuts down
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[AsyncOpenAI, AsyncIterator[None]]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def _limits() -> "httpx.Limits":
+    import httpx
+    return httpx.Limits(
+        max_connections=int(getattr(settings, 'OPENAI_MAX_CONNECTIONS', 100) or 100),
+        max_keepalive_connections=int(getattr(settings, 'OPENAI_KEEPALIVE_CONNECTIONS', 20) or 20),
+        keepalive_expiry=30.0,
+    )
+
+
+def _timeout() -> float:
+    return float(getattr(settings, 'OPENAI_TIMEOUT', 60) or 60)
+
+
+def _base_url() -> Optional[str]:
+    # Points the SDK at a proxy or at the benchmark's fake server; None means api.openai.com
+    return getattr(settings, 'OPENAI_BASE_URL', None) or None
+
+
+def get_client() -> "OpenAI":
+    """Process-wide OpenAI client sharing one keep-alive connection pool."""
+    global _client
+    with _lock:
+        if _client is None:
+            import httpx
+            from openai import OpenAI
+            _client = OpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=_base_url(),
+                timeout=_timeout(),
+                # Retries are handled by the gateway so they respect the shared rate limits
+                max_retries=0,
+                http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+            )
+        return _client
+
+
+async def _close_with_loop(client: "AsyncOpenAI") -> AsyncIterator[None]:
+    # Parked at its yield, the loop tracks this generator: shutdown_asyncgens(), which asyncio.run
+    # (and so asgiref's async_to_sync under WSGI) calls before closing a loop, finalizes it and
+    # closes the client's connections on the loop that opened them
+    try:
+        yield
+    finally:
+        loop = asyncio.get_running_loop()
+        with _lock:
+            entry = _async_clients.get(loop)
+            if entry is not None and entry[0] is client:
+                del _async_clients[loop]
+        await client.close()
+
+
+def get_async_client() -> "AsyncOpenAI":
+    """AsyncOpenAI client for the running event loop, reused across requests on that loop.
+
+    Long-lived loops (ASGI servers) keep one pool; short-lived ones (async views under WSGI,
+    ``async_to_sync`` scans) close their client when the loop shuts down.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entry = _async_clients.get(loop)
+        if entry is None:
+            import httpx
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=_base_url(),
+                timeout=_timeout(),
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+            )
+            closer = _close_with_loop(client)
+            # Start it without awaiting: nothing before the yield suspends
+            try:
+                closer.asend(None).send(None)
+            except StopIteration:
+                pass
+            entry = _async_clients[loop] = (client, closer)
+        return entry[0]
+
+
+def reset_clients() -> None:
+    # Drop cached clients and limiter state, e.g. after the API key or limits change in tests
+    global _client, _gateway
+    with _lock:
+        _client = None
+        _gateway = None
+        _async_clients.clear()
+
+
+# Gateway: every OpenAI call goes through one process-wide limiter so concurrent scans,
+# imports and questions share the provider's request/token budget instead of tripping 429s.
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return len(text or "") // 4 + 1
+
+
+def estimate_chat_tokens(kwargs: Dict[str, Any]) -> int:
+    total = int(kwargs.get("max_tokens") or 0)
+    for message in kwargs.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                # Image inputs are billed by tile; budget a fixed amount per image
+                total += estimate_tokens(part.get("text", "")) if part.get("type") == "text" else 1000
+    return total
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset/retry durations such as "20ms", "1.5s" or "6m0s" into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'([\d.]+)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(num) * scale[unit] for num, unit in parts)
+
+
+class TokenBucket:
+    """Thread-safe token bucket. ``reserve`` books capacity and returns how long to wait for it."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def configure(self, rate: float, capacity: float) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(rate, 1e-6)
+            self.capacity = max(capacity, 1.0)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def reserve(self, amount: float) -> float:
+        # Going into debt lets large requests through once the bucket has refilled for them
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class LLMGateway:
+    """Rate-limited, retrying front for OpenAI resources (``client.embeddings``, ``client.chat.completions``).
+
+    Requests and tokens are metered by token buckets sized from settings and re-sized from the
+    ``x-ratelimit-*`` response headers. Concurrency backs off on 429s and recovers additively while
+    headroom remains. Retryable failures (429, 5xx, timeouts, connection errors) are retried with
+    full-jitter exponential backoff, honouring ``Retry-After``.
+    """
+
+    def __init__(self, rpm: int, tpm: int, max_concurrency: int, max_retries: int,
+                 base_delay: float = 0.5, max_delay: float = 30.0):
+        self.requests = TokenBucket(rpm / 60.0, max(1.0, rpm / 6.0))
+        self.tokens = TokenBucket(tpm / 60.0, max(1.0, tpm / 6.0))
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = float(self.max_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        # Callers waiting for a concurrency slot: threads on _slots, coroutines on their loop's condition
+        self._slots = threading.Condition(self._lock)
+        self._loop_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Condition]" = \
+            weakref.WeakKeyDictionary()
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _admission_delay(self, tokens: int) -> float:
+        pause = max(0.0, self._paused_until - time.monotonic())
+        return max(pause, self.requests.reserve(1), self.tokens.reserve(tokens))
+
+    def _has_slot(self) -> bool:
+        return self._in_flight < max(1, int(self.concurrency))
+
+    def _try_enter(self) -> bool:
+        with self._lock:
+            if not self._has_slot():
+                return False
+            self._in_flight += 1
+            return True
+
+    def _enter(self) -> None:
+        with self._slots:
+            self._slots.wait_for(self._has_slot)
+            self._in_flight += 1
+
+    async def _aenter(self) -> None:
+        if self._try_enter():
+            return
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            slots = self._loop_slots.get(loop)
+            if slots is None:
+                slots = self._loop_slots[loop] = asyncio.Condition()
+        async with slots:
+            await slots.wait_for(self._try_enter)
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._wake()
+
+    def _wake(self) -> None:
+        # Called with _lock held whenever a slot frees up or the concurrency limit changes
+        self._slots.notify_all()
+        for loop, slots in list(self._loop_slots.items()):
+            awake = self._awake(slots)
+            try:
+                asyncio.run_coroutine_threadsafe(awake, loop)
+            except RuntimeError:
+                # The loop is closed; nothing is waiting on it any more
+                awake.close()
+                del self._loop_slots[loop]
+
+    @staticmethod
+    async def _awake(slots: asyncio.Condition) -> None:
+        async with slots:
+            slots.notify_all()
+
+    def _is_retryable(self, exc: Exception) -> bool:
+        import openai
+        if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        if isinstance(exc, openai.APIStatusError):
+            return exc.status_code in _RETRYABLE_STATUS
+        return False
+
+    def _backoff(self, attempt: int, exc: Exception) -> float:
+        delay = None
+        response = getattr(exc, "response", None)
+        if response is not None:
+            headers = response.headers
+            retry_ms = headers.get("retry-after-ms")
+            delay = float(retry_ms) / 1000.0 if retry_ms else _parse_duration(headers.get("retry-after"))
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        return min(delay, self.max_delay)
+
+    def _on_rate_limited(self, delay: float) -> None:
+        with self._lock:
+            self.stats["rate_limited"] += 1
+            self.concurrency = max(1.0, self.concurrency / 2)
+            # Hold back every caller, not just the one that was rejected
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._wake()
+
+    def _observe(self, headers) -> None:
+        if headers is None:
+            return
+
+        def _int(name: str) -> Optional[int]:
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        limit_requests = _int("x-ratelimit-limit-requests")
+        limit_tokens = _int("x-ratelimit-limit-tokens")
+        remaining_requests = _int("x-ratelimit-remaining-requests")
+        remaining_tokens = _int("x-ratelimit-remaining-tokens")
+        # Provider limits are per minute; allow ~10 seconds of burst
+        if limit_requests:
+            self.requests.configure(limit_requests / 60.0, max(1.0, limit_requests / 6.0))
+        if limit_tokens:
+            self.tokens.configure(limit_tokens / 60.0, max(1.0, limit_tokens / 6.0))
+
+        headroom = []
+        if limit_requests and remaining_requests is not None:
+            headroom.append(remaining_requests / limit_requests)
+        if limit_tokens and remaining_tokens is not None:
+            headroom.append(remaining_tokens / limit_tokens)
+        if not headroom:
+            return
+        with self._lock:
+            if min(headroom) < 0.05:
+                self.concurrency = max(1.0, self.concurrency * 0.75)
+            elif min(headroom) > 0.2:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1)
+            else:
+                return
+            self._wake()
+
+    def _finish(self, response, raw: bool, tokens: int):
+        if raw:
+            self._observe(response.headers)
+            response = response.parse()
+        # Billed usage when the API reports it, else the admission estimate
+        usage = getattr(response, "usage", None)
+        record_tokens(getattr(usage, "total_tokens", None) or tokens)
+        return response
+
+    def _invoke(self, resource, kwargs: Dict[str, Any]):
+        # Raw responses expose the rate-limit headers; test doubles may only offer create()
+        raw = getattr(resource, "with_raw_response", None)
+        if raw is None:
+            return resource.create(**kwargs), False
+        return raw.create(**kwargs), True
+
+    async def acall(self, resource, tokens: int, **kwargs):
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._admission_delay(tokens))
+            await self._aenter()
+            try:
+                self._count("requests")
+                pending, raw = self._invoke(resource, kwargs)
+                return self._finish(await pending, raw, tokens)
+            except Exception as exc:
+                if not self._is_retryable(exc) or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(attempt, exc)
+                if getattr(exc, "status_code", None) == 429:
+                    self._on_rate_limited(delay)
+            finally:
+                self._leave()
+            self._count("retries")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def call(self, resource, tokens: int, **kwargs):
+        attempt = 0
+        while True:
+            time.sleep(self._admission_delay(tokens))
+            self._enter()
+            try:
+                self._count("requests")
+                response, raw = self._invoke(resource, kwargs)
+                return self._finish(response, raw, tokens)
+            except Exception as exc:
+                if not self._is_retryable(exc) or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(attempt, exc)
+                if getattr(exc, "status_code", None) == 429:
+                    self._on_rate_limited(delay)
+            finally:
+                self._leave()
+            self._count("retries")
+            attempt += 1
+            time.sleep(delay)
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_gateway() -> LLMGateway:
+    global _gateway
+    with _lock:
+        if _gateway is None:
+            _gateway = LLMGateway(
+                rpm=int(getattr(settings, 'OPENAI_RPM_LIMIT', 500) or 500),
+                tpm=int(getattr(settings, 'OPENAI_TPM_LIMIT', 200000) or 200000),
+                max_concurrency=int(getattr(settings, 'OPENAI_MAX_CONCURRENCY', 32) or 32),
+                max_retries=int(getattr(settings, 'OPENAI_MAX_RETRIES', 6)),
+            )
+        return _gateway
+
+
+def gateway_stats() -> Optional[Dict[str, int]]:
+    # Counters of the process gateway, or None if no call has created it yet
+    gateway = _gateway
+    if gateway is None:
+        return None
+    with gateway._lock:
+        return dict(gateway.stats)
+
+
+async def achat(client, **kwargs):
+    return await get_gateway().acall(client.chat.completions, estimate_chat_tokens(kwargs), **kwargs)
+
+
+def chat(client, **kwargs):
+    return get_gateway().call(client.chat.completions, estimate_chat_tokens(kwargs), **kwargs)
@@ -0,0 +1,87 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.bench import compare_results, run_benchmarks
+
+
+def _sizes(value: str):
+    try:
+        return [int(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise CommandError(f"Invalid --sizes value: {value!r}")
+
+
+class Command(BaseCommand):
+    help = ("Benchmark startup time, scan throughput, index rebuilds and /api/ask/ latency against a local fake OpenAI "
+            "server, on a throwaway database. No API key or network access is needed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='bench_output.json', help="Where to write the JSON results")
+        parser.add_argument('--files', type=int, default=200, help="Files in the synthetic scan tree")
+        parser.add_argument('--sizes', type=_sizes, default=[10_000, 100_000, 1_000_000],
+                            help="Comma-separated chunk counts for the index/ask runs")
+        parser.add_argument('--questions', type=int, default=50, help="Questions asked at each size")
+        parser.add_argument('--dim', type=int, default=256, help="Embedding dimension served by the fake API")
+        parser.add_argument('--latency-ms', type=float, default=50.0, help="Fake API latency per request")
+        parser.add_argument('--jitter-ms', type=float, default=20.0, help="Extra uniform random latency")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of fake API requests that fail (429/500)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--backend', choices=['openai', 'hashing'], default='openai',
+                            help="Embedding backend; 'hashing' embeds locally and only chat goes to the fake server")
+        parser.add_argument('--workdir', help="Keep the generated tree and index here instead of a temp dir")
+        parser.add_argument('--baseline', help="Earlier results file; exit non-zero if a tracked metric regressed")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression against --baseline")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        # Same mechanism as the test runner: a separate database that is dropped afterwards
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and options['workdir']:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = f"{options['workdir'].rstrip('/')}/bench.sqlite3"
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run_benchmarks(
+                workdir=options['workdir'],
+                files=options['files'],
+                sizes=options['sizes'],
+                questions=options['questions'],
+                dim=options['dim'],
+                latency_ms=options['latency_ms'],
+                jitter_ms=options['jitter_ms'],
+                error_rate=options['error_rate'],
+                seed=options['seed'],
+                backend=options['backend'],
+                log=lambda message: self.stdout.write(message),
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+        for result in results["results"]:
+            if result["name"] == "startup":
+                self.stdout.write(f"startup: p50 {result['p50_ms']}ms, min {result['min_ms']}ms"
+                                  + (f" (imports {', '.join(result['heavy_imports'])})" if result['heavy_imports'] else ""))
+            elif result["name"] == "scan":
+                self.stdout.write(f"scan: {result['files']} files, {result['files_per_sec']} files/s, "
+                                  f"{result['chunks_per_sec']} chunks/s, {result['vision_calls']} vision calls "
+                                  f"for {result['images']} images")
+            elif result["name"] == "rebuild_index":
+                self.stdout.write(f"rebuild_index@{result['chunks']}: {result['seconds']}s")
+            else:
+                self.stdout.write(f"ask@{result['chunks']}: first {result['first_ms']}ms, p50 {result['p50_ms']}ms, "
+                                  f"p99 {result['p99_ms']}ms")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
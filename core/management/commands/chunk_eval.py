@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.chunkeval import default_candidates, run_evaluation
+from core.embeddings import get_embedding_backend
+
+
+def _scales(value: str):
+    try:
+        return [float(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise CommandError(f"Invalid --scales value: {value!r}")
+
+
+class Command(BaseCommand):
+    help = ("Compare chunking settings on a sample of a directory: chunk counts, tokens and retrieval recall "
+            "of synthetic questions for the legacy splitter, the current CHUNK_PROFILES, scaled sizes and "
+            "each --profile. Prints the cheapest setting that keeps recall.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory to sample files from")
+        parser.add_argument('--files', type=int, default=200, help="Files to sample")
+        parser.add_argument('--queries', type=int, default=200, help="Synthetic questions")
+        parser.add_argument('--k', type=int, default=5, help="Chunks retrieved per question")
+        parser.add_argument('--profile', action='append', default=[],
+                            help="Candidate CHUNK_PROFILES string, e.g. 'pdf=600:0,text=300:30' (repeatable)")
+        parser.add_argument('--scales', type=_scales, default=[0.5, 1.5, 2.0],
+                            help="Comma-separated factors applied to the current chunk sizes")
+        parser.add_argument('--tolerance', type=float, default=0.01,
+                            help="Passage recall a recommendation may lose against the best candidate")
+        parser.add_argument('--backend', choices=['hashing', 'active'], default='hashing',
+                            help="'hashing' embeds locally; 'active' uses EMBEDDING_BACKEND (may call the API)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Also write the results as JSON here")
+
+    def handle(self, *args, **options):
+        try:
+            candidates = default_candidates(options['scales'], options['profile'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        backend = client = None
+        if options['backend'] == 'active':
+            backend = get_embedding_backend()
+            if backend.needs_client:
+                from core.llm import get_client
+                client = get_client()
+        report = run_evaluation(options['directory'], candidates, max_files=options['files'],
+                                queries=options['queries'], k=options['k'], seed=options['seed'],
+                                backend=backend, client=client, tolerance=options['tolerance'])
+        if not report["files"]:
+            raise CommandError(f"No readable files under {options['directory']}")
+
+        self.stdout.write(f"{report['files']} files, {report['queries']} questions, top {report['k']} "
+                          f"({report['embedding_model']})")
+        self.stdout.write(f"{'candidate':<12} {'chunks':>8} {'tokens':>10} {'doc@k':>7} {'passage@k':>10} {'mrr':>6}  profiles")
+        for r in report["results"]:
+            self.stdout.write(f"{r['name'][:12]:<12} {r['chunks']:>8} {r['tokens']:>10} {r['doc_recall']:>7.3f} "
+                              f"{r['passage_recall']:>10.3f} {r['mrr']:>6.3f}  {r['profiles']}")
+        if report["recommended"]:
+            self.stdout.write(self.style.SUCCESS(f"Recommended: {report['recommended']} "
+                                                 f"(CHUNK_PROFILES={report['recommended_profiles']})"))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.vectorstore import available, list_shards, rebuild_index_from_db, shard_by, shard_for
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the FAISS chunk and document indexes from the database: every shard, or only the "
+            "shard of --project/--contractor. Needed after changing VECTOR_SHARD_BY.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', help="Only rebuild this project's shard")
+        parser.add_argument('--contractor', help="Only rebuild this contractor's shard")
+
+    def handle(self, *args, **options):
+        if not available():
+            raise CommandError("faiss and numpy are required")
+        shards = None
+        if options['project'] is not None or options['contractor'] is not None:
+            shards = [shard_for(options['project'] or "", options['contractor'] or "")]
+        rebuild_index_from_db(shards)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {'all shards' if shards is None else shards[0]} (sharded by {shard_by()}); "
+            f"{len(list_shards())} chunk index shards on disk"
+        ))
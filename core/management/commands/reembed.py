@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.embeddings import get_embedding_backend
+from core.ingest import embed_document_descriptions, flag_stale_embeddings, reembed_pending
+from core.llm import get_client
+from core.vectorstore import rebuild_index_from_db
+
+
+class Command(BaseCommand):
+    help = ("Embed chunks that were stored without vectors (documents flagged needs_embedding) or with "
+            "another embedding model's vectors, and document descriptions likewise, then rebuild the indexes.")
+
+    def handle(self, *args, **options):
+        needs_client = get_embedding_backend().needs_client
+        if needs_client and not settings.OPENAI_API_KEY:
+            raise CommandError("OPENAI_API_KEY is not set")
+        client = get_client() if needs_client else None
+        stale = flag_stale_embeddings()
+        if stale:
+            self.stdout.write(f"{stale} documents have vectors from another embedding model")
+        stats = reembed_pending(client)
+        documents = embed_document_descriptions(client)
+        if stats["chunks_embedded"] or documents:
+            try:
+                rebuild_index_from_db()
+            except Exception:
+                pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-embedded {stats['chunks_embedded']} chunks; {stats['documents']} documents complete, "
+            f"{stats['chunks_failed']} chunks still failing; {documents} document descriptions embedded"
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.snapshot import SnapshotError, restore_snapshot
+
+
+class Command(BaseCommand):
+    help = "Replace all documents, chunks and the FAISS index with the contents of a snapshot archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Archive written by `manage.py snapshot`")
+        parser.add_argument('--no-verify', action='store_true', help="Skip checksum verification before restoring")
+
+    def handle(self, *args, **options):
+        try:
+            manifest = restore_snapshot(options['path'], verify=not options['no_verify'])
+        except (SnapshotError, OSError) as e:
+            raise CommandError(str(e))
+        counts = manifest["counts"]
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {counts['documents']} documents and {counts['chunks']} chunks from {options['path']}"
+        ))
@@ -0,0 +1,65 @@
+import os
+import signal
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.scanrun import execute_run, start_run
+
+
+def _cutoff(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid --cutoff value: {value!r}")
+
+
+class Command(BaseCommand):
+    help = ("Scan a directory tree like /api/scan/, sharded across worker processes. Progress is checkpointed "
+            "per file and per shard; running the same command again after an interruption resumes the scan.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--contractor', default="")
+        parser.add_argument('--project', default="")
+        parser.add_argument('--mode', choices=['concise', 'detailed', 'creative'], default='concise')
+        parser.add_argument('--cutoff', type=_cutoff, help="Only files modified at or after this ISO 8601 time")
+        parser.add_argument('--workers', type=int, help="Worker processes (default: SCAN_WORKERS)")
+        parser.add_argument('--shard-size', type=int, help="Files per shard (default: SCAN_SHARD_FILES)")
+        parser.add_argument('--restart', action='store_true', help="Discard an unfinished scan of this directory and start over")
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not os.path.isdir(directory):
+            raise CommandError(f"Not a directory: {directory}")
+        if not settings.OPENAI_API_KEY:
+            raise CommandError("OPENAI_API_KEY is not set")
+        workers = options['workers'] or int(getattr(settings, 'SCAN_WORKERS', 1) or 1)
+        shard_size = options['shard_size'] or int(getattr(settings, 'SCAN_SHARD_FILES', 256) or 256)
+
+        run, resumed = start_run(directory, contractor=options['contractor'], project=options['project'],
+                                 mode=options['mode'], cutoff=options['cutoff'], restart=options['restart'])
+        if resumed:
+            done = run.shards.filter(status='done').count()
+            self.stdout.write(f"Resuming the scan started {run.started_at:%Y-%m-%d %H:%M} ({done} shards done); "
+                              f"its contractor/project/mode are kept. Use --restart to start over.")
+
+        # SIGTERM (deploys, process managers) stops like Ctrl-C; the checkpoint is already on disk
+        def interrupt(signum, frame):
+            raise KeyboardInterrupt
+        previous = signal.signal(signal.SIGTERM, interrupt)
+        try:
+            totals = execute_run(run, workers=workers, shard_size=shard_size,
+                                 log=lambda message: self.stdout.write(message))
+        except KeyboardInterrupt:
+            raise CommandError("Interrupted; run the same command again to resume")
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+        summary = (f"Processed {totals['processed']} files ({totals['created']} new, {totals['updated']} updated, "
+                   f"{totals['chunks_added']} chunks, {totals['chunks_deduplicated']} deduplicated); "
+                   f"{totals['skipped']} already done, {totals['embedding_failures']} with embedding failures")
+        if totals['failed_shards']:
+            raise CommandError(f"{summary}. {totals['failed_shards']} shards failed; run the command again to retry them")
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.snapshot import create_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write documents, chunks, embeddings and the FAISS index to a compressed snapshot archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Destination archive, e.g. backup.ragsnap")
+
+    def handle(self, *args, **options):
+        manifest = create_snapshot(options['path'])
+        counts = manifest["counts"]
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['path']}: {counts['documents']} documents, {counts['chunks']} chunks, "
+            f"{counts['embeddings']} embeddings, index={'yes' if manifest['has_index'] else 'no'}"
+        ))
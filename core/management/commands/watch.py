@@ -0,0 +1,87 @@
+import os
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from core.watch import RESCAN, Debouncer, apply_changes, create_watchers, reconcile, wait_for_changes
+
+
+class Command(BaseCommand):
+    help = ("Watch directories and keep the database in step: created, modified and moved-in files are "
+            "scanned like /api/scan/, deleted or moved-out files lose their documents, chunks and index entries. "
+            "Uses inotify on local filesystems and polling on network mounts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('roots', nargs='*', help="Directories to watch (default: WATCH_ROOTS)")
+        parser.add_argument('--contractor', default="", help="Contractor stored on ingested documents")
+        parser.add_argument('--project', default="", help="Project stored on ingested documents")
+        parser.add_argument('--mode', choices=['concise', 'detailed', 'creative'], default='concise',
+                            help="Description style, as for /api/scan/")
+        parser.add_argument('--debounce', type=float, help="Quiet seconds before a burst is ingested (default: WATCH_DEBOUNCE_SECONDS)")
+        parser.add_argument('--poll', action='store_true', help="Poll every root instead of using inotify")
+        parser.add_argument('--poll-interval', type=float, help="Seconds between polls (default: WATCH_POLL_INTERVAL)")
+        parser.add_argument('--catch-up', action='store_true',
+                            help="First reconcile the roots with the database (changes made while not watching)")
+
+    def handle(self, *args, **options):
+        roots = [os.path.abspath(r) for r in (options['roots'] or getattr(settings, 'WATCH_ROOTS', []))]
+        if not roots:
+            raise CommandError("No directories to watch; pass them as arguments or set WATCH_ROOTS")
+        missing = [r for r in roots if not os.path.isdir(r)]
+        if missing:
+            raise CommandError(f"Not a directory: {', '.join(missing)}")
+        if not settings.OPENAI_API_KEY:
+            raise CommandError("OPENAI_API_KEY is not set")
+
+        debounce = options['debounce'] if options['debounce'] is not None else float(getattr(settings, 'WATCH_DEBOUNCE_SECONDS', 2.0))
+        debouncer = Debouncer(debounce)
+        ingest = dict(contractor=options['contractor'], project=options['project'], mode=options['mode'])
+
+        stopping = []
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        watchers = create_watchers(roots, force_poll=options['poll'], interval=options['poll_interval'],
+                                   log=lambda message: self.stdout.write(message))
+        try:
+            if options['catch_up']:
+                for root in roots:
+                    self._apply(reconcile(root), ingest)
+            self.stdout.write(f"Watching {', '.join(roots)}")
+            while not stopping:
+                timeout = debouncer.timeout()
+                for kind, path in wait_for_changes(watchers, 1.0 if timeout is None else min(timeout, 1.0)):
+                    if kind == RESCAN:
+                        self.stdout.write(f"Events were lost; reconciling {path}")
+                        for changed, change_kind in reconcile(path).items():
+                            debouncer.add(change_kind, changed)
+                    else:
+                        debouncer.add(kind, path)
+                if debouncer.ready():
+                    self._apply(debouncer.drain(), ingest)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for watcher in watchers:
+                watcher.close()
+            signal.signal(signal.SIGTERM, previous)
+        # Don't drop changes that were waiting for the quiet period
+        if debouncer.pending:
+            self._apply(debouncer.drain(), ingest)
+        self.stdout.write("Stopped watching")
+
+    def _apply(self, changes, ingest):
+        # Long-running: drop connections the database closed while we were idle
+        close_old_connections()
+        try:
+            result = apply_changes(changes, **ingest)
+        except Exception as e:
+            # Keep watching; `--catch-up` on the next start re-applies anything lost here
+            self.stderr.write(f"Failed to apply {len(changes)} changes: {e}")
+            return
+        if result["processed"] or result["deleted"]:
+            self.stdout.write(
+                f"Ingested {result['processed']} files ({result['created']} new, {result['chunks_added']} chunks), "
+                f"removed {result['deleted']} documents, skipped {result['skipped']} unchanged "
+                f"in {result['timings']['total_seconds']}s"
+            )
@@ -0,0 +1,246 @@
+"""Lightweight per-stage timing for scans and questions.
+
+``timed(stage)`` measures a block and records its latency (plus any bytes/tokens the block
+reports) into process-wide histograms exposed at ``/api/metrics/`` in Prometheus text format.
+When a request wraps its work in ``collect(operation)``, the same measurements are summed into a
+per-request ``Breakdown`` that the view returns in its response. The active breakdown and stage
+travel in context variables, so they follow ``asyncio`` tasks, ``asyncio.to_thread`` and
+``sync_to_async`` without being passed around.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> List[int]:
+        running = 0
+        out = []
+        for n in self.counts:
+            running += n
+            out.append(running)
+        return out
+
+
+class Registry:
+    """Process-wide stage and operation metrics. Each worker process keeps its own."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, _Histogram] = {}
+        self.operations: Dict[str, _Histogram] = {}
+        self.bytes: Dict[str, int] = {}
+        self.tokens: Dict[str, int] = {}
+
+    def observe_stage(self, stage: str, seconds: float, nbytes: int = 0, tokens: int = 0) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, _Histogram()).observe(seconds)
+            if nbytes:
+                self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+            if tokens:
+                self.tokens[stage] = self.tokens.get(stage, 0) + tokens
+
+    def observe_operation(self, operation: str, seconds: float) -> None:
+        with self._lock:
+            self.operations.setdefault(operation, _Histogram()).observe(seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages.clear()
+            self.operations.clear()
+            self.bytes.clear()
+            self.tokens.clear()
+
+
+registry = Registry()
+
+
+class Breakdown:
+    """Per-request totals by stage.
+
+    Stages of concurrently processed files overlap, so their ``seconds`` can add up to more than
+    the request's wall-clock ``total_seconds``.
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.total_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, nbytes: int = 0, tokens: int = 0) -> None:
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0, "tokens": 0})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["bytes"] += nbytes
+            entry["tokens"] += tokens
+
+    def as_dict(self) -> Dict[str, object]:
+        with self._lock:
+            stages = {
+                name: {
+                    "count": int(v["count"]),
+                    "seconds": round(v["seconds"], 4),
+                    "max_seconds": round(v["max_seconds"], 4),
+                    "bytes": int(v["bytes"]),
+                    "tokens": int(v["tokens"]),
+                }
+                for name, v in self.stages.items()
+            }
+        return {"total_seconds": round(self.total_seconds, 4), "stages": stages}
+
+
+class StageRecord:
+    """Handle yielded by ``timed``; the block may add the bytes and tokens it handled."""
+
+    __slots__ = ('stage', 'bytes', 'tokens')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.bytes = 0
+        self.tokens = 0
+
+
+_breakdown: contextvars.ContextVar[Optional[Breakdown]] = contextvars.ContextVar('ragnet_breakdown', default=None)
+_stage: contextvars.ContextVar[Optional[StageRecord]] = contextvars.ContextVar('ragnet_stage', default=None)
+
+
+def observe(stage: str, seconds: float, nbytes: int = 0, tokens: int = 0) -> None:
+    registry.observe_stage(stage, seconds, nbytes, tokens)
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown.add(stage, seconds, nbytes, tokens)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[StageRecord]:
+    record = StageRecord(stage)
+    token = _stage.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed = time.perf_counter() - start
+        _stage.reset(token)
+        observe(stage, elapsed, record.bytes, record.tokens)
+
+
+def timed_iter(stage: str, iterable: Iterable) -> Iterator:
+    """Yield from ``iterable``, timing only the work done producing each item (e.g. ``os.walk``)."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            observe(stage, time.perf_counter() - start)
+            return
+        observe(stage, time.perf_counter() - start)
+        yield item
+
+
+def record_tokens(tokens: int) -> None:
+    """Attribute API tokens to the innermost stage currently being timed, if any."""
+    record = _stage.get()
+    if record is not None and tokens:
+        record.tokens += int(tokens)
+
+
+@contextmanager
+def collect(operation: str) -> Iterator[Breakdown]:
+    breakdown = Breakdown(operation)
+    token = _breakdown.set(breakdown)
+    start = time.perf_counter()
+    try:
+        yield breakdown
+    finally:
+        breakdown.total_seconds = time.perf_counter() - start
+        _breakdown.reset(token)
+        registry.observe_operation(operation, breakdown.total_seconds)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, label: str, histograms: Dict[str, _Histogram]) -> List[str]:
+    lines = []
+    for key in sorted(histograms):
+        hist = histograms[key]
+        for bound, n in zip(BUCKETS, hist.cumulative()):
+            lines.append(f"{name}_bucket{_labels(**{label: key, 'le': repr(bound)})} {n}")
+        lines.append(f"{name}_bucket{_labels(**{label: key, 'le': '+Inf'})} {hist.count}")
+        lines.append(f"{name}_sum{_labels(**{label: key})} {hist.total:.6f}")
+        lines.append(f"{name}_count{_labels(**{label: key})} {hist.count}")
+    return lines
+
+
+def render_prometheus(gateway_stats: Optional[Dict[str, int]] = None) -> str:
+    """Prometheus text exposition (format 0.0.4) of the registry and, if given, the LLM gateway counters."""
+    with registry._lock:
+        stages = {k: _copy(v) for k, v in registry.stages.items()}
+        operations = {k: _copy(v) for k, v in registry.operations.items()}
+        nbytes = dict(registry.bytes)
+        tokens = dict(registry.tokens)
+
+    lines = [
+        "# HELP ragnet_stage_duration_seconds Time spent in each pipeline stage.",
+        "# TYPE ragnet_stage_duration_seconds histogram",
+    ]
+    lines += _histogram_lines("ragnet_stage_duration_seconds", "stage", stages)
+    lines += [
+        "# HELP ragnet_operation_duration_seconds Wall-clock time of scans and questions.",
+        "# TYPE ragnet_operation_duration_seconds histogram",
+    ]
+    lines += _histogram_lines("ragnet_operation_duration_seconds", "operation", operations)
+    lines += [
+        "# HELP ragnet_stage_bytes_total Bytes read or written per stage.",
+        "# TYPE ragnet_stage_bytes_total counter",
+    ]
+    lines += [f"ragnet_stage_bytes_total{_labels(stage=k)} {v}" for k, v in sorted(nbytes.items())]
+    lines += [
+        "# HELP ragnet_stage_tokens_total Tokens per stage: OpenAI usage, or packed context for context_pack.",
+        "# TYPE ragnet_stage_tokens_total counter",
+    ]
+    lines += [f"ragnet_stage_tokens_total{_labels(stage=k)} {v}" for k, v in sorted(tokens.items())]
+    if gateway_stats is not None:
+        lines += [
+            "# HELP ragnet_openai_calls_total OpenAI gateway calls by outcome.",
+            "# TYPE ragnet_openai_calls_total counter",
+        ]
+        lines += [f"ragnet_openai_calls_total{_labels(outcome=k)} {v}" for k, v in sorted(gateway_stats.items())]
+    return "\n".join(lines) + "\n"
+
+
+def _copy(hist: _Histogram) -> _Histogram:
+    clone = _Histogram()
+    clone.counts = list(hist.counts)
+    clone.total = hist.total
+    clone.count = hist.count
+    return clone
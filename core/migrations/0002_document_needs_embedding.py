@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 03:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='needs_embedding',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_chunk_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='description_embedding',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+    ]
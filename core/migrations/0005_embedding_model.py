@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-19 04:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def tag_existing_vectors(apps, schema_editor):
+    # Vectors stored so far all came from the configured OpenAI embedding model
+    model = getattr(settings, 'OPENAI_EMBEDDING_MODEL', '') or 'text-embedding-3-small'
+    Document = apps.get_model('core', 'Document')
+    DocumentChunk = apps.get_model('core', 'DocumentChunk')
+    DocumentChunk.objects.exclude(embedding=b"").update(embedding_model=model)
+    Document.objects.exclude(description_embedding=b"").update(description_embedding_model=model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_document_description_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='description_embedding_model',
+            field=models.CharField(blank=True, default='', max_length=128),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_model',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=128),
+        ),
+        migrations.RunPython(tag_existing_vectors, migrations.RunPython.noop),
+    ]
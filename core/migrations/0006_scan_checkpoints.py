@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-19 04:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_embedding_model'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('directory', models.TextField()),
+                ('contractor', models.CharField(blank=True, default='', max_length=256)),
+                ('project', models.CharField(blank=True, default='', max_length=256)),
+                ('mode', models.CharField(default='concise', max_length=16)),
+                ('cutoff', models.DateTimeField(blank=True, null=True)),
+                ('planned', models.BooleanField(default=False)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScanShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('directory', models.TextField()),
+                ('start_name', models.TextField(blank=True, default='')),
+                ('stop_name', models.TextField(blank=True, default='')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=16)),
+                ('counts', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='core.scanrun')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('run', 'directory', 'start_name'), name='unique_scan_shard')],
+            },
+        ),
+    ]
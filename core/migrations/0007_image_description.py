@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-19 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_scan_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDescription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_hash', models.CharField(max_length=80)),
+                ('mode', models.CharField(default='concise', max_length=16)),
+                ('description', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('image_hash', 'mode'), name='unique_image_description')],
+            },
+        ),
+    ]
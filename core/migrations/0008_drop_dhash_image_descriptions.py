@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def drop_dhash_descriptions(apps, schema_editor):
+    # Perceptual-hash keys were shared by different images with the same layout, so their
+    # descriptions may belong to another image; they are described again on the next scan
+    ImageDescription = apps.get_model('core', 'ImageDescription')
+    ImageDescription.objects.filter(image_hash__startswith='dhash:').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_image_description'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_dhash_descriptions, migrations.RunPython.noop),
+    ]
@@ -10,6 +10,12 @@ class Document(models.Model):
     size_bytes = models.BigIntegerField(default=0)
     modified_at = models.DateTimeField(null=True, blank=True)
     description = models.TextField(blank=True, default="")
+    # Embedding of file name + project + description (float32 bytes); first stage of two-stage retrieval
+    description_embedding = models.BinaryField(blank=True, default=b"")
+    # Embedding backend/model that produced description_embedding; see core.embeddings
+    description_embedding_model = models.CharField(max_length=128, blank=True, default="")
+    # Set when some chunks were stored without vectors (e.g. the embeddings API failed); see `manage.py reembed`
+    needs_embedding = models.BooleanField(default=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -22,6 +28,11 @@ class DocumentChunk(models.Model):
     chunk_index = models.IntegerField()
     text = models.TextField()
     embedding = models.BinaryField()  # store as bytes (e.g., float32 array serialized)
+    # Embedding backend/model that produced `embedding`; only vectors of the active model are searched
+    embedding_model = models.CharField(max_length=128, blank=True, default="", db_index=True)
+    minhash = models.BinaryField(blank=True, default=b"")  # MinHash signature (uint32 array), see core.dedup
+    # Near-duplicate of another chunk: shares its embedding and is left out of the vector index
+    duplicate_of = models.ForeignKey("self", null=True, blank=True, on_delete=models.SET_NULL, related_name="duplicates")
 
     class Meta:
         unique_together = ("document", "chunk_index")
@@ -29,4 +40,71 @@ class DocumentChunk(models.Model):
     def __str__(self) -> str:
         return f"{self.document.file_name} [chunk {self.chunk_index}]"
 
+
+class ChunkBand(models.Model):
+    # LSH band key of a canonical chunk's MinHash signature
+    chunk = models.ForeignKey(DocumentChunk, on_delete=models.CASCADE, related_name="bands")
+    key = models.BigIntegerField(db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.chunk_id}:{self.key}"
+
+
+class ImageDescription(models.Model):
+    # Vision description shared by pixel-identical images; see core.images
+    image_hash = models.CharField(max_length=80)
+    mode = models.CharField(max_length=16, default="concise")
+    description = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["image_hash", "mode"], name="unique_image_description"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.image_hash} ({self.mode})"
+
+
+class ScanRun(models.Model):
+    # One `manage.py scan`; its shards are the checkpoint an interrupted scan resumes from
+    directory = models.TextField()
+    contractor = models.CharField(max_length=256, blank=True, default="")
+    project = models.CharField(max_length=256, blank=True, default="")
+    mode = models.CharField(max_length=16, default="concise")
+    cutoff = models.DateTimeField(null=True, blank=True)
+    # Every directory has been split into shards
+    planned = models.BooleanField(default=False)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.directory} ({self.started_at:%Y-%m-%d %H:%M})"
+
+
+class ScanShard(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(s, s) for s in (PENDING, RUNNING, DONE, FAILED)]
+
+    run = models.ForeignKey(ScanRun, on_delete=models.CASCADE, related_name="shards")
+    # Files directly in `directory` whose names sort in [start_name, stop_name); "" leaves that end open
+    directory = models.TextField()
+    start_name = models.TextField(blank=True, default="")
+    stop_name = models.TextField(blank=True, default="")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    counts = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["run", "directory", "start_name"], name="unique_scan_shard"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.directory} [{self.start_name}:{self.stop_name}] {self.status}"
+
 # Create your models here.
@@ -0,0 +1,483 @@
+"""The scan pipeline shared by ``/api/scan/`` and the ``scan`` and ``watch`` commands.
+
+Files are read, described and embedded concurrently on an event loop (``_analyze_entries``); each
+result is written by a ``ScanStore`` on the caller's thread. ``ingest_entries`` runs the whole
+pipeline for an iterable of ``ScanEntry`` and ``delete_paths`` removes documents whose files are gone.
+"""
+import asyncio
+import mimetypes
+import os
+from array import array
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .chunking import chunk_text
+from .dedup import (
+    PendingChunk,
+    ScanDedupIndex,
+    dedup_enabled,
+    find_duplicates,
+    index_chunks,
+    minhash,
+    signature_bytes,
+)
+from .embeddings import aembed_texts, bytes_from_vector, document_embedding_text, embedding_model
+from .images import ImageDescriptionCache, cache_enabled, prepare_image
+from .llm import achat, get_async_client
+from .metrics import timed, timed_iter
+from .models import Document, DocumentChunk
+from .vectorstore import shard_for
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+def read_text_from_file(path: str) -> str:
+    mime, _ = mimetypes.guess_type(path)
+    if not mime:
+        mime = "application/octet-stream"
+    mime = mime.lower()
+
+    try:
+        if mime.startswith("text/"):
+            try:
+                if os.path.getsize(path) > getattr(settings, 'SCAN_MAX_BYTES', 10 * 1024 * 1024):
+                    return ""
+            except Exception:
+                pass
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                return f.read()
+        if mime == "application/pdf" or path.lower().endswith(".pdf"):
+            text = []
+            try:
+                if os.path.getsize(path) > getattr(settings, 'SCAN_MAX_BYTES', 10 * 1024 * 1024):
+                    return ""
+            except Exception:
+                pass
+            from pypdf import PdfReader
+            reader = PdfReader(path)
+            for page in reader.pages:
+                text.append(page.extract_text() or "")
+            # Form feeds keep page boundaries for the PDF chunking strategy
+            return "\f".join(text)
+        # Fallback: don't try to read binary images here; just return empty
+        return ""
+    except Exception:
+        return ""
+
+
+def _summary_request(text: str, mode: str) -> dict:
+    if mode == "detailed":
+        style = "Write a thorough 3-6 sentence summary for search and discovery. Focus on key topics, entities, purpose, and important details."
+    elif mode == "creative":
+        style = "Write a catchy 1-3 sentence summary suitable for search and discovery."
+    else:
+        style = "Summarize the following file content in 1-3 sentences for search and discovery. Focus on key topics, entities, and purpose."
+    prompt = style + "\n\n" + text[:6000]
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that writes concise summaries."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0.2,
+        max_tokens=160,
+    )
+
+
+def _vision_request(data_url: str, mode: str) -> dict:
+    if mode == "detailed":
+        vision_text = "Describe this image in 2-4 sentences for search and discovery. Mention key objects, visible text, and purpose."
+    elif mode == "creative":
+        vision_text = "Describe this image in 1-2 punchy sentences for search and discovery."
+    else:
+        vision_text = "Describe this image in 1-3 sentences for search and discovery. Mention key objects, text, and purpose succinctly."
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that writes concise visual descriptions for search."},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": vision_text},
+                    {"type": "image_url", "image_url": {"url": data_url}},
+                ],
+            },
+        ],
+        temperature=0.2,
+        max_tokens=120,
+    )
+
+
+async def _describe_image(client: "AsyncOpenAI", path: str, mime: str, mode: str,
+                          images: Optional[ImageDescriptionCache] = None) -> str:
+    # Downscaled before upload; pixel-identical images share one description
+    try:
+        with timed("image_prepare") as stage:
+            prepared = await asyncio.to_thread(prepare_image, path, mime)
+            stage.bytes = prepared.original_bytes if prepared else 0
+    except Exception:
+        return ""
+    if prepared is None:
+        return ""
+
+    async def describe() -> str:
+        try:
+            with timed("describe_image") as stage:
+                stage.bytes = len(prepared.data_url)
+                completion = await achat(client, **_vision_request(prepared.data_url, mode))
+            return completion.choices[0].message.content.strip()
+        except Exception:
+            return ""
+
+    if images is None or not cache_enabled():
+        return await describe()
+    return await images.get(prepared.key, mode, describe) or ""
+
+
+async def _describe_file_with_openai(client: "AsyncOpenAI", path: str, text: str, mode: str = "concise",
+                                     images: Optional[ImageDescriptionCache] = None) -> str:
+    # Prefer the extracted text; if unavailable, try vision on images; else fallback to filename-based description.
+    if text:
+        try:
+            with timed("describe"):
+                completion = await achat(client, **_summary_request(text, mode))
+            return completion.choices[0].message.content.strip()
+        except Exception:
+            # fall through to attempt vision or filename-based
+            pass
+
+    # If no text, try multimodal vision for images
+    mime, _ = mimetypes.guess_type(path)
+    mime = (mime or "").lower()
+    if mime.startswith("image/"):
+        desc = await _describe_image(client, path, mime, mode, images)
+        if desc:
+            return desc
+
+    # Fallback: filename-based description
+    base_name = os.path.basename(path)
+    return f"File named {base_name}.".strip()
+
+
+async def _embed_chunks(client: "AsyncOpenAI", chunks: List[str]) -> List[bytes]:
+    if not chunks:
+        return []
+    try:
+        with timed("embed") as stage:
+            stage.bytes = sum(len(c.encode('utf-8')) for c in chunks)
+            vectors = await aembed_texts(client, chunks)
+    except Exception:
+        return [b"" for _ in chunks]
+    return [bytes_from_vector(vec) if vec else b"" for vec in vectors]
+
+
+class ScanEntry(NamedTuple):
+    path: str
+    file_name: str
+    file_type: str
+    size_bytes: int
+    modified_at: datetime
+
+
+def iter_scan_entries(directory: str, cutoff_dt: Optional[datetime] = None) -> Iterator[ScanEntry]:
+    ignore_dirs = set(getattr(settings, 'SCAN_IGNORE_DIRS', set()))
+    for root, dirs, files in os.walk(directory):
+        # Prune ignored directories in-place for efficiency
+        dirs[:] = [d for d in dirs if d not in ignore_dirs]
+        for fname in files:
+            path = os.path.join(root, fname)
+
+            try:
+                stat = os.stat(path)
+            except Exception:
+                continue
+
+            modified_at = datetime.fromtimestamp(stat.st_mtime)
+            if cutoff_dt and modified_at < cutoff_dt:
+                continue
+
+            mime, _ = mimetypes.guess_type(path)
+            yield ScanEntry(path, fname, mime or "application/octet-stream", stat.st_size, modified_at)
+
+
+class _FileAnalysis(NamedTuple):
+    description: str
+    description_embedding: bytes  # document-level vector; b"" if embedding failed
+    chunks: List[str]
+    embeddings: List[bytes]  # float32 bytes per chunk; b"" where embedding failed
+    signatures: List[bytes]  # MinHash per chunk; b"" when dedup is off
+    duplicate_of: List[Optional[int]]  # stored canonical chunk id for near-duplicates
+    scan_refs: List[Optional[PendingChunk]]  # in-scan canonical entry this chunk owns or duplicates
+    owns_ref: List[bool]
+
+
+def _chunk_signatures(chunks: List[str]) -> List[Optional[array]]:
+    return [minhash(chunk) for chunk in chunks]
+
+
+async def _embed_with_dedup(client: "AsyncOpenAI", chunks: List[str], matches: List[Optional[Tuple[int, bytes]]],
+                            refs: List[Optional[PendingChunk]], owns: List[bool]) -> List[bytes]:
+    embeddings = [match[1] if match else b"" for match in matches]
+    to_embed = [i for i in range(len(chunks)) if matches[i] is None and (refs[i] is None or owns[i])]
+    try:
+        fresh = await _embed_chunks(client, [chunks[i] for i in to_embed])
+        for i, blob in zip(to_embed, fresh):
+            embeddings[i] = blob
+    finally:
+        # Always resolve, so duplicates waiting on these chunks fall back to embedding themselves
+        for i in to_embed:
+            if refs[i] is not None and not refs[i].embedding.done():
+                refs[i].embedding.set_result(embeddings[i])
+
+    retry = []
+    for i, ref in enumerate(refs):
+        if ref is not None and not owns[i]:
+            embeddings[i] = await ref.embedding
+            if not embeddings[i]:
+                retry.append(i)
+    for i, blob in zip(retry, await _embed_chunks(client, [chunks[i] for i in retry])):
+        embeddings[i] = blob
+    return embeddings
+
+
+async def _describe_and_embed(client: "AsyncOpenAI", entry: ScanEntry, text: str, mode: str, project: str,
+                              images: Optional[ImageDescriptionCache] = None) -> Tuple[str, bytes]:
+    description = await _describe_file_with_openai(client, entry.path, text, mode=mode, images=images)
+    vectors = await _embed_chunks(client, [document_embedding_text(entry.file_name, project, description)])
+    return description, vectors[0]
+
+
+async def _analyze_file(client: "AsyncOpenAI", entry: ScanEntry, mode: str,
+                        scan_index: Optional[ScanDedupIndex] = None, project: str = "",
+                        images: Optional[ImageDescriptionCache] = None, contractor: str = "") -> _FileAnalysis:
+    # Read once; the same text feeds both the description and the chunks
+    is_pdf = entry.file_type == "application/pdf" or entry.path.lower().endswith(".pdf")
+    with timed("read_pdf" if is_pdf else "read") as stage:
+        text = await asyncio.to_thread(read_text_from_file, entry.path)
+        stage.bytes = entry.size_bytes if text else 0
+    chunks: List[str] = []
+    if text:
+        max_chunks = int(getattr(settings, 'SCAN_MAX_CHUNKS', 64) or 64)
+        with timed("chunk") as stage:
+            chunks = await asyncio.to_thread(chunk_text, text, entry.path, entry.file_type, max_chunks)
+            stage.bytes = sum(len(chunk) for chunk in chunks)
+
+    # Near-duplicates of stored chunks, or of chunks seen earlier in this scan, reuse their
+    # embedding instead of calling the API
+    signatures: List[Optional[array]] = [None] * len(chunks)
+    matches: List[Optional[Tuple[int, bytes]]] = [None] * len(chunks)
+    refs: List[Optional[PendingChunk]] = [None] * len(chunks)
+    owns = [False] * len(chunks)
+    if chunks and dedup_enabled():
+        with timed("dedup"):
+            signatures = await asyncio.to_thread(_chunk_signatures, chunks)
+            matches = await sync_to_async(find_duplicates, thread_sensitive=True)(signatures, project, contractor)
+        if scan_index is not None:
+            loop = asyncio.get_running_loop()
+            for i, sig in enumerate(signatures):
+                if matches[i] is None and sig is not None:
+                    refs[i], is_duplicate = scan_index.match_or_add(sig, loop.create_future)
+                    owns[i] = not is_duplicate
+
+    (description, description_embedding), embeddings = await asyncio.gather(
+        _describe_and_embed(client, entry, text, mode, project, images),
+        _embed_with_dedup(client, chunks, matches, refs, owns),
+    )
+    return _FileAnalysis(
+        description=description,
+        description_embedding=description_embedding,
+        chunks=chunks,
+        embeddings=embeddings,
+        signatures=[signature_bytes(sig) for sig in signatures],
+        duplicate_of=[match[0] if match else None for match in matches],
+        scan_refs=refs,
+        owns_ref=owns,
+    )
+
+
+async def _analyze_entries(entries: Iterable[ScanEntry], mode: str, store: Callable, project: str = "",
+                           contractor: str = "") -> None:
+    """Describe and embed files concurrently, handing each result to the sync ``store`` callback.
+
+    ``store`` runs on the calling thread (thread_sensitive), so it sees the caller's transaction.
+    """
+    client = get_async_client()
+    concurrency = max(1, int(getattr(settings, 'SCAN_CONCURRENCY', 8) or 8))
+    limit = asyncio.Semaphore(concurrency)
+
+    def timed_store(entry: ScanEntry, result: _FileAnalysis) -> None:
+        # Timed on the writer thread so waiting for the thread isn't counted as write time
+        with timed("db_write"):
+            store(entry, result)
+
+    store_async = sync_to_async(timed_store, thread_sensitive=True)
+    scan_index = ScanDedupIndex() if dedup_enabled() else None
+    images = ImageDescriptionCache()
+
+    async def one(entry: ScanEntry) -> None:
+        async with limit:
+            result = await _analyze_file(client, entry, mode, scan_index, project, images, contractor)
+        await store_async(entry, result)
+
+    # Bounded windows keep the number of pending tasks flat on very large trees
+    window: List[ScanEntry] = []
+    for entry in timed_iter("walk", entries):
+        window.append(entry)
+        if len(window) >= concurrency * 8:
+            await asyncio.gather(*(one(e) for e in window))
+            window = []
+    if window:
+        await asyncio.gather(*(one(e) for e in window))
+
+
+
+def new_counts() -> Dict[str, int]:
+    return {"processed": 0, "created": 0, "updated": 0, "chunks_added": 0, "chunks_deduplicated": 0, "embedding_failures": 0}
+
+
+def delete_chunks(chunks) -> Tuple[List[int], List[int]]:
+    """Delete a chunk queryset. Returns the deleted ids and the ids of surviving near-duplicates
+    that lost their canonical chunk and are now canonical (and indexable) themselves."""
+    ids = list(chunks.values_list('id', flat=True))
+    if not ids:
+        return [], []
+    promoted = list(DocumentChunk.objects.filter(duplicate_of__in=chunks).exclude(id__in=chunks.values('id')))
+    DocumentChunk.objects.filter(id__in=chunks.values('id')).delete()
+    # on_delete=SET_NULL already cleared the link; give them LSH bands so later copies find them
+    for chunk in promoted:
+        chunk.duplicate_of_id = None
+    index_chunks(promoted)
+    return ids, [chunk.id for chunk in promoted]
+
+
+class ScanStore:
+    """Writes analyzed files to the database and tallies the scan counts.
+
+    Always called on one thread (see ``_analyze_entries``); each file is written in its own
+    transaction. Chunk ids entering and leaving the set of canonical chunks are collected so the
+    vector index can be updated incrementally.
+    """
+
+    def __init__(self, contractor: str = "", project: str = ""):
+        self.contractor = contractor
+        self.project = project
+        self.model = embedding_model()
+        self.counts = new_counts()
+        self.added_chunk_ids: List[int] = []
+        self.removed_chunk_ids: List[int] = []
+
+    def __call__(self, entry: ScanEntry, result: _FileAnalysis) -> None:
+        # One transaction per file: an interrupted scan keeps every file it finished
+        with transaction.atomic():
+            self._store(entry, result)
+
+    def _store(self, entry: ScanEntry, result: _FileAnalysis) -> None:
+        counts = self.counts
+        # Chunks whose embedding failed are still stored; the flag queues the file for `manage.py reembed`
+        needs_embedding = any(not blob for blob in result.embeddings)
+        counts["embedding_failures"] += int(needs_embedding)
+        doc, created_flag = Document.objects.update_or_create(
+            file_path=entry.path,
+            defaults=dict(
+                file_name=entry.file_name,
+                file_type=entry.file_type,
+                contractor=self.contractor,
+                project=self.project,
+                size_bytes=entry.size_bytes,
+                modified_at=entry.modified_at,
+                description=result.description,
+                description_embedding=result.description_embedding,
+                description_embedding_model=self.model if result.description_embedding else "",
+                needs_embedding=needs_embedding,
+            ),
+        )
+        counts["processed"] += 1
+        counts["created"] += int(created_flag)
+        counts["updated"] += int(not created_flag)
+
+        if result.chunks:
+            removed, promoted = delete_chunks(DocumentChunk.objects.filter(document=doc))
+            self.removed_chunk_ids.extend(removed)
+            self.added_chunk_ids.extend(promoted)
+            # A rescanned file matches its own previous chunks; those were just deleted, so the
+            # new chunks keep the copied embedding but become canonical themselves
+            canonical_ids = {cid for cid in result.duplicate_of if cid is not None}
+            canonical_ids |= {ref.chunk_id for ref in result.scan_refs if ref is not None and ref.chunk_id is not None}
+            alive = set(DocumentChunk.objects.filter(id__in=canonical_ids).values_list('id', flat=True)) if canonical_ids else set()
+            rows = []
+            for idx, (chunk, blob, sig, dup, ref, owns) in enumerate(zip(
+                    result.chunks, result.embeddings, result.signatures, result.duplicate_of, result.scan_refs, result.owns_ref)):
+                if dup is None and ref is not None and not owns:
+                    dup = ref.chunk_id
+                rows.append(DocumentChunk(
+                    document=doc,
+                    chunk_index=idx,
+                    text=chunk,
+                    embedding=blob,
+                    embedding_model=self.model if blob else "",
+                    minhash=sig,
+                    duplicate_of_id=dup if dup in alive else None,
+                ))
+            DocumentChunk.objects.bulk_create(rows)
+            for row, ref, owns in zip(rows, result.scan_refs, result.owns_ref):
+                if owns:
+                    ref.chunk_id = row.id
+            # Duplicates of chunks from this same file can only be linked once their ids exist
+            linked = []
+            for row, ref, owns in zip(rows, result.scan_refs, result.owns_ref):
+                if ref is not None and not owns and row.duplicate_of_id is None and ref.chunk_id is not None and ref.chunk_id != row.id:
+                    row.duplicate_of_id = ref.chunk_id
+                    linked.append(row)
+            if linked:
+                DocumentChunk.objects.bulk_update(linked, ['duplicate_of'])
+            index_chunks(rows)
+            self.added_chunk_ids.extend(row.id for row in rows if row.duplicate_of_id is None)
+            counts["chunks_added"] += len(rows)
+            counts["chunks_deduplicated"] += sum(1 for row in rows if row.duplicate_of_id is not None)
+
+
+def ingest_entries(entries: Iterable[ScanEntry], contractor: str = "", project: str = "", mode: str = "concise") -> ScanStore:
+    """Describe, embed and store ``entries``. Returns the store with its counts and changed chunk ids.
+
+    Each file is committed as soon as it is stored. The vector index is not touched; callers
+    rebuild or update it afterwards.
+    """
+    store = ScanStore(contractor=contractor, project=project)
+    async_to_sync(_analyze_entries)(entries, mode, store, project, contractor)
+    return store
+
+
+def scan_entry(path: str) -> Optional[ScanEntry]:
+    """``ScanEntry`` for one file, or None if it no longer exists or is not a regular file."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    mime, _ = mimetypes.guess_type(path)
+    return ScanEntry(path, os.path.basename(path), mime or "application/octet-stream", stat.st_size,
+                     datetime.fromtimestamp(stat.st_mtime))
+
+
+def delete_paths(paths: Sequence[str] = (), prefixes: Sequence[str] = ()) -> Tuple[int, List[int], List[int], Set[str]]:
+    """Delete documents for ``paths`` and for everything under the directory ``prefixes``.
+
+    Returns the number of documents removed, the deleted and promoted chunk ids (see
+    ``delete_chunks``) and the index shards the documents belonged to.
+    """
+    condition = Q(file_path__in=list(paths))
+    for prefix in prefixes:
+        condition |= Q(file_path__startswith=prefix.rstrip(os.sep) + os.sep)
+    docs = Document.objects.filter(condition)
+    with transaction.atomic():
+        shards = {shard_for(project, contractor) for project, contractor in docs.values_list('project', 'contractor').distinct()}
+        removed, promoted = delete_chunks(DocumentChunk.objects.filter(document__in=docs))
+        _, per_model = docs.delete()
+    return per_model.get(Document._meta.label, 0), removed, promoted, shards
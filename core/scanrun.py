@@ -0,0 +1,175 @@
+"""Sharded, resumable scans for ``manage.py scan``.
+
+The tree is split into ``ScanShard`` rows: up to ``SCAN_SHARD_FILES`` files of one directory,
+identified by a name range so a resumed scan lists the same files again. Shards are processed by a
+pool of worker processes, each running the ``/api/scan/`` pipeline (``ingest_entries``) with its
+own event loop. Every file is committed as it is stored and every shard is marked done when it
+finishes, so an interrupted run resumes with the unfinished shards and skips the files those
+shards already wrote.
+"""
+import multiprocessing
+import os
+import signal
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import django
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from .models import Document, ScanRun, ScanShard
+from .scanner import ScanEntry, ingest_entries, new_counts, scan_entry
+from .vectorstore import rebuild_index_from_db, shard_for
+
+
+def iter_shard_plan(directory: str, shard_size: int) -> Iterator[Tuple[str, str, str]]:
+    """Yield ``(directory, start_name, stop_name)`` covering every file under ``directory``.
+
+    Ranges are half-open and the first and last shard of a directory are open-ended, so files
+    added between runs still fall into some shard.
+    """
+    ignore_dirs = set(getattr(settings, 'SCAN_IGNORE_DIRS', set()))
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d not in ignore_dirs)
+        names = sorted(files)
+        if not names:
+            continue
+        starts = names[::shard_size]
+        starts[0] = ""
+        for i, start in enumerate(starts):
+            yield root, start, starts[i + 1] if i + 1 < len(starts) else ""
+
+
+def shard_entries(shard: ScanShard, cutoff: Optional[datetime] = None) -> List[ScanEntry]:
+    try:
+        names = sorted(e.name for e in os.scandir(shard.directory) if e.is_file())
+    except OSError:
+        return []  # directory vanished since planning
+    entries = []
+    for name in names:
+        if (shard.start_name and name < shard.start_name) or (shard.stop_name and name >= shard.stop_name):
+            continue
+        entry = scan_entry(os.path.join(shard.directory, name))
+        if entry is None or (cutoff and entry.modified_at < cutoff):
+            continue
+        entries.append(entry)
+    return entries
+
+
+_worker_configured = False
+
+
+def _configure_worker(workers: int) -> None:
+    # The rate limits are per process; split them so the pool as a whole stays within them
+    global _worker_configured
+    if _worker_configured:
+        return
+    _worker_configured = True
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the coordinator handles Ctrl-C
+    for name, default in (('OPENAI_RPM_LIMIT', 500), ('OPENAI_TPM_LIMIT', 200000), ('OPENAI_MAX_CONCURRENCY', 32)):
+        value = int(getattr(settings, name, default) or default)
+        setattr(settings, name, max(1, value // workers))
+
+
+def run_shard(shard_id: int, workers: int = 1) -> Dict[str, int]:
+    """Scan one shard; runs in a worker process (or inline with a single worker)."""
+    if workers > 1:
+        _configure_worker(workers)
+        close_old_connections()
+    shard = ScanShard.objects.select_related('run').get(id=shard_id)
+    run = shard.run
+    ScanShard.objects.filter(id=shard_id).update(status=ScanShard.RUNNING, error="")
+    try:
+        entries = shard_entries(shard, run.cutoff and timezone.make_naive(run.cutoff))
+        # Files this run already stored before it was interrupted
+        written = set(Document.objects.filter(file_path__in=[e.path for e in entries], updated_at__gte=run.started_at)
+                      .values_list('file_path', flat=True))
+        store = ingest_entries([e for e in entries if e.path not in written],
+                               contractor=run.contractor, project=run.project, mode=run.mode)
+    except Exception as e:
+        ScanShard.objects.filter(id=shard_id).update(status=ScanShard.FAILED, error=str(e)[:2000])
+        return {**new_counts(), "skipped": 0, "failed_shards": 1}
+    counts = {**store.counts, "skipped": len(written), "failed_shards": 0}
+    ScanShard.objects.filter(id=shard_id).update(status=ScanShard.DONE, counts=counts)
+    return counts
+
+
+def start_run(directory: str, contractor: str = "", project: str = "", mode: str = "concise",
+              cutoff: Optional[datetime] = None, restart: bool = False) -> Tuple[ScanRun, bool]:
+    """The unfinished run for ``directory`` (resumed) or a new one. Returns ``(run, resumed)``."""
+    directory = os.path.abspath(directory)
+    unfinished = ScanRun.objects.filter(directory=directory, finished_at__isnull=True)
+    if restart:
+        unfinished.delete()
+    else:
+        run = unfinished.order_by('-id').first()
+        if run is not None:
+            return run, True
+    if cutoff is not None and timezone.is_naive(cutoff):
+        cutoff = timezone.make_aware(cutoff)
+    run = ScanRun.objects.create(directory=directory, contractor=contractor, project=project, mode=mode, cutoff=cutoff)
+    return run, False
+
+
+def _add(totals: Dict[str, int], counts: Dict[str, int]) -> None:
+    for key, value in counts.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+def execute_run(run: ScanRun, workers: int = 1, shard_size: int = 256,
+                log: Callable[[str], None] = lambda message: None) -> Dict[str, int]:
+    """Plan (or finish planning) ``run``, scan its pending shards and rebuild the index.
+
+    Planning and scanning overlap: shards are handed to the workers as each batch is planned.
+    The run is only marked finished when every shard is done; failed shards are retried on resume.
+    """
+    # Shards a crashed or interrupted run left behind start over (their finished files are skipped)
+    run.shards.filter(status__in=[ScanShard.RUNNING, ScanShard.FAILED]).update(status=ScanShard.PENDING)
+    totals = {**new_counts(), "skipped": 0, "failed_shards": 0}
+    pending: List = []
+    last_id = 0
+
+    def submit(dispatch: Callable[[int], object]) -> None:
+        nonlocal last_id
+        for shard_id in run.shards.filter(status=ScanShard.PENDING, id__gt=last_id).order_by('id').values_list('id', flat=True):
+            pending.append(dispatch(shard_id))
+            last_id = shard_id
+
+    def plan(dispatch: Callable[[int], object]) -> None:
+        if not run.planned:
+            batch: List[ScanShard] = []
+            for directory, start, stop in iter_shard_plan(run.directory, shard_size):
+                batch.append(ScanShard(run=run, directory=directory, start_name=start, stop_name=stop))
+                if len(batch) >= 500:
+                    ScanShard.objects.bulk_create(batch, ignore_conflicts=True)
+                    batch = []
+                    submit(dispatch)
+            ScanShard.objects.bulk_create(batch, ignore_conflicts=True)
+            run.planned = True
+            run.save(update_fields=['planned'])
+        submit(dispatch)
+
+    if workers <= 1:
+        plan(lambda shard_id: shard_id)
+        for shard_id in pending:
+            _add(totals, run_shard(shard_id))
+            log(f"{totals['processed']} files, {totals['skipped']} already done")
+    else:
+        # Spawned workers never inherit the coordinator's connections, threads or event loop
+        connections.close_all()
+        with multiprocessing.get_context('spawn').Pool(workers, initializer=django.setup) as pool:
+            plan(lambda shard_id: pool.apply_async(run_shard, (shard_id, workers)))
+            for done, result in enumerate(pending, 1):
+                _add(totals, result.get())
+                if done % 10 == 0 or done == len(pending):
+                    log(f"{done}/{len(pending)} shards, {totals['processed']} files, {totals['skipped']} already done")
+
+    try:
+        rebuild_index_from_db([shard_for(run.project, run.contractor)])
+    except Exception:
+        pass
+    if not run.shards.exclude(status=ScanShard.DONE).exists():
+        run.finished_at = timezone.now()
+        run.save(update_fields=['finished_at'])
+    return totals
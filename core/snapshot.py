@@ -0,0 +1,378 @@
+import contextlib
+import hashlib
+import io
+import json
+import tempfile
+import zipfile
+from array import array
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .dedup import NUM_PERM, index_chunks
+from .embeddings import decode_embedding, embedding_model, encode_embedding
+from .models import Document, DocumentChunk
+from .vectorstore import (
+    ALL_SHARD,
+    index_files,
+    install_indexes,
+    rebuild_document_index,
+    rebuild_index_from_db,
+    shard_by,
+)
+
+SNAPSHOT_FORMAT = 'ragnetscanner-snapshot'
+SNAPSHOT_VERSION = 4
+
+# Archive members. Chunk columns are stored side by side so restore can stream them in step.
+_DOCUMENTS = 'documents.ndjson'
+_CHUNK_IDS = 'chunks/id.i64'
+_CHUNK_DOCS = 'chunks/document_id.i64'
+_CHUNK_INDEX = 'chunks/chunk_index.i32'
+_CHUNK_DIMS = 'chunks/dim.i32'
+_CHUNK_TEXT = 'chunks/text.ndjson'
+_CHUNK_VECTORS = 'chunks/embedding.f32'
+_CHUNK_MODELS = 'chunks/embedding_model.ndjson'  # model name per chunk, "" without a vector
+_CHUNK_DUPLICATE_OF = 'chunks/duplicate_of.i64'  # 0 = canonical
+_CHUNK_MINHASH = 'chunks/minhash.u32'  # NUM_PERM values per chunk, all zero when absent
+# Version 4 stores one chunk index per shard as index/<shard>/index.bin and mapping.json;
+# earlier versions hold a single unsharded index at index/index.bin
+_INDEX = 'index/index.bin'
+_MAPPING = 'index/mapping.json'
+_MANIFEST = 'manifest.json'
+
+_DOC_FIELDS = ('id', 'file_path', 'file_name', 'file_type', 'contractor', 'project',
+               'size_bytes', 'modified_at', 'description', 'description_embedding', 'description_embedding_model',
+               'needs_embedding', 'created_at', 'updated_at')
+_DATETIME_FIELDS = ('modified_at', 'created_at', 'updated_at')
+
+_BATCH = 2000
+_MINHASH_BYTES = NUM_PERM * 4
+_EMPTY_MINHASH = bytes(_MINHASH_BYTES)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _shard_members(shard: str):
+    return f'index/{shard}/index.bin', f'index/{shard}/mapping.json'
+
+
+class _Member:
+    """Streaming writer for one archive member that tracks its checksum and size."""
+
+    def __init__(self, zf: zipfile.ZipFile, name: str):
+        self.name = name
+        self._fh = zf.open(name, 'w', force_zip64=True)
+        self._sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self._fh.write(data)
+        self._sha.update(data)
+        self.size += len(data)
+
+    def close(self) -> Dict[str, Any]:
+        self._fh.close()
+        return {"sha256": self._sha.hexdigest(), "size": self.size}
+
+
+def _document_row(values: Dict[str, Any]) -> Dict[str, Any]:
+    for name in _DATETIME_FIELDS:
+        if values.get(name) is not None:
+            values[name] = values[name].isoformat()
+    values['description_embedding'] = encode_embedding(values.get('description_embedding') or b"")
+    return values
+
+
+_CHUNK_FIELDS = ('id', 'document_id', 'chunk_index', 'duplicate_of_id', 'text', 'embedding_model', 'embedding', 'minhash')
+
+
+class _ChunkColumns:
+    """Chunk columns spooled to temporary files, appended to one batch of rows at a time."""
+
+    def __init__(self, stack: contextlib.ExitStack):
+        self._files = {name: stack.enter_context(tempfile.TemporaryFile())
+                       for name in (_CHUNK_IDS, _CHUNK_DOCS, _CHUNK_INDEX, _CHUNK_DUPLICATE_OF, _CHUNK_TEXT,
+                                    _CHUNK_MODELS, _CHUNK_VECTORS, _CHUNK_DIMS, _CHUNK_MINHASH)}
+
+    def add(self, rows) -> List[int]:
+        """Append ``_CHUNK_FIELDS`` rows; returns each row's embedding dimension (0 without one)."""
+        ids, docs, indexes, dups, dims = array('q'), array('q'), array('i'), array('q'), array('i')
+        texts, models, vectors, signatures = [], [], [], []
+        for pk, doc_id, chunk_index, duplicate_of, text, model, blob, minhash in rows:
+            ids.append(pk)
+            docs.append(doc_id)
+            indexes.append(chunk_index or 0)
+            dups.append(duplicate_of or 0)
+            texts.append(json.dumps(text) + "\n")
+            models.append(json.dumps(model or "") + "\n")
+            # Embeddings are concatenated raw; the per-chunk dimension column says how to split them
+            blob = bytes(blob or b"")
+            size = len(blob) // 4
+            dims.append(size)
+            vectors.append(blob[:size * 4])
+            minhash = bytes(minhash or b"")
+            signatures.append(minhash if len(minhash) == _MINHASH_BYTES else _EMPTY_MINHASH)
+        for name, data in ((_CHUNK_IDS, ids.tobytes()), (_CHUNK_DOCS, docs.tobytes()),
+                           (_CHUNK_INDEX, indexes.tobytes()), (_CHUNK_DUPLICATE_OF, dups.tobytes()),
+                           (_CHUNK_TEXT, "".join(texts).encode('utf-8')),
+                           (_CHUNK_MODELS, "".join(models).encode('utf-8')),
+                           (_CHUNK_VECTORS, b"".join(vectors)), (_CHUNK_DIMS, dims.tobytes()),
+                           (_CHUNK_MINHASH, b"".join(signatures))):
+            self._files[name].write(data)
+        return list(dims)
+
+    def files(self):
+        for name, fh in self._files.items():
+            fh.seek(0)
+            yield name, fh
+
+
+def _snapshot_isolation() -> None:
+    # PostgreSQL defaults to READ COMMITTED, where each query sees the rows committed before it;
+    # REPEATABLE READ makes every query of the transaction read one snapshot. MySQL/InnoDB
+    # already defaults to it. Must run before the transaction's first query.
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+
+
+def create_snapshot(path: str) -> Dict[str, Any]:
+    """Write documents, chunk text, raw float32 embeddings and the FAISS index to one compressed archive.
+
+    Returns the manifest that is stored alongside the data.
+    """
+    checksums: Dict[str, Dict[str, Any]] = {}
+    counts = {"documents": 0, "chunks": 0, "embeddings": 0}
+    dim: Optional[int] = None
+    # Chunk columns always line up, since each batch of rows is read once. Documents and chunks
+    # are read in separate queries; the transaction keeps them consistent on SQLite (writers are
+    # serialized) and, with _snapshot_isolation, on PostgreSQL and MySQL
+    outermost = not connection.in_atomic_block
+    with contextlib.ExitStack() as stack, transaction.atomic(), \
+            zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        if outermost:
+            _snapshot_isolation()
+        docs = _Member(zf, _DOCUMENTS)
+        for values in Document.objects.order_by('id').values(*_DOC_FIELDS).iterator(chunk_size=_BATCH):
+            docs.write((json.dumps(_document_row(values)) + "\n").encode('utf-8'))
+            counts["documents"] += 1
+        checksums[_DOCUMENTS] = docs.close()
+
+        # Every column is filled from the same rows, batch by batch in id order, into temporary
+        # files (zipfile allows only one member open for writing) that are then copied in
+        spool = _ChunkColumns(stack)
+        last_id = 0
+        while True:
+            rows = list(DocumentChunk.objects.filter(id__gt=last_id).order_by('id')
+                        .values_list(*_CHUNK_FIELDS)[:_BATCH])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for size in spool.add(rows):
+                counts["chunks"] += 1
+                if size:
+                    counts["embeddings"] += 1
+                    dim = dim or size
+        for name, fh in spool.files():
+            member = _Member(zf, name)
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                member.write(block)
+            checksums[name] = member.close()
+
+        files = index_files()
+        for shard, pair in files.items():
+            for name, data in zip(_shard_members(shard), pair):
+                member = _Member(zf, name)
+                member.write(data)
+                checksums[name] = member.close()
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created_at": timezone.now().isoformat(),
+            "embedding_model": embedding_model(),
+            "embedding_dim": dim,
+            "counts": counts,
+            "has_index": bool(files),
+            "shard_by": shard_by(),
+            "index_shards": sorted(files),
+            "members": checksums,
+        }
+        zf.writestr(_MANIFEST, json.dumps(manifest, indent=2))
+    return manifest
+
+
+def _read_manifest(zf: zipfile.ZipFile) -> Dict[str, Any]:
+    try:
+        manifest = json.loads(zf.read(_MANIFEST))
+    except KeyError:
+        raise SnapshotError("Archive has no manifest.json")
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError("Not a RAG Netscanner snapshot")
+    if int(manifest.get("version", 0)) > SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {manifest.get('version')}")
+    return manifest
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """Check every member against the manifest checksums. Returns the manifest."""
+    with zipfile.ZipFile(path, 'r') as zf:
+        manifest = _read_manifest(zf)
+        for name, expected in manifest.get("members", {}).items():
+            sha = hashlib.sha256()
+            try:
+                with zf.open(name) as fh:
+                    for block in iter(lambda: fh.read(1 << 20), b""):
+                        sha.update(block)
+            except KeyError:
+                raise SnapshotError(f"Missing archive member {name}")
+            if sha.hexdigest() != expected.get("sha256"):
+                raise SnapshotError(f"Checksum mismatch for {name}")
+    return manifest
+
+
+def _read_ints(fh, typecode: str, count: int) -> array:
+    arr = array(typecode)
+    data = fh.read(count * arr.itemsize)
+    arr.frombytes(data)
+    return arr
+
+
+def _iter_chunk_batches(zf: zipfile.ZipFile, default_model: str) -> Iterator[List[DocumentChunk]]:
+    names = set(zf.namelist())
+    with contextlib.ExitStack() as stack:
+        ids_fh, docs_fh, index_fh, dims_fh, vec_fh, text_fh = (
+            stack.enter_context(zf.open(name))
+            for name in (_CHUNK_IDS, _CHUNK_DOCS, _CHUNK_INDEX, _CHUNK_DIMS, _CHUNK_VECTORS, _CHUNK_TEXT)
+        )
+        # Dedup columns were added in version 2
+        dup_fh = stack.enter_context(zf.open(_CHUNK_DUPLICATE_OF)) if _CHUNK_DUPLICATE_OF in names else None
+        sig_fh = stack.enter_context(zf.open(_CHUNK_MINHASH)) if _CHUNK_MINHASH in names else None
+        text_lines = io.TextIOWrapper(text_fh, encoding='utf-8')
+        # Per-chunk models were added in version 3; older archives hold only the manifest's model
+        model_lines = io.TextIOWrapper(stack.enter_context(zf.open(_CHUNK_MODELS)), encoding='utf-8') if _CHUNK_MODELS in names else None
+        while True:
+            ids = _read_ints(ids_fh, 'q', _BATCH)
+            if not ids:
+                return
+            n = len(ids)
+            doc_ids = _read_ints(docs_fh, 'q', n)
+            indexes = _read_ints(index_fh, 'i', n)
+            dims = _read_ints(dims_fh, 'i', n)
+            dups = _read_ints(dup_fh, 'q', n) if dup_fh else array('q', bytes(8 * n))
+            if not (len(doc_ids) == len(indexes) == len(dims) == len(dups) == n):
+                raise SnapshotError("Chunk columns have different lengths")
+            batch = []
+            for pk, doc_id, chunk_index, size, dup in zip(ids, doc_ids, indexes, dims, dups):
+                line = text_lines.readline()
+                if not line:
+                    raise SnapshotError("Chunk text column is truncated")
+                embedding = vec_fh.read(size * 4) if size else b""
+                if len(embedding) != size * 4:
+                    raise SnapshotError("Embedding column is truncated")
+                signature = sig_fh.read(_MINHASH_BYTES) if sig_fh else _EMPTY_MINHASH
+                if model_lines is not None:
+                    model_line = model_lines.readline()
+                    if not model_line:
+                        raise SnapshotError("Embedding model column is truncated")
+                    model = json.loads(model_line)
+                else:
+                    model = default_model if embedding else ""
+                batch.append(DocumentChunk(
+                    id=pk,
+                    document_id=doc_id,
+                    chunk_index=chunk_index,
+                    text=json.loads(line),
+                    embedding=embedding,
+                    embedding_model=model,
+                    minhash=b"" if signature == _EMPTY_MINHASH else signature,
+                    duplicate_of_id=dup or None,
+                ))
+            yield batch
+
+
+def _iter_document_batches(zf: zipfile.ZipFile, default_model: str) -> Iterator[List[Document]]:
+    batch: List[Document] = []
+    with zf.open(_DOCUMENTS) as fh:
+        for raw in io.TextIOWrapper(fh, encoding='utf-8'):
+            if not raw.strip():
+                continue
+            values = json.loads(raw)
+            for name in _DATETIME_FIELDS:
+                if values.get(name):
+                    values[name] = datetime.fromisoformat(values[name])
+            values['description_embedding'] = decode_embedding(values.get('description_embedding')) or b""
+            if 'description_embedding_model' not in values:
+                values['description_embedding_model'] = default_model if values['description_embedding'] else ""
+            batch.append(Document(**values))
+            if len(batch) >= _BATCH:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def restore_snapshot(path: str, verify: bool = True) -> Dict[str, Any]:
+    """Replace the database contents and vector index with a snapshot.
+
+    Primary keys are preserved so the archived FAISS id mapping stays valid and can be
+    swapped in directly; without an archived index it is rebuilt from the restored rows.
+    """
+    manifest = verify_snapshot(path) if verify else None
+    with zipfile.ZipFile(path, 'r') as zf:
+        if manifest is None:
+            manifest = _read_manifest(zf)
+        archived_model = manifest.get("embedding_model") or ""
+        with transaction.atomic():
+            DocumentChunk.objects.all().delete()
+            Document.objects.all().delete()
+            for docs in _iter_document_batches(zf, archived_model):
+                stamps = [(d.created_at, d.updated_at) for d in docs]
+                Document.objects.bulk_create(docs, batch_size=500)
+                # bulk_create applies auto_now/auto_now_add; put the archived timestamps back
+                for d, (created_at, updated_at) in zip(docs, stamps):
+                    d.created_at, d.updated_at = created_at, updated_at
+                Document.objects.bulk_update(docs, ['created_at', 'updated_at'], batch_size=500)
+            for chunks in _iter_chunk_batches(zf, archived_model):
+                DocumentChunk.objects.bulk_create(chunks, batch_size=500)
+                # LSH bands are derived data; rebuild them from the signatures
+                index_chunks(chunks)
+            # Explicit primary keys leave sequences behind on some backends
+            sql = connection.ops.sequence_reset_sql(no_style(), [Document, DocumentChunk])
+            if sql:
+                with connection.cursor() as cursor:
+                    for statement in sql:
+                        cursor.execute(statement)
+
+        # The archived indexes belong to the archive's embedding model and shard layout; they are
+        # only served directly when both are still active
+        index_installed = False
+        if manifest.get("has_index"):
+            if "index_shards" in manifest:
+                layout = manifest.get("shard_by") or "none"
+                members = {shard: _shard_members(shard) for shard in manifest["index_shards"]}
+            else:
+                layout, members = "none", {ALL_SHARD: (_INDEX, _MAPPING)}
+            if layout == shard_by():
+                install_indexes(((shard, zf.read(index_name), zf.read(mapping_name))
+                                 for shard, (index_name, mapping_name) in members.items()),
+                                model=archived_model or None)
+            if layout == shard_by() and (not archived_model or archived_model == embedding_model()):
+                # The document-level index is small; rebuild it rather than archiving it
+                try:
+                    rebuild_document_index()
+                except Exception:
+                    pass
+                index_installed = True
+    if not index_installed:
+        try:
+            rebuild_index_from_db()
+        except Exception:
+            pass
+    return manifest
@@ -1,9 +1,35 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.conf import settings
 import os
+import sys
+import base64
+import io
+import json
 import tempfile
-from .models import Document, DocumentChunk
+import threading
+import zipfile
+from types import SimpleNamespace
+from unittest import mock
+import httpx
+import openai
+from .models import Document, DocumentChunk, ScanShard
+from .embeddings import bytes_from_vector, embedding_model, encode_embedding
+from .ingest import flag_stale_embeddings, reembed_pending
+from .llm import LLMGateway, TokenBucket, _parse_duration
+from . import dedup
+from .context import build_context, count_tokens, merge_overlap
+from .chunking import ChunkProfile, chunk_text, parse_profiles
+from .chunkeval import default_candidates, run_evaluation
+from .snapshot import SnapshotError, create_snapshot, restore_snapshot
+from . import vectorstore
+from . import metrics
+from . import bench
+from . import images
+from . import watch
+from . import scanrun
+from . import warmup
+from .scanner import delete_paths, ingest_entries, scan_entry
 
 
 class APISmokeTests(TestCase):
@@ -19,5 +45,1132 @@ class APISmokeTests(TestCase):
         resp = self.client.post(reverse('scan-directory'), data='{}', content_type='application/json')
         self.assertEqual(resp.status_code, 400)
 
+    def test_open_file_launches_the_platform_opener(self):
+        with tempfile.NamedTemporaryFile(suffix=".txt") as f, mock.patch.object(os, 'name', 'posix'), \
+                mock.patch.object(sys, 'platform', 'linux'), mock.patch('subprocess.Popen') as popen:
+            resp = self.client.post(reverse('open-file'), data=json.dumps({"file_path": f.name}),
+                                    content_type='application/json')
+        self.assertEqual(resp.status_code, 200, resp.content)
+        popen.assert_called_once_with(['xdg-open', f.name])
+        resp = self.client.post(reverse('open-file'), data=json.dumps({"file_path": "/missing/file.txt"}),
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+
+
+class FakeAsyncOpenAI:
+    """Minimal stand-in for AsyncOpenAI returning canned completions and embeddings."""
+
+    def __init__(self, answer="A summary."):
+        self.answer = answer
+        self.chat_calls = []
+        self.embedded = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    async def _chat(self, **kwargs):
+        self.chat_calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f" {self.answer} "))])
+
+    async def _embed(self, model, input):
+        self.embedded.extend(input)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0, float(len(t) % 7), 0.5]) for t in input])
+
+
+@override_settings(OPENAI_API_KEY='sk-test')
+class AsyncPipelineTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(VECTOR_INDEX_DIR=os.path.join(self.tmp.name, 'faiss'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.fake = FakeAsyncOpenAI()
+        for target in ('core.views.get_async_client', 'core.scanner.get_async_client'):
+            patcher = mock.patch(target, return_value=self.fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp.name, 'share', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def _chunk_inputs(self):
+        # Document-level vectors are embedded alongside chunks; keep only chunk texts
+        return [text for text in self.fake.embedded if not text.startswith("File: ")]
+
+    def test_scan_describes_and_embeds_concurrently(self):
+        self._write('a.txt', 'alpha ' * 400)
+        self._write('b.txt', 'beta')
+        self._write('c.bin', '')
+        resp = self.client.post(reverse('scan-directory'), data=json.dumps({"directory": os.path.join(self.tmp.name, 'share')}), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["processed"], 3)
+        self.assertEqual(Document.objects.get(file_name='a.txt').description, "A summary.")
+        self.assertEqual(Document.objects.get(file_name='c.bin').description, "File named c.bin.")
+        self.assertEqual(resp.json()["chunks_added"], DocumentChunk.objects.count())
+        self.assertFalse(DocumentChunk.objects.filter(embedding=b"").exists())
+        # Every document, chunked or not, gets a description vector for the first retrieval stage
+        self.assertFalse(Document.objects.filter(description_embedding=b"").exists())
+        self.assertIn("File: c.bin\nFile named c.bin.", self.fake.embedded)
+
+    def test_scan_and_ask_report_stage_timings(self):
+        self._write('a.txt', 'alpha beta gamma')
+        resp = self.client.post(reverse('scan-directory'), data=json.dumps({"directory": os.path.join(self.tmp.name, 'share')}), content_type='application/json')
+        stages = resp.json()["timings"]["stages"]
+        for name in ("walk", "read", "describe", "embed", "db_write"):
+            self.assertIn(name, stages)
+        self.assertEqual(stages["read"]["bytes"], len('alpha beta gamma'))
+        self.assertGreater(stages["embed"]["tokens"], 0)
+        self.assertEqual(stages["db_write"]["count"], 1)
+
+        resp = self.client.post(reverse('ask-question'), data=json.dumps({"question": "alpha"}), content_type='application/json')
+        stages = resp.json()["timings"]["stages"]
+        for name in ("embed", "context_pack", "generate"):
+            self.assertIn(name, stages)
+        self.assertTrue({"search_chunks", "search_documents"} & set(stages))
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('ragnet_stage_duration_seconds_count{stage="db_write"}', body)
+        self.assertIn('ragnet_operation_duration_seconds_bucket{operation="ask",le="+Inf"}', body)
+
+    def test_ask_is_async_and_uses_shared_client(self):
+        doc = Document.objects.create(file_path="/tmp/q.txt", file_name="q.txt", file_type="text/plain")
+        DocumentChunk.objects.create(document=doc, chunk_index=0, text="abc", embedding_model=embedding_model(), embedding=bytes_from_vector([1.0, 3.0, 0.5]))
+        self.fake.answer = "Grounded answer."
+        resp = self.client.post(reverse('ask-question'), data=json.dumps({"question": "abc"}), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["answer"], "Grounded answer.")
+        self.assertEqual(resp.json()["contexts"][0]["file_name"], "q.txt")
+        self.assertIn("abc", self.fake.chat_calls[0]["messages"][1]["content"])
+
+    def test_scan_flags_files_whose_embeddings_failed(self):
+        self._write('a.txt', 'alpha')
+
+        async def failing_embed(model, input):
+            raise ValueError("boom")
+        self.fake.embeddings = SimpleNamespace(create=failing_embed)
+        resp = self.client.post(reverse('scan-directory'), data=json.dumps({"directory": os.path.join(self.tmp.name, 'share')}), content_type='application/json')
+        self.assertEqual(resp.json()["embedding_failures"], 1)
+        self.assertTrue(Document.objects.get().needs_embedding)
+        self.assertEqual(bytes(DocumentChunk.objects.get().embedding), b"")
+
+    def test_scan_reuses_embeddings_for_near_duplicates(self):
+        base = " ".join(f"clause{i} shall apply to the contractor" for i in range(40))
+        self._write('spec.txt', base)
+        self._write('spec_copy.txt', base + " revised")
+        self._write('other.txt', "completely unrelated words about something else entirely")
+        resp = self.client.post(reverse('scan-directory'), data=json.dumps({"directory": os.path.join(self.tmp.name, 'share')}), content_type='application/json')
+        # Both specs are analyzed side by side, so either one may end up canonical
+        dups = DocumentChunk.objects.filter(duplicate_of__isnull=False)
+        self.assertEqual(resp.json()["chunks_deduplicated"], dups.count())
+        self.assertEqual(dups.count(), DocumentChunk.objects.filter(document__file_name='spec.txt').count())
+        for dup in dups:
+            self.assertEqual({dup.document.file_name, dup.duplicate_of.document.file_name}, {'spec.txt', 'spec_copy.txt'})
+            self.assertEqual(bytes(dup.embedding), bytes(dup.duplicate_of.embedding))
+        # Only canonical chunks were sent to the embeddings API
+        self.assertEqual(len(self._chunk_inputs()), DocumentChunk.objects.filter(duplicate_of__isnull=True).count())
+
+    def test_duplicates_stay_within_their_project(self):
+        spec = " ".join(f"clause{i} shall apply to the contractor" for i in range(40))
+        self._write('alpha/spec.txt', spec)
+        self._write('beta/spec.txt', spec)
+        self._write('beta/notes.txt', "site meeting notes about parking and deliveries")
+        with override_settings(EMBEDDING_BACKEND='hashing', EMBEDDING_DIM=64):
+            for project in ("Alpha", "Beta"):
+                self.client.post(reverse('scan-directory'), data=json.dumps({"directory": os.path.join(self.tmp.name, 'share', project.lower()), "project": project}),
+                                 content_type='application/json')
+            self.assertFalse(DocumentChunk.objects.filter(duplicate_of__isnull=False).exists())
+            resp = self.client.post(reverse('ask-question'), data=json.dumps({"question": "clause7 shall apply to the contractor", "project": "beta"}),
+                                    content_type='application/json')
+        beta_ids = set(Document.objects.filter(project="Beta").values_list('id', flat=True))
+        contexts = resp.json()["contexts"]
+        self.assertTrue(contexts)
+        self.assertTrue(all(c["document_id"] in beta_ids for c in contexts))
+        self.assertEqual(contexts[0]["file_name"], "spec.txt")
+
+    def test_rescan_keeps_chunks_canonical(self):
+        self._write('a.txt', 'alpha beta gamma delta epsilon zeta')
+        payload = json.dumps({"directory": os.path.join(self.tmp.name, 'share')})
+        self.client.post(reverse('scan-directory'), data=payload, content_type='application/json')
+        self.client.post(reverse('scan-directory'), data=payload, content_type='application/json')
+        chunk = DocumentChunk.objects.get()
+        self.assertIsNone(chunk.duplicate_of_id)
+        self.assertEqual(chunk.bands.count(), dedup.BANDS)
+        self.assertEqual(len(self._chunk_inputs()), 1)
+
+    def test_local_backend_embeds_without_the_api(self):
+        self._write('a.txt', 'steel beam schedule for level two')
+        with override_settings(EMBEDDING_BACKEND='hashing', EMBEDDING_DIM=64):
+            self.client.post(reverse('scan-directory'), data=json.dumps({"directory": os.path.join(self.tmp.name, 'share')}), content_type='application/json')
+            resp = self.client.post(reverse('ask-question'), data=json.dumps({"question": "steel beam"}), content_type='application/json')
+        self.assertEqual(self.fake.embedded, [])
+        chunk = DocumentChunk.objects.get()
+        self.assertEqual((chunk.embedding_model, len(chunk.embedding)), ("local-hashing-v1-64", 64 * 4))
+        self.assertEqual(Document.objects.get().description_embedding_model, "local-hashing-v1-64")
+        self.assertEqual(resp.json()["contexts"][0]["file_name"], "a.txt")
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp.name, 'faiss', 'local-hashing-v1-64')))
+
+    def test_ask_rejects_get(self):
+        self.assertEqual(self.client.get(reverse('ask-question')).status_code, 405)
+
+    def test_ask_rejects_non_integer_k(self):
+        resp = self.client.post(reverse('ask-question'), data=json.dumps({"question": "q", "k": "five"}), content_type='application/json')
+        self.assertEqual((resp.status_code, resp.json()), (400, {"error": "k must be an integer"}))
+
+
+def _status_error(cls, status, headers=None):
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "http://test/v1/embeddings"))
+    return cls("error", response=response, body=None)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        patcher = mock.patch.object(metrics, 'registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_breakdown_only_collects_inside_its_block(self):
+        with metrics.timed("outside"):
+            pass
+        with metrics.collect("scan") as breakdown:
+            with metrics.timed("read") as stage:
+                stage.bytes = 10
+                metrics.record_tokens(7)
+            with metrics.timed("read"):
+                pass
+        result = breakdown.as_dict()
+        self.assertEqual(set(result["stages"]), {"read"})
+        self.assertEqual((result["stages"]["read"]["count"], result["stages"]["read"]["bytes"], result["stages"]["read"]["tokens"]), (2, 10, 7))
+        self.assertEqual(self.registry.stages["outside"].count, 1)
+
+    def test_prometheus_histogram_is_cumulative(self):
+        self.registry.observe_stage("embed", 0.002)
+        self.registry.observe_stage("embed", 20.0, tokens=5)
+        text = metrics.render_prometheus({"requests": 3})
+        self.assertIn('ragnet_stage_duration_seconds_bucket{stage="embed",le="0.005"} 1', text)
+        self.assertIn('ragnet_stage_duration_seconds_bucket{stage="embed",le="30.0"} 2', text)
+        self.assertIn('ragnet_stage_duration_seconds_count{stage="embed"} 2', text)
+        self.assertIn('ragnet_stage_tokens_total{stage="embed"} 5', text)
+        self.assertIn('ragnet_openai_calls_total{outcome="requests"} 3', text)
+
+
+class FlakyResource:
+    """Sync resource whose create() raises the queued errors before succeeding."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+class GatewayTests(TestCase):
+    def _gateway(self, **kwargs):
+        params = dict(rpm=6000, tpm=10_000_000, max_concurrency=8, max_retries=3, base_delay=0.001, max_delay=0.01)
+        params.update(kwargs)
+        return LLMGateway(**params)
+
+    def test_retries_rate_limit_and_backs_off_concurrency(self):
+        gateway = self._gateway()
+        resource = FlakyResource(_status_error(openai.RateLimitError, 429, {"retry-after-ms": "5"}),
+                                 _status_error(openai.InternalServerError, 503))
+        self.assertEqual(gateway.call(resource, 10), "ok")
+        self.assertEqual(resource.calls, 3)
+        self.assertEqual(gateway.stats["retries"], 2)
+        self.assertEqual(gateway.concurrency, 4)
+
+    def test_non_retryable_error_raises_immediately(self):
+        gateway = self._gateway()
+        resource = FlakyResource(_status_error(openai.BadRequestError, 400))
+        with self.assertRaises(openai.BadRequestError):
+            gateway.call(resource, 10)
+        self.assertEqual(resource.calls, 1)
+
+    def test_gives_up_after_max_retries(self):
+        gateway = self._gateway(max_retries=1)
+        resource = FlakyResource(*[_status_error(openai.InternalServerError, 500) for _ in range(3)])
+        with self.assertRaises(openai.InternalServerError):
+            gateway.call(resource, 10)
+        self.assertEqual(resource.calls, 2)
+
+    def test_headers_resize_buckets_and_concurrency(self):
+        gateway = self._gateway()
+        gateway.concurrency = 2
+        gateway._observe({"x-ratelimit-limit-requests": "600", "x-ratelimit-remaining-requests": "590",
+                          "x-ratelimit-limit-tokens": "60000", "x-ratelimit-remaining-tokens": "50000"})
+        self.assertEqual(gateway.requests.rate, 10)
+        self.assertEqual(gateway.tokens.capacity, 10000)
+        self.assertEqual(gateway.concurrency, 3)
+
+    def test_waiters_take_freed_slots(self):
+        from asgiref.sync import async_to_sync
+        gateway = self._gateway(max_concurrency=1)
+        self.assertTrue(gateway._try_enter())
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(gateway.call(FlakyResource(), 1)))
+        waiter.start()
+        waiter.join(0.05)
+        self.assertEqual(results, [])
+        gateway._leave()
+        waiter.join(5)
+        self.assertEqual(results, ["ok"])
+
+        self.assertTrue(gateway._try_enter())
+        threading.Timer(0.05, gateway._leave).start()
+
+        async def create(**kwargs):
+            return "ok"
+
+        async def call():
+            return await gateway.acall(SimpleNamespace(create=create), 1)
+
+        self.assertEqual(async_to_sync(call)(), "ok")
+        self.assertEqual((gateway.stats["requests"], gateway._in_flight), (2, 0))
+
+    def test_token_bucket_reports_wait(self):
+        bucket = TokenBucket(rate=10, capacity=10)
+        self.assertEqual(bucket.reserve(10), 0.0)
+        self.assertAlmostEqual(bucket.reserve(5), 0.5, places=1)
+
+    @override_settings(OPENAI_API_KEY='sk-test')
+    def test_async_clients_are_shared_per_loop_and_closed_with_it(self):
+        from asgiref.sync import async_to_sync
+        from .llm import _async_clients, get_async_client
+        clients = []
+
+        async def use():
+            clients.append(get_async_client())
+            clients.append(get_async_client())
+
+        async_to_sync(use)()
+        async_to_sync(use)()
+        self.assertIs(clients[0], clients[1])
+        self.assertIsNot(clients[1], clients[2])
+        self.assertTrue(all(c.is_closed() for c in clients))
+        self.assertEqual(len(_async_clients), 0)
+
+    def test_parse_duration(self):
+        self.assertEqual(_parse_duration("20ms"), 0.02)
+        self.assertEqual(_parse_duration("6m0s"), 360.0)
+        self.assertEqual(_parse_duration("2"), 2.0)
+
+
+class DedupTests(TestCase):
+    def test_similarity_tracks_overlap(self):
+        text = " ".join(f"word{i}" for i in range(200))
+        near = text.replace("word100", "changed")
+        self.assertGreater(dedup.similarity(dedup.minhash(text), dedup.minhash(near)), 0.85)
+        self.assertLess(dedup.similarity(dedup.minhash(text), dedup.minhash("something else entirely here now")), 0.2)
+        self.assertIsNone(dedup.minhash("  ...  "))
+
+    def test_pure_python_matches_numpy(self):
+        if dedup._numpy() is None:
+            self.skipTest("numpy not installed")
+        text = "the quick brown fox jumps over the lazy dog again and again"
+        with_numpy = dedup.minhash(text)
+        with mock.patch.object(dedup, 'np', None):
+            self.assertEqual(dedup.minhash(text), with_numpy)
+
+    def test_collapse_keeps_highest_ranked(self):
+        doc = Document.objects.create(file_path="/tmp/d.txt", file_name="d.txt", file_type="text/plain")
+        text = " ".join(f"term{i}" for i in range(100))
+        a = DocumentChunk(document=doc, chunk_index=0, text=text)
+        b = DocumentChunk(document=doc, chunk_index=1, text=text + " extra")
+        c = DocumentChunk(document=doc, chunk_index=2, text="different content altogether for this chunk")
+        kept = dedup.collapse_near_duplicates([(a, 0.9), (b, 0.8), (c, 0.5)])
+        self.assertEqual([chunk for chunk, _ in kept], [a, c])
+
+
+class ContextPackingTests(TestCase):
+    def setUp(self):
+        self.doc = Document.objects.create(file_path="/tmp/ctx.txt", file_name="ctx.txt", file_type="text/plain")
+        self.other = Document.objects.create(file_path="/tmp/other.txt", file_name="other.txt", file_type="text/plain")
+
+    def _chunks(self, doc, texts, start=0):
+        return [DocumentChunk(document=doc, chunk_index=start + i, text=t) for i, t in enumerate(texts)]
+
+    def test_adjacent_splitter_chunks_merge_without_overlap(self):
+        text = " ".join(f"sentence {i} about the foundation design." for i in range(120))
+        parts = chunk_text(text, "ctx.txt", profiles={"text": ChunkProfile(250, 50)})
+        self.assertEqual(merge_overlap(parts[0], parts[1]), text[:len(merge_overlap(parts[0], parts[1]))])
+        chunks = self._chunks(self.doc, parts[:3])
+        context, _ = build_context([(chunks[1], 0.9), (chunks[0], 0.8), (chunks[2], 0.7)], budget=10_000)
+        self.assertTrue(context.startswith("[Score 0.90] From ctx.txt (chunks 0-2):"))
+        self.assertEqual(context.count("sentence 0 "), 1)
+
+    def test_budget_keeps_best_passages(self):
+        low = self._chunks(self.other, ["filler text " * 200])[0]
+        best = self._chunks(self.doc, ["the answer is forty two"], start=5)[0]
+        context, used = build_context([(low, 0.2), (best, 0.9)], budget=120)
+        self.assertLessEqual(used, 120)
+        self.assertTrue(context.startswith("[Score 0.90] From ctx.txt:\nthe answer is forty two"))
+        self.assertLessEqual(count_tokens(context), 120)
+
+    def test_unrelated_boundary_is_not_glued(self):
+        self.assertEqual(merge_overlap("first part.", "second part."), "first part.\nsecond part.")
+
+
+class ReembedTests(TestCase):
+    def test_reembed_fills_missing_vectors_and_clears_flag(self):
+        doc = Document.objects.create(file_path="/tmp/r.txt", file_name="r.txt", file_type="text/plain", needs_embedding=True)
+        DocumentChunk.objects.create(document=doc, chunk_index=0, text="kept", embedding_model=embedding_model(), embedding=bytes_from_vector([1.0]))
+        DocumentChunk.objects.create(document=doc, chunk_index=1, text="missing", embedding=b"")
+        embeddings = mock.Mock()
+        embeddings.create.return_value = SimpleNamespace(data=[SimpleNamespace(embedding=[0.5])])
+        del embeddings.with_raw_response
+        stats = reembed_pending(SimpleNamespace(embeddings=embeddings))
+        self.assertEqual(stats["chunks_embedded"], 1)
+        self.assertEqual(embeddings.create.call_args.kwargs["input"], ["missing"])
+        self.assertFalse(Document.objects.get().needs_embedding)
+        self.assertFalse(DocumentChunk.objects.filter(embedding=b"").exists())
+
+
+class EmbeddingBackendTests(TestCase):
+    def test_hashing_vectors_are_normalized_and_lexical(self):
+        from .embeddings import HashingEmbeddingBackend
+        backend = HashingEmbeddingBackend(dim=128)
+        a, b, c, a2, _ = backend.embed(None, ["steel beam column", "steel beam", "roof drainage", "steel beam column", ""])
+        dot = lambda x, y: sum(p * q for p, q in zip(x, y))
+        self.assertAlmostEqual(dot(a, a), 1.0, places=5)
+        self.assertEqual(a, a2)
+        self.assertGreater(dot(a, b), dot(a, c))
+
+    @override_settings(EMBEDDING_BACKEND='hashing', EMBEDDING_DIM=16)
+    def test_switching_backends_reembeds_stale_vectors(self):
+        doc = Document.objects.create(file_path="/tmp/m.txt", file_name="m.txt", file_type="text/plain")
+        DocumentChunk.objects.create(document=doc, chunk_index=0, text="old", embedding_model="text-embedding-3-small",
+                                     embedding=bytes_from_vector([1.0, 0.0, 0.0]))
+        self.assertEqual(flag_stale_embeddings(), 1)
+        stats = reembed_pending(client=None)
+        chunk = DocumentChunk.objects.get()
+        self.assertEqual((stats["chunks_embedded"], chunk.embedding_model, len(chunk.embedding)), (1, "local-hashing-v1-16", 64))
+        self.assertFalse(Document.objects.get().needs_embedding)
+
+
+@mock.patch('core.views.rebuild_index_from_db', return_value=False)
+class ImportExportTests(TestCase):
+    def _ndjson(self, *records):
+        return "\n".join(json.dumps(r) for r in records) + "\n"
+
+    def test_ndjson_import_reuses_matching_embeddings(self, _rebuild):
+        vec = encode_embedding(bytes_from_vector([0.1, 0.2, 0.3]))
+        body = self._ndjson(
+            {"type": "header", "embedding_model": settings.OPENAI_EMBEDDING_MODEL, "embedding_dim": 3},
+            {"file_path": "/tmp/a.txt", "file_name": "a.txt", "chunks": [
+                {"index": 0, "text": "alpha", "embedding": vec},
+                {"index": 1, "text": "beta", "embedding": [0.1, 0.2]},
+            ]},
+        )
+        resp = self.client.post(reverse('import-database'), data=body, content_type='application/x-ndjson')
+        self.assertEqual(resp.status_code, 200)
+        stats = resp.json()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["chunks_written"], 2)
+        self.assertEqual(stats["chunks_reused"], 1)
+        self.assertEqual(stats["embeddings_rejected"], 1)
+        chunks = list(DocumentChunk.objects.order_by('chunk_index'))
+        self.assertEqual(len(chunks[0].embedding), 12)
+        self.assertEqual(bytes(chunks[1].embedding), b"")
+
+    def test_ndjson_import_rejects_other_model(self, _rebuild):
+        vec = encode_embedding(bytes_from_vector([0.1, 0.2, 0.3]))
+        body = self._ndjson(
+            {"type": "header", "embedding_model": "some-other-model"},
+            {"file_path": "/tmp/a.txt", "chunks": [{"index": 0, "text": "alpha", "embedding": vec}]},
+        )
+        resp = self.client.post(reverse('import-database'), data=body, content_type='application/x-ndjson')
+        self.assertEqual(resp.json()["chunks_reused"], 0)
+        self.assertEqual(resp.json()["embeddings_rejected"], 1)
+
+    def test_ndjson_round_trip_and_update(self, _rebuild):
+        doc = Document.objects.create(file_path="/tmp/b.txt", file_name="b.txt", file_type="text/plain", project="P1")
+        DocumentChunk.objects.create(document=doc, chunk_index=0, text="hello", embedding_model=embedding_model(), embedding=bytes_from_vector([1.0, 0.0]))
+        resp = self.client.get(reverse('export-database'), {"output": "ndjson"})
+        body = b"".join(resp.streaming_content).decode("utf-8")
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(lines[0]["embedding_dim"], 2)
+        self.assertEqual(lines[1]["file_path"], "/tmp/b.txt")
+
+        resp = self.client.post(reverse('import-database'), data=body, content_type='application/x-ndjson')
+        stats = resp.json()
+        self.assertEqual((stats["created"], stats["updated"], stats["chunks_reused"]), (0, 1, 1))
+        self.assertEqual(DocumentChunk.objects.get().text, "hello")
+
+    def test_ndjson_import_invalid_line(self, _rebuild):
+        resp = self.client.post(reverse('import-database'), data='{"file_path": "/x"}\nnot json\n', content_type='application/x-ndjson')
+        self.assertEqual(resp.status_code, 400)
+        # The pending batch holding /x is dropped, not flushed
+        self.assertEqual(resp.json()["imported"]["created"], 0)
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(DocumentChunk.objects.exists())
+
+    @override_settings(IMPORT_BATCH_SIZE=1)
+    def test_ndjson_import_invalid_line_keeps_flushed_batches(self, _rebuild):
+        body = '{"file_path": "/a", "chunks": [{"text": "alpha"}]}\n{"file_path": "/b"}\nnot json\n'
+        resp = self.client.post(reverse('import-database'), data=body, content_type='application/x-ndjson')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["imported"]["created"], 2)
+        self.assertEqual(sorted(Document.objects.values_list("file_path", flat=True)), ["/a", "/b"])
+        self.assertEqual(DocumentChunk.objects.get().text, "alpha")
+
+    def test_json_import_still_supported(self, _rebuild):
+        body = {"data": [{"file_path": "/tmp/c.txt", "file_name": "c.txt", "chunks": [{"index": 0, "text": "x"}]}]}
+        resp = self.client.post(reverse('import-database'), data=json.dumps(body), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["chunks_written"], 1)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(VECTOR_INDEX_DIR=os.path.join(self.tmp.name, 'faiss'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.archive = os.path.join(self.tmp.name, 'backup.ragsnap')
+
+    def test_round_trip_preserves_rows_and_vectors(self):
+        doc = Document.objects.create(file_path="/tmp/s.txt", file_name="s.txt", file_type="text/plain", project="P")
+        DocumentChunk.objects.create(document=doc, chunk_index=0, text="one \u2713", embedding_model=embedding_model(), embedding=bytes_from_vector([1.0, 0.5]))
+        DocumentChunk.objects.create(document=doc, chunk_index=1, text="two", embedding=b"")
+        updated_at = Document.objects.get().updated_at
+        indexed = vectorstore.rebuild_index_from_db()
+        manifest = create_snapshot(self.archive)
+        self.assertEqual(manifest["counts"], {"documents": 1, "chunks": 2, "embeddings": 1})
+        self.assertEqual(manifest["index_shards"], [vectorstore.shard_for("P")] if indexed else [])
+
+        DocumentChunk.objects.all().delete()
+        Document.objects.all().delete()
+        restore_snapshot(self.archive)
+        restored = Document.objects.get()
+        self.assertEqual((restored.id, restored.project, restored.updated_at), (doc.id, "P", updated_at))
+        chunks = list(DocumentChunk.objects.order_by('chunk_index'))
+        self.assertEqual([c.text for c in chunks], ["one \u2713", "two"])
+        self.assertEqual(bytes(chunks[0].embedding), bytes_from_vector([1.0, 0.5]))
+        self.assertEqual(bytes(chunks[1].embedding), b"")
+        self.assertEqual(vectorstore.list_shards(), manifest["index_shards"])
+
+    def test_install_indexes_keeps_live_shards_until_complete(self):
+        vectorstore.install_indexes([("old", b"old-index", b"[1]")])
+        live = vectorstore._shards_dir()
+
+        def failing():
+            yield "new", b"new-index", b"[2]"
+            raise OSError("archive read failed")
+
+        with self.assertRaises(OSError):
+            vectorstore.install_indexes(failing())
+        self.assertEqual(os.listdir(live.parent), [live.name])
+        self.assertEqual((live / "old" / "index.bin").read_bytes(), b"old-index")
+
+        vectorstore.install_indexes([("new", b"new-index", b"[2]")])
+        self.assertEqual(os.listdir(live.parent), [live.name])
+        self.assertEqual(os.listdir(live), ["new"])
+        self.assertEqual((live / "new" / "mapping.json").read_bytes(), b"[2]")
+
+    def test_chunk_columns_stay_aligned_when_rows_change_between_batches(self):
+        from . import snapshot
+        doc = Document.objects.create(file_path="/tmp/s.txt", file_name="s.txt", file_type="text/plain")
+        for i in range(3):
+            DocumentChunk.objects.create(document=doc, chunk_index=i, text=f"chunk {i}", embedding_model=embedding_model(),
+                                         embedding=bytes_from_vector([float(i), 1.0]))
+        add = snapshot._ChunkColumns.add
+
+        def add_then_write(columns, rows):
+            # A concurrent writer removes an already-read row and adds one with a new vector
+            if rows[0][4] == "chunk 0":
+                DocumentChunk.objects.filter(text="chunk 0").delete()
+                DocumentChunk.objects.create(document=doc, chunk_index=3, text="chunk 3", embedding=b"")
+            return add(columns, rows)
+
+        with mock.patch.object(snapshot, '_BATCH', 1), mock.patch.object(snapshot._ChunkColumns, 'add', add_then_write):
+            manifest = create_snapshot(self.archive)
+        self.assertEqual(manifest["counts"], {"documents": 1, "chunks": 4, "embeddings": 3})
+        restore_snapshot(self.archive)
+        for chunk in DocumentChunk.objects.exclude(chunk_index=3):
+            self.assertEqual(bytes(chunk.embedding), bytes_from_vector([float(chunk.chunk_index), 1.0]))
+            self.assertEqual(chunk.text, f"chunk {chunk.chunk_index}")
+
+    def test_corrupted_archive_is_rejected(self):
+        Document.objects.create(file_path="/tmp/s.txt", file_name="s.txt", file_type="text/plain")
+        create_snapshot(self.archive)
+        tampered = os.path.join(self.tmp.name, 'tampered.ragsnap')
+        with zipfile.ZipFile(self.archive) as src, zipfile.ZipFile(tampered, 'w') as dst:
+            for name in src.namelist():
+                data = src.read(name)
+                dst.writestr(name, data.replace(b"s.txt", b"x.txt") if name == 'documents.ndjson' else data)
+        with self.assertRaises(SnapshotError):
+            restore_snapshot(tampered)
+        self.assertEqual(Document.objects.get().file_name, "s.txt")
+
 
 # Create your tests here.
+
+
+class TwoStageRetrievalTests(TestCase):
+    def setUp(self):
+        if not vectorstore.available():
+            self.skipTest("faiss and numpy are required")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(VECTOR_INDEX_DIR=self.tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _doc(self, name, vector, description="desc"):
+        return Document.objects.create(
+            file_path=f"/tmp/{name}", file_name=name, file_type="text/plain",
+            description=description, description_embedding=bytes_from_vector(vector),
+            description_embedding_model=embedding_model(),
+        )
+
+    def test_chunks_come_only_from_shortlisted_documents(self):
+        near = self._doc("near.txt", [1.0, 0.0, 0.0])
+        far = self._doc("far.txt", [0.0, 1.0, 0.0])
+        image = self._doc("plan.png", [0.9, 0.1, 0.0], description="Floor plan of level 2.")
+        DocumentChunk.objects.create(document=near, chunk_index=0, text="near text", embedding_model=embedding_model(), embedding=bytes_from_vector([0.8, 0.2, 0.0]))
+        # Closest chunk overall, but its document is not shortlisted
+        DocumentChunk.objects.create(document=far, chunk_index=0, text="far text", embedding_model=embedding_model(), embedding=bytes_from_vector([1.0, 0.0, 0.0]))
+        vectorstore.rebuild_document_index()
+
+        results = vectorstore.search_two_stage([1.0, 0.0, 0.0], k=5, candidate_docs=2)
+        self.assertEqual({c.document.file_name for c, _ in results}, {"near.txt", "plan.png"})
+        pseudo = next(c for c, _ in results if c.document_id == image.id)
+        self.assertEqual((pseudo.id, pseudo.chunk_index, pseudo.text), (None, -1, "Floor plan of level 2."))
+
+    def test_documents_without_a_document_vector_still_compete(self):
+        near = self._doc("near.txt", [1.0, 0.0, 0.0])
+        DocumentChunk.objects.create(document=near, chunk_index=0, text="near text", embedding_model=embedding_model(), embedding=bytes_from_vector([0.6, 0.4, 0.0]))
+        # Scanned before document vectors existed; one shares a shard with near.txt, one is alone in its shard
+        for name, project, vector in (("legacy.txt", "", [1.0, 0.0, 0.0]), ("old.txt", "Archive", [0.9, 0.1, 0.0])):
+            doc = Document.objects.create(file_path=f"/tmp/{name}", file_name=name, file_type="text/plain", project=project)
+            DocumentChunk.objects.create(document=doc, chunk_index=0, text=name, embedding_model=embedding_model(), embedding=bytes_from_vector(vector))
+        vectorstore.rebuild_index_from_db()
+
+        results = vectorstore.search_two_stage([1.0, 0.0, 0.0], k=5, candidate_docs=1)
+        self.assertEqual([c.document.file_name for c, _ in results], ["legacy.txt", "old.txt", "near.txt"])
+        Document.objects.exclude(file_name="near.txt").update(description_embedding=bytes_from_vector([0.0, 0.0, 1.0]),
+                                                               description_embedding_model=embedding_model())
+        vectorstore.rebuild_index_from_db()
+        self.assertEqual(vectorstore.search_two_stage([1.0, 0.0, 0.0], k=5, candidate_docs=1)[0][0].document.file_name, "near.txt")
+
+    def test_without_document_index_returns_none(self):
+        self.assertIsNone(vectorstore.search_two_stage([1.0, 0.0], k=3))
+
+
+class ShardedIndexTests(TestCase):
+    def setUp(self):
+        if not vectorstore.available():
+            self.skipTest("faiss and numpy are required")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(VECTOR_INDEX_DIR=self.tmp.name, VECTOR_SHARD_BY='project')
+        override.enable()
+        self.addCleanup(override.disable)
+        vectorstore.shard_cache.clear()
+        self.addCleanup(vectorstore.shard_cache.clear)
+
+    def _chunk(self, project, name, vector):
+        doc, _ = Document.objects.get_or_create(file_path=f"/{project}/{name}", defaults=dict(
+            file_name=name, file_type="text/plain", project=project))
+        return DocumentChunk.objects.create(document=doc, chunk_index=doc.chunks.count(), text=name,
+                                            embedding_model=embedding_model(), embedding=bytes_from_vector(vector))
+
+    def test_scoped_query_loads_only_its_shard_and_global_query_merges_all(self):
+        self._chunk("Alpha", "a1.txt", [1.0, 0.0, 0.0])
+        self._chunk("Alpha", "a2.txt", [0.6, 0.8, 0.0])
+        self._chunk("Beta", "b1.txt", [0.9, 0.1, 0.0])
+        self._chunk("", "loose.txt", [0.0, 0.0, 1.0])
+        vectorstore.rebuild_index_from_db()
+        self.assertEqual(len(vectorstore.list_shards()), 3)
+
+        results = vectorstore.search_similar_chunks([1.0, 0.0, 0.0], k=5, project="bet")
+        self.assertEqual([c.text for c, _ in results], ["b1.txt"])
+        beta, alpha = vectorstore._shard_paths(vectorstore.shard_for("Beta"))[0], vectorstore._shard_paths(vectorstore.shard_for("Alpha"))[0]
+        self.assertIn(beta, vectorstore.shard_cache)
+        self.assertNotIn(alpha, vectorstore.shard_cache)
+
+        results = vectorstore.search_similar_chunks([1.0, 0.0, 0.0], k=3)
+        self.assertEqual([c.text for c, _ in results], ["a1.txt", "b1.txt", "a2.txt"])
+        self.assertEqual(vectorstore.shard_cache.loads, 3)
+
+    def test_cache_evicts_least_recently_used_shards_within_budget(self):
+        self._chunk("Alpha", "a.txt", [1.0, 0.0])
+        self._chunk("Beta", "b.txt", [0.0, 1.0])
+        vectorstore.rebuild_index_from_db()
+        alpha, beta = (vectorstore._shard_paths(vectorstore.shard_for(p)) for p in ("Alpha", "Beta"))
+        # One 2-d vector plus its id is 16 bytes; room for a single shard
+        cache = vectorstore.ShardCache(budget_bytes=20)
+        cache.get(alpha)
+        cache.get(beta)
+        self.assertEqual((alpha[0] in cache, beta[0] in cache, cache.evictions), (False, True, 1))
+
+        # A rewritten shard is reloaded on its next use
+        self._chunk("Beta", "b2.txt", [0.5, 0.5])
+        vectorstore.rebuild_index_from_db([vectorstore.shard_for("Beta")])
+        index, ids = cache.get(beta)
+        self.assertEqual((index.ntotal, cache.loads), (2, 3))
+
+    def test_incremental_changes_touch_only_the_owning_shard(self):
+        a = self._chunk("Alpha", "a.txt", [1.0, 0.0])
+        self._chunk("Beta", "b.txt", [0.0, 1.0])
+        vectorstore.rebuild_index_from_db()
+        beta_index = vectorstore._shard_paths(vectorstore.shard_for("Beta"))[0]
+        beta_mtime = beta_index.stat().st_mtime_ns
+        added = self._chunk("Gamma", "g.txt", [0.7, 0.7])
+        vectorstore.apply_index_changes([a.id], [added.id])
+        a.document.delete()
+        self.assertEqual(vectorstore.list_shards(), sorted([vectorstore.shard_for("Beta"), vectorstore.shard_for("Gamma")]))
+        self.assertEqual(beta_index.stat().st_mtime_ns, beta_mtime)
+        results = vectorstore.search_similar_chunks([1.0, 0.0], k=5)
+        self.assertEqual([c.text for c, _ in results], ["g.txt", "b.txt"])
+
+
+    def test_duplicates_of_another_shards_chunk_are_indexed_in_their_own(self):
+        canonical = self._chunk("Alpha", "a.txt", [1.0, 0.0])
+        local = self._chunk("Alpha", "a_copy.txt", [1.0, 0.0])
+        remote = self._chunk("Beta", "b_copy.txt", [1.0, 0.0])
+        DocumentChunk.objects.filter(id__in=[local.id, remote.id]).update(duplicate_of=canonical)
+        vectorstore.rebuild_index_from_db()
+        self.assertEqual([c.text for c, _ in vectorstore.search_similar_chunks([1.0, 0.0], k=5, project="alpha")], ["a.txt"])
+        self.assertEqual([c.text for c, _ in vectorstore.search_similar_chunks([1.0, 0.0], k=5, project="beta")], ["b_copy.txt"])
+
+        added = self._chunk("Gamma", "g_copy.txt", [1.0, 0.0])
+        DocumentChunk.objects.filter(id=added.id).update(duplicate_of=canonical)
+        vectorstore.apply_index_changes([], [added.id])
+        self.assertEqual([c.text for c, _ in vectorstore.search_similar_chunks([1.0, 0.0], k=5, project="gamma")], ["g_copy.txt"])
+
+class BenchTests(TestCase):
+    def test_fake_server_serves_sdk_clients(self):
+        from .embeddings import embed_texts
+        from .llm import chat, get_client, reset_clients
+        with bench.FakeOpenAIServer(dim=8) as server, override_settings(OPENAI_API_KEY="x", OPENAI_BASE_URL=server.base_url):
+            reset_clients()
+            self.addCleanup(reset_clients)
+            vectors = embed_texts(get_client(), ["a", "b", "a"])
+            answer = chat(get_client(), model="m", messages=[{"role": "user", "content": "hi"}])
+        self.assertEqual([len(v) for v in vectors], [8, 8, 8])
+        self.assertEqual(vectors[0], vectors[2])
+        self.assertEqual(answer.choices[0].message.content, "Synthetic benchmark answer.")
+        self.assertEqual(server.stats["inputs"], 3)
+
+    def test_generated_tree_is_readable(self):
+        from .scanner import read_text_from_file
+        with tempfile.TemporaryDirectory() as root:
+            counts = bench.generate_tree(root, files=20, seed=1)
+            self.assertEqual(counts["text"] + counts["pdf"] + counts["image"], 20)
+            pdfs = [os.path.join(d, f) for d, _, files in os.walk(root) for f in files if f.endswith(".pdf")]
+            self.assertTrue(pdfs)
+            words = read_text_from_file(pdfs[0]).split()
+            self.assertTrue(words)
+            self.assertTrue(set(words) <= set(bench._WORDS))
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        baseline = {"results": [
+            {"name": "scan", "files_per_sec": 100.0},
+            {"name": "ask", "chunks": 10000, "p50_ms": 10.0, "p99_ms": 50.0},
+        ]}
+        current = {"results": [
+            {"name": "scan", "files_per_sec": 90.0},
+            {"name": "ask", "chunks": 10000, "p50_ms": 10.5, "p99_ms": 80.0},
+        ]}
+        self.assertEqual(bench.compare_results(current, baseline, tolerance=0.2), ["ask@10000 p99_ms: 50.0 -> 80.0 (+60% worse)"])
+        self.assertEqual(bench.percentile([5, 1, 3, 2, 4], 50), 3)
+
+
+class ChunkingTests(TestCase):
+    def test_formats_split_along_their_structure(self):
+        profiles = {name: ChunkProfile(64, 0) for name in ("pdf", "markdown", "code", "csv", "text")}
+        pages = ["Page one is short.", "Page two is short.", " ".join(f"Clause {i} applies." for i in range(80))]
+        pdf = chunk_text("\f".join(pages), "spec.pdf", profiles=profiles)
+        self.assertEqual(pdf[0], "Page one is short.\n\nPage two is short.")
+        self.assertTrue(pdf[1].startswith("Clause 0 applies."))
+
+        markdown = "# Spec\n\n## Concrete\n" + " ".join(f"Mix {i} is C30." for i in range(60)) + "\n## Steel\nS355.\n"
+        sections = chunk_text(markdown, "spec.md", profiles=profiles)
+        self.assertTrue(all(c.startswith("# Spec\n## Concrete\n") for c in sections[1:-1]))
+        self.assertIn("## Steel\nS355.", sections[-1])
+
+        rows = chunk_text("id,item\n" + "".join(f"{i},beam {i}\n" for i in range(100)), "bom.csv", profiles=profiles)
+        self.assertGreater(len(rows), 1)
+        self.assertTrue(all(c.startswith("id,item\n") for c in rows))
+
+        code = "def load(path):\n" + "".join(f"    value_{i} = read(path, {i})\n" for i in range(40))
+        blocks = chunk_text(code, "load.py", profiles=profiles)
+        self.assertTrue(all(c.startswith("def load(path):\n    value_") for c in blocks))
+
+    def test_chunks_are_sized_in_tokens_with_per_format_overlap(self):
+        text = " ".join(f"sentence {i} about the foundation design." for i in range(120))
+        with override_settings(CHUNK_PROFILES="text=64:16,pdf=64:0"):
+            overlapping = chunk_text(text, "notes.txt")
+            pages = chunk_text(text, "notes.pdf")
+        self.assertTrue(all(count_tokens(c) <= 64 for c in overlapping + pages))
+        # Text chunks repeat the end of the previous chunk; PDF chunks don't
+        self.assertTrue(text.startswith(merge_overlap(overlapping[0], overlapping[1])))
+        self.assertEqual(merge_overlap(pages[0], pages[1]), pages[0] + "\n" + pages[1])
+        self.assertEqual(len(chunk_text(text, "notes.txt", limit=2)), 2)
+        with self.assertRaises(ValueError):
+            parse_profiles("pdf=400:500")
+
+    def test_malformed_profiles_fail_at_startup(self):
+        from django.apps import apps
+        from django.core.exceptions import ImproperlyConfigured
+        for value, bad in (("pdf=400:0,txt=300", "'txt'"), ("text=250:25,pdf=many", "'pdf=many'"), ("code=300:300", "'code=300:300'")):
+            with override_settings(CHUNK_PROFILES=value), self.assertRaisesMessage(ImproperlyConfigured, bad):
+                apps.get_app_config('core').ready()
+        with override_settings(CHUNK_PROFILES="pdf=600:0"):
+            apps.get_app_config('core').ready()
+
+    def test_evaluation_reports_chunks_and_recall_per_candidate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for n in range(4):
+                with open(os.path.join(tmp, f"spec{n}.md"), "w", encoding="utf-8") as f:
+                    for s in range(6):
+                        f.write(f"## Section {s}\n")
+                        f.write(" ".join(f"Item {n}-{s}-{i} requires grade {i * 7 + n} anchors near bay {s}." for i in range(8)))
+                        f.write("\n\n")
+            report = run_evaluation(tmp, default_candidates([2.0]), queries=40)
+        self.assertEqual(report["files"], 4)
+        by_name = {r["name"]: r for r in report["results"]}
+        self.assertEqual(set(by_name), {"legacy", "current", "x2"})
+        self.assertLess(by_name["x2"]["chunks"], by_name["current"]["chunks"])
+        self.assertEqual(by_name["current"]["chunks_by_format"], {"markdown": by_name["current"]["chunks"]})
+        self.assertGreater(by_name["current"]["passage_recall"], 0.5)
+        self.assertIn(report["recommended"], {"current", "x2"})
+
+
+class StartupTests(TestCase):
+    def test_startup_defers_heavy_imports(self):
+        result = bench.bench_startup(runs=1)
+        self.assertEqual(result["heavy_imports"], [])
+
+    def test_warm_up_runs_only_in_serving_processes(self):
+        with override_settings(WARMUP_ON_START=True), mock.patch.object(sys, 'argv', ['manage.py', 'migrate']):
+            self.assertFalse(warmup.serving_process())
+            self.assertIsNone(warmup.start_warmup())
+        with mock.patch.object(sys, 'argv', ['manage.py', 'runserver', '--noreload']):
+            self.assertTrue(warmup.serving_process())
+            self.assertIsNone(warmup.start_warmup())  # WARMUP_ON_START is off by default
+
+    def test_warm_up_preloads_index_shards(self):
+        if not vectorstore.available():
+            self.skipTest("faiss and numpy are required")
+        with tempfile.TemporaryDirectory() as tmp, override_settings(VECTOR_INDEX_DIR=tmp):
+            doc = Document.objects.create(file_path="/w/a.txt", file_name="a.txt", file_type="text/plain", project="P",
+                                          description_embedding=bytes_from_vector([1.0, 0.0]),
+                                          description_embedding_model=embedding_model())
+            DocumentChunk.objects.create(document=doc, chunk_index=0, text="a", embedding_model=embedding_model(),
+                                         embedding=bytes_from_vector([1.0, 0.0]))
+            vectorstore.rebuild_index_from_db()
+            vectorstore.shard_cache.clear()
+            self.addCleanup(vectorstore.shard_cache.clear)
+            result = warmup.warm_up()
+            self.assertEqual(result["shards"], 2)
+            self.assertIn(vectorstore._shard_paths(vectorstore.shard_for("P"))[0], vectorstore.shard_cache)
+            self.assertIn("numpy", result["modules"])
+
+
+@override_settings(OPENAI_API_KEY='sk-test')
+class WatchTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = os.path.join(self.tmp.name, 'share')
+        os.makedirs(self.root)
+        override = override_settings(VECTOR_INDEX_DIR=os.path.join(self.tmp.name, 'faiss'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.fake = FakeAsyncOpenAI()
+        patcher = mock.patch('core.scanner.get_async_client', return_value=self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write(self, name, content):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def _indexed_ids(self):
+        ids = set()
+        for shard in vectorstore.list_shards():
+            with open(vectorstore._shard_paths(shard)[1], 'r', encoding='utf-8') as f:
+                ids.update(json.load(f))
+        return ids
+
+    def test_debouncer_waits_for_quiet_period_and_keeps_latest_change(self):
+        now = [0.0]
+        debouncer = watch.Debouncer(2.0, max_delay=10.0, clock=lambda: now[0])
+        debouncer.add(watch.CHANGED, "/r/a.txt")
+        debouncer.add(watch.CHANGED, "/r/sub/b.txt")
+        now[0] = 1.5
+        debouncer.add(watch.DELETED, "/r/a.txt")
+        self.assertFalse(debouncer.ready())
+        self.assertAlmostEqual(debouncer.timeout(), 2.0)
+        debouncer.add(watch.DELETED_DIR, "/r/sub")
+        now[0] = 3.5
+        self.assertTrue(debouncer.ready())
+        self.assertEqual(debouncer.drain(), {"/r/a.txt": watch.DELETED, "/r/sub": watch.DELETED_DIR})
+        self.assertIsNone(debouncer.timeout())
+
+        # A steady stream of changes is still flushed after max_delay
+        for t in range(0, 12):
+            now[0] = 10.0 + t
+            debouncer.add(watch.CHANGED, f"/r/{t}.txt")
+        self.assertTrue(debouncer.ready())
+
+    def test_polling_watcher_reports_created_modified_and_deleted_files(self):
+        now = [0.0]
+        keep = self._write('keep.txt', 'one')
+        gone = self._write('gone.txt', 'two')
+        self._write('node_modules/dep.js', 'ignored')
+        watcher = watch.PollingWatcher([self.root], interval=30, clock=lambda: now[0])
+        self._write('keep.txt', 'one plus more')
+        os.remove(gone)
+        new = self._write('new.txt', 'three')
+        self.assertEqual(watcher.poll(), [])  # not due yet
+        now[0] = 30
+        self.assertEqual(set(watcher.poll()), {(watch.CHANGED, keep), (watch.CHANGED, new), (watch.DELETED, gone)})
+        now[0] = 60
+        self.assertEqual(watcher.poll(), [])
+
+    def test_inotify_watcher_reports_writes_moves_and_deletes(self):
+        if not watch.inotify_available():
+            self.skipTest("inotify is not available")
+        watcher = watch.InotifyWatcher([self.root])
+        self.addCleanup(watcher.close)
+        path = self._write('a.txt', 'alpha')
+        self.assertIn((watch.CHANGED, path), watch.wait_for_changes([watcher], 1.0))
+        moved = os.path.join(self.tmp.name, 'elsewhere')
+        os.makedirs(os.path.join(self.root, 'sub'))
+        self._write('sub/b.txt', 'beta')
+        watch.wait_for_changes([watcher], 0.2)
+        os.rename(os.path.join(self.root, 'sub'), moved)
+        os.remove(path)
+        changes = watch.wait_for_changes([watcher], 1.0)
+        self.assertIn((watch.DELETED_DIR, os.path.join(self.root, 'sub')), changes)
+        self.assertIn((watch.DELETED, path), changes)
+        os.rename(moved, os.path.join(self.root, 'back'))
+        self.assertIn((watch.CHANGED, os.path.join(self.root, 'back', 'b.txt')), watch.wait_for_changes([watcher], 1.0))
+
+    def test_apply_changes_ingests_skips_and_deletes(self):
+        a = self._write('a.txt', 'alpha beta gamma')
+        b = self._write('sub/b.txt', 'delta epsilon')
+        result = watch.apply_changes({a: watch.CHANGED, b: watch.CHANGED}, project="P1")
+        self.assertEqual((result["processed"], result["created"]), (2, 2))
+        self.assertEqual(Document.objects.get(file_path=a).project, "P1")
+        chunk_ids = set(DocumentChunk.objects.values_list('id', flat=True))
+        if vectorstore.available():
+            self.assertEqual(self._indexed_ids(), chunk_ids)
+
+        # Unchanged files cost nothing; a rewritten one replaces its chunks in the index
+        result = watch.apply_changes({b: watch.CHANGED})
+        self.assertEqual((result["processed"], result["skipped"]), (0, 1))
+        self._write('a.txt', 'alpha beta gamma rewritten')
+        os.utime(a, (1, 1))
+        watch.apply_changes({a: watch.CHANGED})
+        old_a = chunk_ids - set(DocumentChunk.objects.filter(document__file_path=b).values_list('id', flat=True))
+        self.assertFalse(DocumentChunk.objects.filter(id__in=old_a).exists())
+
+        os.remove(a)
+        result = watch.apply_changes({a: watch.CHANGED, os.path.join(self.root, 'sub'): watch.DELETED_DIR})
+        self.assertEqual(result["deleted"], 2)
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(DocumentChunk.objects.exists())
+        if vectorstore.available():
+            self.assertEqual(self._indexed_ids(), set())
+
+    def test_deleting_a_canonical_chunk_promotes_its_duplicates(self):
+        original = Document.objects.create(file_path="/w/orig.txt", file_name="orig.txt", file_type="text/plain")
+        copy = Document.objects.create(file_path="/w/copy.txt", file_name="copy.txt", file_type="text/plain")
+        sig = dedup.signature_bytes(dedup.minhash("the same clause in both files " * 5))
+        blob = bytes_from_vector([1.0, 0.0, 0.0])
+        canonical = DocumentChunk.objects.create(document=original, chunk_index=0, text="x", embedding=blob,
+                                                 embedding_model=embedding_model(), minhash=sig)
+        dup = DocumentChunk.objects.create(document=copy, chunk_index=0, text="x", embedding=blob,
+                                           embedding_model=embedding_model(), minhash=sig, duplicate_of=canonical)
+        deleted, removed, promoted, shards = delete_paths(["/w/orig.txt"])
+        self.assertEqual((deleted, removed, promoted), (1, [canonical.id], [dup.id]))
+        self.assertEqual(shards, {vectorstore.shard_for("", "")})
+        dup.refresh_from_db()
+        self.assertIsNone(dup.duplicate_of_id)
+        self.assertEqual(dup.bands.count(), dedup.BANDS)
+
+
+@override_settings(OPENAI_API_KEY='sk-test')
+class ScanRunTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = os.path.join(self.tmp.name, 'share')
+        override = override_settings(VECTOR_INDEX_DIR=os.path.join(self.tmp.name, 'faiss'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.fake = FakeAsyncOpenAI()
+        patcher = mock.patch('core.scanner.get_async_client', return_value=self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write(self, name, content="text"):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def _covered(self, run):
+        return [e.path for shard in run.shards.all() for e in scanrun.shard_entries(shard)]
+
+    def test_shards_cover_every_file_once_even_after_new_files(self):
+        paths = {self._write(f"f{i:02d}.txt") for i in range(25)} | {self._write("sub/a.txt"), self._write(".git/x")}
+        paths.discard(os.path.join(self.root, ".git", "x"))
+        run, resumed = scanrun.start_run(self.root)
+        self.assertFalse(resumed)
+        ScanShard.objects.bulk_create(ScanShard(run=run, directory=d, start_name=a, stop_name=b)
+                                      for d, a, b in scanrun.iter_shard_plan(self.root, 10))
+        self.assertEqual(run.shards.count(), 4)
+        self.assertEqual(sorted(self._covered(run)), sorted(paths))
+        # Names sorting before, between and after the planned ranges
+        paths |= {self._write(name) for name in ("a.txt", "f09b.txt", "zz.txt")}
+        self.assertEqual(sorted(self._covered(run)), sorted(paths))
+
+    def test_interrupted_run_resumes_without_redoing_finished_work(self):
+        for i in range(4):
+            self._write(f"f{i}.txt", f"content number {i}")
+        run, _ = scanrun.start_run(self.root, project="P")
+        calls = []
+
+        def crash_on_second_shard(entries, **kwargs):
+            calls.append(entries)
+            if len(calls) > 1:
+                raise KeyboardInterrupt
+            return ingest_entries(entries, **kwargs)
+
+        with mock.patch('core.scanrun.ingest_entries', side_effect=crash_on_second_shard):
+            with self.assertRaises(KeyboardInterrupt):
+                scanrun.execute_run(run, workers=1, shard_size=2)
+        self.assertEqual(list(run.shards.order_by('id').values_list('status', flat=True)), [ScanShard.DONE, ScanShard.RUNNING])
+        # One file of the unfinished shard was committed before the crash
+        f2 = scan_entry(os.path.join(self.root, "f2.txt"))
+        ingest_entries([f2], project="P")
+        described = len(self.fake.chat_calls)
+
+        resumed_run, resumed = scanrun.start_run(self.root)
+        self.assertEqual((resumed_run.id, resumed), (run.id, True))
+        totals = scanrun.execute_run(resumed_run, workers=1, shard_size=2)
+        self.assertEqual((totals["processed"], totals["skipped"]), (1, 1))
+        self.assertEqual(len(self.fake.chat_calls), described + 1)
+        self.assertEqual(set(Document.objects.values_list('project', flat=True)), {"P"})
+        self.assertEqual(Document.objects.count(), 4)
+        resumed_run.refresh_from_db()
+        self.assertIsNotNone(resumed_run.finished_at)
+        self.assertFalse(scanrun.start_run(self.root)[1])
+
+
+@override_settings(OPENAI_API_KEY='sk-test', IMAGE_MAX_DIMENSION=256)
+class ImageTests(TestCase):
+    def setUp(self):
+        if images.Image is None:
+            self.skipTest("Pillow is required")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = os.path.join(self.tmp.name, 'share')
+        os.makedirs(self.root)
+        override = override_settings(VECTOR_INDEX_DIR=os.path.join(self.tmp.name, 'faiss'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.fake = FakeAsyncOpenAI(answer="A company logo.")
+        patcher = mock.patch('core.scanner.get_async_client', return_value=self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _image(self, name, seed, size=(1600, 1200)):
+        import random
+        from PIL import ImageDraw
+        rng = random.Random(seed)
+        image = images.Image.new("RGB", size, (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        for _ in range(30):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.rectangle([x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 400)],
+                           fill=tuple(rng.randrange(256) for _ in range(3)))
+        path = os.path.join(self.root, name)
+        image.save(path)
+        return path
+
+    def _vision_calls(self):
+        return [c for c in self.fake.chat_calls if isinstance(c["messages"][1]["content"], list)]
+
+    def _invoice(self, name, number):
+        from PIL import ImageDraw
+        image = images.Image.new("RGB", (1240, 1754), (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle([80, 80, 1160, 240], outline=(0, 0, 0), width=4)
+        for row in range(12):
+            draw.line([80, 400 + row * 80, 1160, 400 + row * 80], fill=(0, 0, 0), width=2)
+            draw.text((100, 420 + row * 80), f"Item {number}-{row}  qty {row + number}  EUR {17 * row + number}.00", fill=(0, 0, 0))
+        draw.text((100, 140), f"INVOICE {number:05d}", fill=(0, 0, 0))
+        path = os.path.join(self.root, name)
+        image.save(path)
+        return path
+
+    def test_large_images_are_downscaled_and_exact_copies_share_a_key(self):
+        png = self._image("plan.png", seed=1)
+        prepared = images.prepare_image(png, "image/png")
+        self.assertTrue(prepared.data_url.startswith("data:image/jpeg;base64,"))
+        self.assertLess(len(prepared.data_url), prepared.original_bytes)
+        with images.Image.open(io.BytesIO(base64.b64decode(prepared.data_url.split(",", 1)[1]))) as sent:
+            self.assertEqual(sent.size, (256, 192))
+        with images.Image.open(png) as original:
+            original.save(os.path.join(self.root, "plan.bmp"))
+            original.save(os.path.join(self.root, "plan.jpg"), quality=90)
+        self.assertEqual(images.prepare_image(os.path.join(self.root, "plan.bmp"), "image/bmp").key, prepared.key)
+        # A lossy re-encode changes the pixels, so it is described on its own
+        self.assertNotEqual(images.prepare_image(os.path.join(self.root, "plan.jpg"), "image/jpeg").key, prepared.key)
+        self.assertNotEqual(images.prepare_image(self._image("other.png", seed=2), "image/png").key, prepared.key)
+
+    def test_pages_with_the_same_layout_get_their_own_descriptions(self):
+        keys = {images.prepare_image(self._invoice(f"invoice{n}.png", n), "image/png").key for n in range(3)}
+        self.assertEqual(len(keys), 3)
+        self.client.post(reverse('scan-directory'), data=json.dumps({"directory": self.root}), content_type='application/json')
+        self.assertEqual(len(self._vision_calls()), 3)
+        self.assertEqual(images.ImageDescription.objects.count(), 3)
+
+    def test_waiting_copies_retry_when_the_first_description_fails(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        cache = images.ImageDescriptionCache()
+        attempts = []
+
+        async def describe():
+            attempts.append(len(attempts))
+            await asyncio.sleep(0.01)
+            return "" if len(attempts) == 1 else "A stamp."
+
+        async def run():
+            return await asyncio.gather(*(cache.get("pixels:abc", "concise", describe) for _ in range(3)))
+
+        self.assertEqual(async_to_sync(run)(), ["", "A stamp.", "A stamp."])
+        self.assertEqual(len(attempts), 2)
+
+    def test_identical_images_are_described_once(self):
+        for i in range(4):
+            self._image(f"logo{i}.png", seed=7)
+        self._image("photo.png", seed=8)
+        payload = json.dumps({"directory": self.root})
+        resp = self.client.post(reverse('scan-directory'), data=payload, content_type='application/json')
+        self.assertEqual(len(self._vision_calls()), 2)
+        self.assertEqual(resp.json()["timings"]["stages"]["describe_image"]["count"], 2)
+        self.assertEqual(set(Document.objects.values_list('description', flat=True)), {"A company logo."})
+        # Later scans reuse the stored descriptions
+        self.client.post(reverse('scan-directory'), data=payload, content_type='application/json')
+        self.assertEqual(len(self._vision_calls()), 2)
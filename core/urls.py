@@ -9,6 +9,7 @@ urlpatterns = [
     path('import/', views.import_database, name='import-database'),
     path('clear/', views.clear_database, name='clear-database'),
     path('open/', views.open_file, name='open-file'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
 
 
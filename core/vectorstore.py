@@ -1,34 +1,136 @@
+"""FAISS indexes over chunk and document description embeddings.
+
+Vectors are split into shards by project (or contractor, see ``VECTOR_SHARD_BY``), each persisted
+under ``VECTOR_INDEX_DIR/<model>/<shard_by>/<shard>/`` and rebuilt or patched on its own. Loaded
+shards are kept in a process-wide LRU cache bounded by ``VECTOR_CACHE_MB`` and reloaded when their
+files change on disk. A query filtered by the shard field only searches the matching shards;
+an unfiltered one searches every shard in parallel and merges the top k.
+"""
+import contextvars
+import hashlib
+import heapq
 import os
+import re
 import json
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from django.conf import settings
+from django.db.models import Q
+
+from .embeddings import embedding_model
+from .lazy import NOT_LOADED, optional_import
+from .metrics import timed
+from .models import Document, DocumentChunk
+
+# Both optional (numpy is missing on some Windows setups) and imported on first use; see available()
+np = NOT_LOADED
+faiss = NOT_LOADED
+
 
-try:
-    import numpy as np  # type: ignore
-except Exception:  # pragma: no cover
-    np = None  # numpy is optional on some Windows setups
+def available() -> bool:
+    """Import numpy and faiss if not done yet; False when either is missing."""
+    global np, faiss
+    if np is NOT_LOADED:
+        np = optional_import('numpy')
+    if faiss is NOT_LOADED:
+        faiss = optional_import('faiss')
+    return np is not None and faiss is not None
 
-try:
-    import faiss  # type: ignore
-except Exception:  # pragma: no cover
-    faiss = None  # allows import without faiss installed
+SHARD_FIELDS = ("project", "contractor")
+# Shard of every vector when VECTOR_SHARD_BY is "none", and of documents with an empty shard field
+ALL_SHARD = "all"
+UNASSIGNED_SHARD = "_unassigned"
 
-from .models import DocumentChunk
 
+def _model_slug(model: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', model) or 'default'
 
-def _index_dir() -> Path:
-    path = Path(settings.BASE_DIR) / 'data' / 'faiss'
+
+def _index_dir(model: Optional[str] = None) -> Path:
+    # One subdirectory per embedding model, so switching backends never mixes vector spaces
+    base = Path(getattr(settings, 'VECTOR_INDEX_DIR', None) or Path(settings.BASE_DIR) / 'data' / 'faiss')
+    path = base / _model_slug(model or embedding_model())
     path.mkdir(parents=True, exist_ok=True)
     return path
 
 
-def _index_paths() -> Tuple[Path, Path]:
-    d = _index_dir()
+def shard_by() -> str:
+    value = str(getattr(settings, 'VECTOR_SHARD_BY', 'project') or 'none').lower()
+    return value if value in SHARD_FIELDS else 'none'
+
+
+def shard_name(value: str) -> str:
+    """Directory name of the shard holding documents whose shard field is ``value``."""
+    if shard_by() == 'none':
+        return ALL_SHARD
+    if not value:
+        return UNASSIGNED_SHARD
+    # Readable prefix plus a hash, so values differing only in case or punctuation stay apart
+    digest = hashlib.sha1(value.encode('utf-8')).hexdigest()[:8]
+    return f"{_model_slug(value.lower())[:40]}-{digest}"
+
+
+def shard_for(project: str = "", contractor: str = "") -> str:
+    return shard_name({"project": project, "contractor": contractor}.get(shard_by(), ""))
+
+
+def _shards_dir(model: Optional[str] = None) -> Path:
+    return _index_dir(model) / shard_by()
+
+
+def _shard_paths(shard: str, model: Optional[str] = None) -> Tuple[Path, Path]:
+    d = _shards_dir(model) / shard
     return d / 'index.bin', d / 'mapping.json'
 
 
+def _doc_shard_paths(shard: str, model: Optional[str] = None) -> Tuple[Path, Path]:
+    d = _shards_dir(model) / shard
+    return d / 'doc_index.bin', d / 'doc_mapping.json'
+
+
+def _undescribed_path(shard: str, model: Optional[str] = None) -> Path:
+    # Marks a shard holding documents with chunk vectors but no document vector
+    return _shards_dir(model) / shard / 'undescribed'
+
+
+def list_shards(model: Optional[str] = None, documents: bool = False) -> List[str]:
+    """Shards with a persisted chunk index (or document index with ``documents=True``)."""
+    filename = 'doc_index.bin' if documents else 'index.bin'
+    try:
+        return sorted(e.name for e in os.scandir(_shards_dir(model)) if e.is_dir() and os.path.exists(os.path.join(e.path, filename)))
+    except FileNotFoundError:
+        return []
+
+
+def _shard_values() -> Dict[str, str]:
+    # Shard name -> shard field value, for every shard that currently has documents
+    field = shard_by()
+    if field == 'none':
+        return {ALL_SHARD: ""} if Document.objects.exists() else {}
+    return {shard_name(v): v for v in Document.objects.values_list(field, flat=True).distinct()}
+
+
+def _document_filter(value: str, prefix: str = "") -> Dict[str, str]:
+    field = shard_by()
+    return {} if field == 'none' else {prefix + field: value}
+
+
+def _indexed_in_shard(value: str) -> Q:
+    # Near-duplicates share their canonical chunk's vector, so only canonical chunks are indexed;
+    # a duplicate whose canonical chunk lies in another shard (linked before duplicates were
+    # matched per project and contractor) is indexed itself so its shard still finds it
+    field = shard_by()
+    if field == 'none':
+        return Q(duplicate_of__isnull=True)
+    return Q(duplicate_of__isnull=True) | ~Q(**{f"duplicate_of__document__{field}": value})
+
+
 def _normalize_matrix(vectors):
     if np is None:
         return vectors
@@ -37,18 +139,13 @@ def _normalize_matrix(vectors):
     return vectors / norms
 
 
-def rebuild_index_from_db() -> bool:
-    # Requires both faiss and numpy
-    if faiss is None or np is None:
-        return False
-    chunks = list(DocumentChunk.objects.all().only('id', 'embedding'))
-    if not chunks:
-        return False
+def _build_flat_index(rows):
+    # rows: iterable of (pk, float32 bytes); vectors of a different dimension than the first are skipped
     embeddings = []
     ids = []
     target_dim = None
-    for ch in chunks:
-        vec = np.frombuffer(ch.embedding, dtype=np.float32)
+    for pk, blob in rows:
+        vec = np.frombuffer(blob, dtype=np.float32)
         if vec.size == 0:
             continue
         if target_dim is None:
@@ -56,61 +153,456 @@ def rebuild_index_from_db() -> bool:
         if int(vec.size) != target_dim:
             continue
         embeddings.append(vec)
-        ids.append(ch.id)
+        ids.append(pk)
     if not embeddings:
-        return False
+        return None
     matrix = np.stack(embeddings, axis=0)
     d = matrix.shape[1]
     matrix = _normalize_matrix(matrix.astype(np.float32))
     index = faiss.IndexFlatIP(d)
     index.add(matrix)
+    return index, np.asarray(ids, dtype=np.int64)
+
+
+def _write_index(index, ids, index_path: Path, mapping_path: Path) -> None:
+    # Write to temp files and rename over the live ones so readers never see a partial index
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_index = index_path.with_suffix('.bin.tmp')
+    tmp_mapping = mapping_path.with_suffix('.json.tmp')
+    faiss.write_index(index, str(tmp_index))
+    with open(tmp_mapping, 'w', encoding='utf-8') as f:
+        json.dump(np.asarray(ids, dtype=np.int64).tolist(), f)
+    os.replace(tmp_mapping, mapping_path)
+    os.replace(tmp_index, index_path)
+
 
-    index_path, mapping_path = _index_paths()
-    faiss.write_index(index, str(index_path))
-    with open(mapping_path, 'w', encoding='utf-8') as f:
-        json.dump(ids, f)
+def _remove_files(*paths: Path) -> None:
+    for path in paths:
+        path.unlink(missing_ok=True)
+    try:
+        paths[0].parent.rmdir()  # only succeeds once the shard has no files left
+    except OSError:
+        pass
+
+
+def _rebuild_chunk_shard(shard: str, value: Optional[str]) -> bool:
+    index_path, mapping_path = _shard_paths(shard)
+    with timed("index_rebuild") as stage:
+        built = None
+        if value is not None:
+            chunks = (DocumentChunk.objects.filter(_indexed_in_shard(value), embedding_model=embedding_model(),
+                                                   **_document_filter(value, 'document__'))
+                      .values_list('id', 'embedding'))
+            built = _build_flat_index(chunks)
+        if built is None:
+            # Don't leave a stale index pointing at deleted chunks
+            _remove_files(index_path, mapping_path)
+            return False
+        _write_index(*built, index_path, mapping_path)
+        stage.bytes = index_path.stat().st_size
     return True
 
 
-def _load_index() -> Optional[Tuple["faiss.Index", List[int]]]:  # type: ignore
-    if faiss is None:
-        return None
-    index_path, mapping_path = _index_paths()
-    if not index_path.exists() or not mapping_path.exists():
-        return None
-    index = faiss.read_index(str(index_path))
+def _undescribed_documents(value: str):
+    # Scanned before document vectors existed, or their description embed failed: the document
+    # index can't shortlist them, so two-stage search takes their chunks from the chunk index
+    model = embedding_model()
+    with_vectors = DocumentChunk.objects.filter(embedding_model=model).exclude(embedding=b"").values('document_id')
+    return (Document.objects.filter(id__in=with_vectors, **_document_filter(value))
+            .filter(~Q(description_embedding_model=model) | Q(description_embedding=b"")))
+
+
+def _rebuild_document_shard(shard: str, value: Optional[str]) -> bool:
+    index_path, mapping_path = _doc_shard_paths(shard)
+    with timed("doc_index_rebuild") as stage:
+        built = None
+        undescribed = _undescribed_path(shard)
+        if value is not None:
+            docs = (Document.objects.filter(description_embedding_model=embedding_model(), **_document_filter(value))
+                    .exclude(description_embedding=b""))
+            built = _build_flat_index(docs.values_list('id', 'description_embedding'))
+        if value is not None and _undescribed_documents(value).exists():
+            undescribed.parent.mkdir(parents=True, exist_ok=True)
+            undescribed.touch()
+        else:
+            undescribed.unlink(missing_ok=True)
+        if built is None:
+            _remove_files(index_path, mapping_path)
+            return False
+        _write_index(*built, index_path, mapping_path)
+        stage.bytes = index_path.stat().st_size
+    return True
+
+
+def _target_shards(shards: Optional[Iterable[str]], documents: bool) -> Tuple[List[str], Dict[str, str]]:
+    values = _shard_values()
+    if shards is not None:
+        return sorted(set(shards)), values
+    # A full rebuild also clears shards whose documents are all gone
+    return sorted(set(values) | set(list_shards(documents=documents))), values
+
+
+def rebuild_index_from_db(shards: Optional[Iterable[str]] = None) -> bool:
+    """Rebuild the chunk and document indexes of ``shards`` (names, see ``shard_for``), or of all.
+
+    Returns whether any chunk index was written.
+    """
+    if not available():
+        return False
+    targets, values = _target_shards(shards, documents=False)
+    rebuild_document_index(targets if shards is not None else None)
+    built = False
+    for shard in targets:
+        built = _rebuild_chunk_shard(shard, values.get(shard)) or built
+    return built
+
+
+def rebuild_document_index(shards: Optional[Iterable[str]] = None) -> bool:
+    """Index Document.description_embedding vectors for the first stage of two-stage retrieval."""
+    if not available():
+        return False
+    targets, values = _target_shards(shards, documents=True)
+    built = False
+    for shard in targets:
+        built = _rebuild_document_shard(shard, values.get(shard)) or built
+    return built
+
+
+def _read_mapping(mapping_path: Path):
     with open(mapping_path, 'r', encoding='utf-8') as f:
-        ids: List[int] = json.load(f)
+        return np.asarray(json.load(f), dtype=np.int64)
+
+
+def apply_index_changes(removed_ids: Iterable[int], added_ids: Iterable[int], shards: Iterable[str] = ()) -> bool:
+    """Update the persisted chunk indexes in place for a small change set instead of rebuilding them.
+
+    Rows of ``removed_ids`` are dropped from whichever shard holds them and current-model vectors
+    of ``added_ids`` are appended to their document's shard, unless they are near-duplicates of a
+    chunk in the same shard; a shard
+    without an index yet is built from the database. Document indexes are small and are
+    rebuilt for every touched shard plus ``shards`` (e.g. those of deleted documents).
+    """
+    if not available():
+        return False
+    added_ids = set(added_ids)
+    # Re-added ids replace their old rows
+    dropped = np.asarray(sorted(set(removed_ids) | added_ids), dtype=np.int64)
+    additions: Dict[str, List[Tuple[int, bytes]]] = {}
+    if added_ids:
+        rows = (DocumentChunk.objects.filter(id__in=added_ids, embedding_model=embedding_model())
+                .exclude(embedding=b"").values_list('id', 'embedding', 'document__project', 'document__contractor',
+                                                    'duplicate_of_id', 'duplicate_of__document__project',
+                                                    'duplicate_of__document__contractor'))
+        for pk, blob, project, contractor, canonical, canonical_project, canonical_contractor in rows:
+            shard = shard_for(project, contractor)
+            if canonical is not None and shard_for(canonical_project or "", canonical_contractor or "") == shard:
+                continue
+            additions.setdefault(shard, []).append((pk, blob))
+    values = _shard_values()
+    touched = set(shards) | set(additions)
+    with timed("index_update") as stage:
+        for shard in sorted(set(list_shards()) | set(additions)):
+            paths = _shard_paths(shard)
+            if not paths[0].exists() or not paths[1].exists():
+                _rebuild_chunk_shard(shard, values.get(shard))
+                continue
+            ids = _read_mapping(paths[1])
+            positions = np.nonzero(np.isin(ids, dropped))[0] if dropped.size else np.empty(0, dtype=np.int64)
+            rows = additions.get(shard, [])
+            if not positions.size and not rows:
+                continue
+            touched.add(shard)
+            index = faiss.read_index(str(paths[0]))
+            if positions.size:
+                # Flat indexes compact on removal, so the mapping keeps its order minus the dropped rows
+                index.remove_ids(positions.astype(np.int64))
+                ids = np.delete(ids, positions)
+            vectors = []
+            new_ids = []
+            for pk, blob in rows:
+                vec = np.frombuffer(blob, dtype=np.float32)
+                if vec.size == index.d:
+                    vectors.append(vec)
+                    new_ids.append(pk)
+            if vectors:
+                index.add(_normalize_matrix(np.stack(vectors).astype(np.float32)))
+                ids = np.concatenate([ids, np.asarray(new_ids, dtype=np.int64)])
+            if not ids.size:
+                _remove_files(*paths)
+                continue
+            _write_index(index, ids, *paths)
+            stage.bytes += paths[0].stat().st_size
+    rebuild_document_index(touched)
+    return True
+
+
+def index_files(model: Optional[str] = None) -> Dict[str, Tuple[bytes, bytes]]:
+    # Raw bytes of each shard's persisted chunk index and id mapping
+    files = {}
+    for shard in list_shards(model):
+        index_path, mapping_path = _shard_paths(shard, model)
+        if mapping_path.exists():
+            files[shard] = (index_path.read_bytes(), mapping_path.read_bytes())
+    return files
+
+
+def install_indexes(shards: Iterable[Tuple[str, bytes, bytes]], model: Optional[str] = None) -> None:
+    """Replace every shard of ``model`` with ``(shard, index_bytes, mapping_bytes)`` entries.
+
+    The shards are written to a sibling directory that is renamed into place, so the live
+    indexes are only removed once the new ones are complete.
+    """
+    live = _shards_dir(model)
+    live.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{live.name}.", suffix=".new", dir=live.parent))
+    try:
+        for shard, index_bytes, mapping_bytes in shards:
+            (staging / shard).mkdir()
+            (staging / shard / 'index.bin').write_bytes(index_bytes)
+            (staging / shard / 'mapping.json').write_bytes(mapping_bytes)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    # A directory can't be renamed over a non-empty one; move the live one aside first
+    retired = None
+    if live.exists():
+        retired = Path(tempfile.mkdtemp(prefix=f".{live.name}.", suffix=".old", dir=live.parent))
+        os.replace(live, retired / live.name)
+    os.replace(staging, live)
+    if retired is not None:
+        shutil.rmtree(retired, ignore_errors=True)
+
+
+def _read_index(paths: Tuple[Path, Path]):
+    with timed("index_load") as stage:
+        index = faiss.read_index(str(paths[0]))
+        ids = _read_mapping(paths[1])
+        stage.bytes = paths[0].stat().st_size
     return index, ids
 
 
-def search_similar_chunks(query_vector, k: int = 5) -> Optional[List[Tuple[DocumentChunk, float]]]:
+class ShardCache:
+    """Loaded shard indexes, least recently used first, within a memory budget.
+
+    Entries are keyed by index file and carry the files' modification stamps, so an index
+    rewritten by another process (a scan, ``manage.py watch``) is reloaded on its next use. The
+    most recently loaded shard is kept even when it alone exceeds the budget.
+    """
+
+    def __init__(self, budget_bytes: Optional[int] = None):
+        self._budget = budget_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def budget(self) -> int:
+        if self._budget is not None:
+            return self._budget
+        return int(float(getattr(settings, 'VECTOR_CACHE_MB', 1024) or 0) * 1024 * 1024)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(entry[3] for entry in self._entries.values())
+
+    def __contains__(self, index_path) -> bool:
+        with self._lock:
+            return str(index_path) in self._entries
+
+    def get(self, paths: Tuple[Path, Path]):
+        """``(index, ids)`` for the index at ``paths``, loading it if needed; None if it doesn't exist."""
+        key = str(paths[0])
+        try:
+            stamp = tuple((st.st_mtime_ns, st.st_size) for st in (os.stat(paths[0]), os.stat(paths[1])))
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                return entry[1], entry[2]
+        # Loaded outside the lock so other shards can be searched (or loaded) meanwhile
+        index, ids = _read_index(paths)
+        nbytes = index.ntotal * index.d * 4 + ids.nbytes
+        with self._lock:
+            self.loads += 1
+            self._entries[key] = (stamp, index, ids, nbytes)
+            self._entries.move_to_end(key)
+            total = sum(e[3] for e in self._entries.values())
+            while total > self.budget and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                total -= evicted[3]
+                self.evictions += 1
+        return index, ids
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.loads = 0
+            self.evictions = 0
+
+
+shard_cache = ShardCache()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _search_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            threads = max(1, int(getattr(settings, 'VECTOR_SEARCH_THREADS', 8) or 1))
+            _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='vector-search')
+        return _executor
+
+
+def _query_shards(project: str = "", contractor: str = "", documents: bool = False) -> List[str]:
+    """Shards a query filtered by project/contractor substring has to search.
+
+    Only the filter on the shard field narrows the search; when it matches no shard every
+    shard is searched, like an unfiltered query.
+    """
+    existing = list_shards(documents=documents)
+    field = shard_by()
+    value = {"project": project, "contractor": contractor}.get(field, "")
+    if value and len(existing) > 1:
+        matching = {shard_name(v) for v in Document.objects.filter(**{f"{field}__icontains": value})
+                    .values_list(field, flat=True).distinct()}
+        scoped = [s for s in existing if s in matching]
+        if scoped:
+            return scoped
+    return existing
+
+
+def _search_shards(shards: Sequence[str], paths_for: Callable[[str], Tuple[Path, Path]], q, k: int) -> Optional[List[Tuple[float, int, str]]]:
+    """Top ``k`` ``(score, pk, shard)`` across ``shards``; None when no shard could be searched."""
+
+    def search(shard: str):
+        loaded = shard_cache.get(paths_for(shard))
+        if loaded is None:
+            return None
+        index, ids = loaded
+        if index.d != q.size:
+            return None
+        distances, indices = index.search(q.reshape(1, -1), k)
+        return [(float(dist), int(ids[i]), shard) for i, dist in zip(indices[0], distances[0]) if i >= 0]
+
+    if len(shards) <= 1:
+        results = [search(shard) for shard in shards]
+    else:
+        # Each task runs in a copy of this context so its index_load timings reach the request
+        executor = _search_executor()
+        futures = [executor.submit(contextvars.copy_context().run, search, shard) for shard in shards]
+        results = [f.result() for f in futures]
+    searched = [hits for hits in results if hits is not None]
+    if not searched:
+        return None
+    return heapq.nlargest(k, (hit for hits in searched for hit in hits), key=lambda hit: hit[0])
+
+
+def _current(shard: str, project: str, contractor: str) -> bool:
+    # A document moved to another project since its shard was indexed is only found via the new one
+    return shard_by() == 'none' or shard_for(project, contractor) == shard
+
+
+def search_similar_documents(query_vector, k: int = 20, project: str = "", contractor: str = "") -> Optional[List[Tuple[int, float]]]:
+    # Returns (document id, score) pairs, or None when no document index is available
+    if not available():
+        return None
+    shards = _query_shards(project, contractor, documents=True)
+    if not shards:
+        return None
+    q = _normalized_query(query_vector)
+    with timed("search_documents"):
+        hits = _search_shards(shards, _doc_shard_paths, q, k)
+    if hits is None:
+        return None
+    owners = {pk: (p, c) for pk, p, c in Document.objects.filter(id__in=[pk for _, pk, _ in hits])
+              .values_list('id', 'project', 'contractor')}
+    return [(pk, score) for score, pk, shard in hits if pk in owners and _current(shard, *owners[pk])]
+
+
+def search_two_stage(query_vector, k: int = 5, candidate_docs: int = 20, project: str = "",
+                     contractor: str = "") -> Optional[List[Tuple[DocumentChunk, float]]]:
+    """Pick the top documents by description embedding, then rank only their chunks.
+
+    Documents without chunk vectors (images, binaries) compete with a synthetic chunk holding
+    their description (``chunk_index`` -1, unsaved). Documents without a document vector compete
+    with their hits in the chunk index. Returns None when the document index is unavailable so
+    callers can fall back to the flat chunk search.
+    """
+    docs = search_similar_documents(query_vector, k=candidate_docs, project=project, contractor=contractor)
+    if docs is None:
+        return None
+    with timed("search_chunks"):
+        results = _rank_candidate_chunks(query_vector, docs, k) if docs else []
+        shards = [s for s in _query_shards(project, contractor) if _undescribed_path(s).exists()]
+        if shards:
+            hits = _search_shards(shards, _shard_paths, _normalized_query(query_vector), k) or []
+            model = embedding_model()
+            results += [(chunk, score) for chunk, score in _hit_chunks(hits)
+                        if chunk.document.description_embedding_model != model or not chunk.document.description_embedding]
+            results.sort(key=lambda pair: pair[1], reverse=True)
+    return results[:k]
+
+
+def _rank_candidate_chunks(query_vector, docs: List[Tuple[int, float]], k: int) -> List[Tuple[DocumentChunk, float]]:
+    q = _normalized_query(query_vector)
+    doc_scores = dict(docs)
+    documents = Document.objects.in_bulk(list(doc_scores))
+    results: List[Tuple[DocumentChunk, float]] = []
+    with_chunks = set()
+    chunks = list(DocumentChunk.objects.filter(document_id__in=list(doc_scores), embedding_model=embedding_model())
+                  .exclude(embedding=b""))
+    if chunks:
+        rows = [(c, np.frombuffer(c.embedding, dtype=np.float32)) for c in chunks]
+        rows = [(c, v) for c, v in rows if v.size == q.size]
+        if rows:
+            matrix = _normalize_matrix(np.stack([v for _, v in rows]))
+            scores = matrix @ q
+            for (chunk, _), score in zip(rows, scores):
+                chunk.document = documents[chunk.document_id]
+                results.append((chunk, float(score)))
+                with_chunks.add(chunk.document_id)
+    for doc_id, score in docs:
+        doc = documents.get(doc_id)
+        if doc is not None and doc_id not in with_chunks and doc.description:
+            results.append((DocumentChunk(document=doc, chunk_index=-1, text=doc.description), score))
+    results.sort(key=lambda pair: pair[1], reverse=True)
+    return results[:k]
+
+
+def search_similar_chunks(query_vector, k: int = 5, project: str = "", contractor: str = "") -> Optional[List[Tuple[DocumentChunk, float]]]:
     # Requires both faiss and numpy; otherwise, caller should fall back
-    if faiss is None or np is None:
+    if not available():
         return None
-    loaded = _load_index()
-    if loaded is None:
+    shards = _query_shards(project, contractor)
+    if not shards:
         return None
-    index, ids = loaded
-    q = np.asarray(query_vector, dtype=np.float32)
-    q = q / (np.linalg.norm(q) or 1.0)
-    distances, indices = index.search(q.reshape(1, -1), k)
-    idxs = indices[0]
-    dists = distances[0]
-    # Map FAISS row indices to DB primary keys
-    pk_list: List[int] = []
-    scores: List[float] = []
-    for i, dist in zip(idxs, dists):
-        if i < 0:
-            continue
-        pk_list.append(ids[i])
-        scores.append(float(dist))
-    if not pk_list:
-        return []
-    chunks = list(DocumentChunk.objects.select_related('document').filter(id__in=pk_list))
-    order = {pk: pos for pos, pk in enumerate(pk_list)}
-    chunks.sort(key=lambda c: order.get(c.id, 1_000_000))
-    return list(zip(chunks, scores))
+    q = _normalized_query(query_vector)
+    with timed("search_chunks"):
+        hits = _search_shards(shards, _shard_paths, q, k)
+        if hits is None:
+            return None
+        return _hit_chunks(hits)
+
 
+def _hit_chunks(hits: List[Tuple[float, int, str]]) -> List[Tuple[DocumentChunk, float]]:
+    # Map FAISS hits to DB rows, keeping the merged score order
+    chunks = DocumentChunk.objects.select_related('document').in_bulk([pk for _, pk, _ in hits])
+    results = []
+    for score, pk, shard in hits:
+        chunk = chunks.get(pk)
+        if chunk is not None and _current(shard, chunk.document.project, chunk.document.contractor):
+            results.append((chunk, score))
+    return results
 
 
+def _normalized_query(query_vector):
+    q = np.asarray(query_vector, dtype=np.float32)
+    return q / (np.linalg.norm(q) or 1.0)
@@ -1,147 +1,34 @@
 import os
-import io
 import json
-import mimetypes
-import time
-from datetime import datetime
-import base64
-from typing import List, Tuple
 import sys
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from asgiref.sync import sync_to_async
 
 from django.conf import settings
-from django.http import JsonResponse, HttpRequest
+from django.http import HttpResponse, JsonResponse, HttpRequest, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
-from django.db.models import Q
+from django.views.decorators.http import require_POST
+from django.db.models import Count, Q
 
 from rest_framework.decorators import api_view
 from rest_framework import status
 
 from .models import Document, DocumentChunk
 
-from openai import OpenAI
-from pypdf import PdfReader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from array import array
 import math
-from .vectorstore import rebuild_index_from_db, search_similar_chunks
-
-
-def _read_text_from_file(path: str) -> str:
-    mime, _ = mimetypes.guess_type(path)
-    if not mime:
-        mime = "application/octet-stream"
-    mime = mime.lower()
-
-    try:
-        if mime.startswith("text/"):
-            try:
-                if os.path.getsize(path) > getattr(settings, 'SCAN_MAX_BYTES', 10 * 1024 * 1024):
-                    return ""
-            except Exception:
-                pass
-            with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read()
-        if mime == "application/pdf" or path.lower().endswith(".pdf"):
-            text = []
-            try:
-                if os.path.getsize(path) > getattr(settings, 'SCAN_MAX_BYTES', 10 * 1024 * 1024):
-                    return ""
-            except Exception:
-                pass
-            reader = PdfReader(path)
-            for page in reader.pages:
-                text.append(page.extract_text() or "")
-            return "\n".join(text)
-        # Fallback: don't try to read binary images here; just return empty
-        return ""
-    except Exception:
-        return ""
-
-
-def _describe_file_with_openai(client: OpenAI, path: str, mode: str = "concise") -> str:
-    # Prefer text extraction; if unavailable, try vision on images; else fallback to filename-based description.
-    text = _read_text_from_file(path)
-    if text:
-        if mode == "detailed":
-            style = "Write a thorough 3-6 sentence summary for search and discovery. Focus on key topics, entities, purpose, and important details."
-        elif mode == "creative":
-            style = "Write a catchy 1-3 sentence summary suitable for search and discovery."
-        else:
-            style = "Summarize the following file content in 1-3 sentences for search and discovery. Focus on key topics, entities, and purpose."
-        prompt = style + "\n\n" + text[:6000]
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that writes concise summaries."},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.2,
-                max_tokens=160,
-            )
-            return completion.choices[0].message.content.strip()
-        except Exception:
-            # fall through to attempt vision or filename-based
-            pass
-
-    # If no text, try multimodal vision for images
-    mime, _ = mimetypes.guess_type(path)
-    mime = (mime or "").lower()
-    if mime.startswith("image/"):
-        try:
-            with open(path, "rb") as f:
-                b64 = base64.b64encode(f.read()).decode("utf-8")
-            data_url = f"data:{mime};base64,{b64}"
-            if mode == "detailed":
-                vision_text = "Describe this image in 2-4 sentences for search and discovery. Mention key objects, visible text, and purpose."
-            elif mode == "creative":
-                vision_text = "Describe this image in 1-2 punchy sentences for search and discovery."
-            else:
-                vision_text = "Describe this image in 1-3 sentences for search and discovery. Mention key objects, text, and purpose succinctly."
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that writes concise visual descriptions for search."},
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": vision_text},
-                            {"type": "image_url", "image_url": {"url": data_url}},
-                        ],
-                    },
-                ],
-                temperature=0.2,
-                max_tokens=120,
-            )
-            desc = completion.choices[0].message.content.strip()
-            if desc:
-                return desc
-        except Exception:
-            pass
-
-    # Fallback: filename-based description
-    base_name = os.path.basename(path)
-    return f"File named {base_name}.".strip()
+from .embeddings import aembed_texts, embedding_model, vector_from_bytes
+from .llm import achat, gateway_stats, get_async_client, get_client
+from .metrics import collect, render_prometheus, timed
+from .context import build_context
+from .dedup import collapse_near_duplicates, dedup_enabled
+from .ingest import ImportFailed, import_records, iter_ndjson, iter_export_ndjson
+from .scanner import ingest_entries, iter_scan_entries
+from .vectorstore import rebuild_index_from_db, search_similar_chunks, search_two_stage, shard_for
 
-
-def _embed_texts(client: OpenAI, texts: List[str]) -> List[List[float]]:
-    if not texts:
-        return []
-    resp = client.embeddings.create(model="text-embedding-3-small", input=texts)
-    vectors = [list(item.embedding) for item in resp.data]
-    return vectors
-
-
-def _bytes_from_vector(vec: List[float]) -> bytes:
-    # Store as float32 bytes
-    return array('f', vec).tobytes()
-
-
-def _vector_from_bytes(blob: bytes) -> List[float]:
-    arr = array('f')
-    arr.frombytes(blob)
-    return arr.tolist()
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
 @api_view(["POST"])
@@ -169,91 +56,16 @@ def scan_directory(request: HttpRequest):
     if not settings.OPENAI_API_KEY:
         return JsonResponse({"error": "Server missing OPENAI_API_KEY. Set it in .env and restart."}, status=500)
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
-    processed = 0
-    created = 0
-    updated = 0
-    new_chunks = 0
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-
-    ignore_dirs = set(getattr(settings, 'SCAN_IGNORE_DIRS', set()))
-    with transaction.atomic():
-        for root, dirs, files in os.walk(directory):
-            # Prune ignored directories in-place for efficiency
-            dirs[:] = [d for d in dirs if d not in ignore_dirs]
-            for fname in files:
-                path = os.path.join(root, fname)
-
-                try:
-                    stat = os.stat(path)
-                except Exception:
-                    continue
-
-                modified_at = datetime.fromtimestamp(stat.st_mtime)
-                if cutoff_dt and modified_at < cutoff_dt:
-                    continue
-
-                mime, _ = mimetypes.guess_type(path)
-                file_type = mime or "application/octet-stream"
-
-                description = _describe_file_with_openai(client, path, mode=mode)
-                doc, created_flag = Document.objects.update_or_create(
-                    file_path=path,
-                    defaults=dict(
-                        file_name=fname,
-                        file_type=file_type,
-                        contractor=contractor,
-                        project=project,
-                        size_bytes=stat.st_size,
-                        modified_at=modified_at,
-                        description=description,
-                    ),
-                )
-                processed += 1
-                created += int(created_flag)
-                updated += int(not created_flag)
-
-                # Chunk text and embed
-                text = _read_text_from_file(path)
-                if text:
-                    chunks = text_splitter.split_text(text)
-                    max_chunks = int(getattr(settings, 'SCAN_MAX_CHUNKS', 64) or 64)
-                    if len(chunks) > max_chunks:
-                        chunks = chunks[:max_chunks]
-                    if chunks:
-                        try:
-                            embeddings = _embed_texts(client, chunks)
-                        except Exception:
-                            embeddings = [[] for _ in chunks]
-                        DocumentChunk.objects.filter(document=doc).delete()
-                        for idx, (chunk, vec) in enumerate(zip(chunks, embeddings)):
-                            try:
-                                emb_bytes = _bytes_from_vector(vec) if vec else b""
-                            except Exception:
-                                emb_bytes = b""
-                            DocumentChunk.objects.create(
-                                document=doc,
-                                chunk_index=idx,
-                                text=chunk,
-                                embedding=emb_bytes,
-                            )
-                            new_chunks += 1
-
-    # Rebuild FAISS index after scan (best-effort)
-    try:
-        rebuild_index_from_db()
-    except Exception:
-        pass
+    with collect("scan") as breakdown:
+        store = ingest_entries(iter_scan_entries(directory, cutoff_dt), contractor=contractor, project=project, mode=mode)
 
-    return JsonResponse(
-        {
-            "processed": processed,
-            "created": created,
-            "updated": updated,
-            "chunks_added": new_chunks,
-        }
-    )
+        # Rebuild the FAISS index shard the scan wrote to (best-effort)
+        try:
+            rebuild_index_from_db([shard_for(project, contractor)])
+        except Exception:
+            pass
+
+    return JsonResponse({**store.counts, "timings": breakdown.as_dict()})
 
 
 @api_view(["GET"])
@@ -289,11 +101,8 @@ def list_documents(request: HttpRequest):
     return JsonResponse({"results": data})
 
 
-def _search_similar_chunks(query: str, k: int = 5) -> List[Tuple[DocumentChunk, float]]:
+def _search_similar_chunks(q_vec: List[float], k: int = 5) -> List[Tuple[DocumentChunk, float]]:
     # Simple in-DB search by cosine against all embeddings (works for small demo DB). For large scale, use FAISS index persisted to disk.
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
-    q_vec = _embed_texts(client, [query])[0]
-
     def cosine(a: List[float], b: List[float]) -> float:
         if not a or not b or len(a) != len(b):
             return 0.0
@@ -304,37 +113,27 @@ def _search_similar_chunks(query: str, k: int = 5) -> List[Tuple[DocumentChunk,
         return float(dot / denom)
 
     results: List[Tuple[DocumentChunk, float]] = []
-    for chunk in DocumentChunk.objects.select_related("document").all():
-        vec = _vector_from_bytes(chunk.embedding)
+    chunks = DocumentChunk.objects.select_related("document").filter(duplicate_of__isnull=True, embedding_model=embedding_model())
+    for chunk in chunks:
+        vec = vector_from_bytes(chunk.embedding)
         score = cosine(vec, q_vec)
         results.append((chunk, score))
     results.sort(key=lambda x: x[1], reverse=True)
     return results[:k]
 
 
-@api_view(["POST"])
-@csrf_exempt
-def ask_question(request: HttpRequest):
-    try:
-        body = json.loads(request.body or b"{}")
-    except Exception:
-        return JsonResponse({"error": "Invalid JSON body"}, status=400)
-    question = body.get("question", "")
-    if not question:
-        return JsonResponse({"error": "Missing question"}, status=400)
-
-    if not settings.OPENAI_API_KEY:
-        return JsonResponse({"error": "Server missing OPENAI_API_KEY. Set it in .env and restart."}, status=500)
-
-    top_k = int(body.get("k", 5))
-    project_filter = str(body.get("project", "") or "").strip().lower()
-    contractor_filter = str(body.get("contractor", "") or "").strip().lower()
-    # Use FAISS index if available, else fallback to brute-force
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    q_vec = _embed_texts(client, [question])[0]
-    retrieved = search_similar_chunks(q_vec, k=top_k)
+def _retrieve_context(q_vec: List[float], top_k: int, project_filter: str, contractor_filter: str) -> Tuple[List[Tuple[DocumentChunk, float]], str, Dict[int, int]]:
+    # Two-stage (documents, then their chunks) when the document index exists; else the flat
+    # FAISS chunk index; else brute-force. The filters also pick which index shards are searched.
+    retrieved = None
+    if getattr(settings, 'ASK_TWO_STAGE', True):
+        retrieved = search_two_stage(q_vec, k=top_k, candidate_docs=int(getattr(settings, 'ASK_CANDIDATE_DOCS', 20) or 20),
+                                     project=project_filter, contractor=contractor_filter)
     if retrieved is None:
-        retrieved = _search_similar_chunks(question, k=top_k)
+        retrieved = search_similar_chunks(q_vec, k=top_k, project=project_filter, contractor=contractor_filter)
+    if retrieved is None:
+        with timed("search_chunks"):
+            retrieved = _search_similar_chunks(q_vec, k=top_k)
 
     def _matches_filters(chunk: DocumentChunk) -> bool:
         if project_filter and project_filter not in (chunk.document.project or "").lower():
@@ -346,11 +145,18 @@ def ask_question(request: HttpRequest):
     if retrieved:
         retrieved = [(c, s) for (c, s) in retrieved if _matches_filters(c)] or retrieved
 
-    # Build context; if weak/empty, fall back to database summary so generic queries get a helpful answer
-    context_snippets: List[str] = []
-    for chunk, score in retrieved:
-        context_snippets.append(f"[Score {score:.2f}] From {chunk.document.file_name}:\n{chunk.text}")
-    context_text = "\n\n".join(context_snippets)
+    # Chunks indexed before dedup (or below the LSH recall) can still repeat the same text
+    duplicate_counts: Dict[int, int] = {}
+    if retrieved and dedup_enabled():
+        retrieved = collapse_near_duplicates(retrieved)
+        duplicate_counts = dict(
+            DocumentChunk.objects.filter(duplicate_of_id__in=[c.id for c, _ in retrieved if c.id is not None])
+            .values('duplicate_of_id').annotate(n=Count('id')).values_list('duplicate_of_id', 'n')
+        )
+
+    # Build context within the token budget; if weak/empty, fall back to database summary so generic queries get a helpful answer
+    with timed("context_pack") as stage:
+        context_text, stage.tokens = build_context(retrieved)
 
     has_strong_context = bool(retrieved)
     if has_strong_context:
@@ -376,23 +182,57 @@ def ask_question(request: HttpRequest):
             summary_lines.append(f"- {d.file_name}: {d.description[:200] if d.description else ''}")
         context_text = "\n".join(summary_lines)
 
-    prompt = (
-        "You are a RAG assistant over a local document database. "
-        "Use the provided context to answer the user's question. If the question is generic (e.g., 'what is this'), "
-        "briefly explain what the database contains (types of files, projects, contractors) and how to query it. "
-        "Prefer concise, grounded answers and cite filenames when relevant.\n\n"
-        f"Context:\n{context_text}\n\nQuestion: {question}\nAnswer:"
-    )
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You answer with grounded, concise responses."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.2,
-        max_tokens=400,
-    )
-    answer = completion.choices[0].message.content.strip()
+    return retrieved, context_text, duplicate_counts
+
+
+@csrf_exempt
+@require_POST
+async def ask_question(request: HttpRequest):
+    try:
+        body = json.loads(request.body or b"{}")
+    except Exception:
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+    question = body.get("question", "")
+    if not question:
+        return JsonResponse({"error": "Missing question"}, status=400)
+
+    try:
+        top_k = int(body.get("k", 5))
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "k must be an integer"}, status=400)
+    top_k = max(1, min(top_k, int(getattr(settings, 'ASK_MAX_K', 50) or 50)))
+
+    if not settings.OPENAI_API_KEY:
+        return JsonResponse({"error": "Server missing OPENAI_API_KEY. Set it in .env and restart."}, status=500)
+
+    project_filter = str(body.get("project", "") or "").strip().lower()
+    contractor_filter = str(body.get("contractor", "") or "").strip().lower()
+    client = get_async_client()
+    with collect("ask") as breakdown:
+        with timed("embed"):
+            q_vec = (await aembed_texts(client, [question]))[0]
+        # FAISS search and ORM lookups are blocking; run them off the event loop
+        retrieved, context_text, duplicate_counts = await sync_to_async(_retrieve_context)(q_vec, top_k, project_filter, contractor_filter)
+
+        prompt = (
+            "You are a RAG assistant over a local document database. "
+            "Use the provided context to answer the user's question. If the question is generic (e.g., 'what is this'), "
+            "briefly explain what the database contains (types of files, projects, contractors) and how to query it. "
+            "Prefer concise, grounded answers and cite filenames when relevant.\n\n"
+            f"Context:\n{context_text}\n\nQuestion: {question}\nAnswer:"
+        )
+        with timed("generate"):
+            completion = await achat(
+                client,
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You answer with grounded, concise responses."},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0.2,
+                max_tokens=400,
+            )
+        answer = completion.choices[0].message.content.strip()
 
     return JsonResponse({
         "answer": answer,
@@ -402,15 +242,33 @@ def ask_question(request: HttpRequest):
                 "file_name": chunk.document.file_name,
                 "score": float(score),
                 "preview": chunk.text[:300],
+                "duplicates": duplicate_counts.get(chunk.id, 0),
             }
             for chunk, score in retrieved
         ],
+        "timings": breakdown.as_dict(),
     })
 
+
+@api_view(["GET"])
+def metrics(request: HttpRequest):
+    # Prometheus scrape target; counters are per worker process
+    return HttpResponse(render_prometheus(gateway_stats()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Database management APIs
 
 @api_view(["GET"])
 def export_database(request: HttpRequest):
+    # NDJSON streams one document per line and carries embeddings so imports can skip re-embedding
+    if (request.GET.get("output", "") or "").lower() == "ndjson":
+        include_embeddings = (request.GET.get("embeddings", "1") or "1").lower() in {"1", "true", "yes"}
+        response = StreamingHttpResponse(
+            iter_export_ndjson(include_embeddings=include_embeddings),
+            content_type="application/x-ndjson",
+        )
+        response["Content-Disposition"] = 'attachment; filename="ragnetscanner-export.ndjson"'
+        return response
+
     # Export all Documents with chunk texts (no embeddings) for portability
     payload = []
     for d in Document.objects.all().order_by("-updated_at"):
@@ -432,72 +290,42 @@ def export_database(request: HttpRequest):
     return JsonResponse({"data": payload})
 
 
+def _is_ndjson(request: HttpRequest) -> bool:
+    content_type = (request.content_type or "").lower()
+    return content_type in {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"}
+
+
 @api_view(["POST"])
 @csrf_exempt
 def import_database(request: HttpRequest):
-    try:
-        body = json.loads(request.body or b"{}")
-    except Exception:
-        return JsonResponse({"error": "Invalid JSON body"}, status=400)
-
-    items = body.get("data", [])
-    if not isinstance(items, list):
-        return JsonResponse({"error": "data must be a list"}, status=400)
-
-    created = 0
-    updated = 0
-    chunks_written = 0
-    chunks_embedded = 0
-
-    client: OpenAI | None = None
+    if _is_ndjson(request):
+        # Parse line by line from the request stream instead of buffering the whole body
+        records = iter_ndjson(request.stream or [])
+    else:
+        try:
+            body = json.loads(request.body or b"{}")
+        except Exception:
+            return JsonResponse({"error": "Invalid JSON body"}, status=400)
+        records = body.get("data", [])
+        if not isinstance(records, list):
+            return JsonResponse({"error": "data must be a list"}, status=400)
+        records = [it for it in records if isinstance(it, dict)]
+
+    # Local embedding backends don't need a client; imports still embed missing chunks with them
+    client: "OpenAI | None" = None
     if settings.OPENAI_API_KEY:
         try:
-            client = OpenAI(api_key=settings.OPENAI_API_KEY)
+            client = get_client()
         except Exception:
             client = None
 
-    with transaction.atomic():
-        for it in items:
-            fp = it.get("file_path")
-            if not fp:
-                continue
-            doc, was_created = Document.objects.update_or_create(
-                file_path=fp,
-                defaults=dict(
-                    file_name=it.get("file_name", ""),
-                    file_type=it.get("file_type", "application/octet-stream"),
-                    contractor=it.get("contractor", ""),
-                    project=it.get("project", ""),
-                    size_bytes=int(it.get("size_bytes", 0) or 0),
-                    modified_at=datetime.fromisoformat(it["modified_at"]) if it.get("modified_at") else None,
-                    description=it.get("description", ""),
-                ),
-            )
-            created += int(was_created)
-            updated += int(not was_created)
-
-            # Replace chunks with fresh ones; embed if possible
-            DocumentChunk.objects.filter(document=doc).delete()
-            chunks = it.get("chunks", []) or []
-            texts = [str(ch.get("text", "")) for ch in chunks]
-            embeddings: list[list[float]] | None = None
-            if client and texts and any(t.strip() for t in texts):
-                try:
-                    embeddings = _embed_texts(client, texts)
-                except Exception:
-                    embeddings = None
-            for idx, ch in enumerate(chunks):
-                vec_bytes = b""
-                if embeddings and idx < len(embeddings):
-                    vec_bytes = _bytes_from_vector(embeddings[idx])
-                    chunks_embedded += 1
-                DocumentChunk.objects.create(
-                    document=doc,
-                    chunk_index=int(ch.get("index", idx) or idx),
-                    text=str(ch.get("text", "")),
-                    embedding=vec_bytes,
-                )
-                chunks_written += 1
+    error = None
+    try:
+        stats = import_records(records, client=client)
+    except ImportFailed as e:
+        # Batches flushed before the bad record stay imported; report what they wrote
+        error = str(e)
+        stats = e.stats
 
     # Rebuild FAISS index best-effort
     try:
@@ -505,12 +333,9 @@ def import_database(request: HttpRequest):
     except Exception:
         pass
 
-    return JsonResponse({
-        "created": created,
-        "updated": updated,
-        "chunks_written": chunks_written,
-        "chunks_embedded": chunks_embedded,
-    })
+    if error is not None:
+        return JsonResponse({"error": error, "imported": stats}, status=400)
+    return JsonResponse(stats)
 
 
 @api_view(["POST"])
@@ -0,0 +1,92 @@
+"""Optional warm-up of serving processes (``WARMUP_ON_START``).
+
+Heavy dependencies are imported lazily (see ``core.lazy``), so a fresh worker would otherwise pay
+for them, for the tokenizer and for loading the FAISS shards on its first ``/api/ask/``.
+``CoreConfig.ready()`` starts ``warm_up`` on a background thread in processes that serve HTTP
+(WSGI/ASGI servers, ``runserver``); management commands and test runs skip it.
+"""
+import os
+import sys
+import threading
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from .lazy import HEAVY_MODULES, optional_import
+from .metrics import timed
+
+# Result of the last warm-up in this process, for diagnostics
+last_warmup: Optional[Dict[str, object]] = None
+
+
+def serving_process() -> bool:
+    """Whether this process was started to serve requests."""
+    # WSGI/ASGI servers import the project's wsgi/asgi module, whose import runs django.setup()
+    package = str(getattr(settings, 'WSGI_APPLICATION', '') or '').split('.')[0]
+    if package and (f"{package}.wsgi" in sys.modules or f"{package}.asgi" in sys.modules):
+        return True
+    argv = sys.argv
+    if len(argv) > 1 and argv[1] == 'runserver':
+        # With the autoreloader only the child process serves
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
+    return False
+
+
+def _preload_shards() -> int:
+    # Document indexes first: every two-stage question searches them
+    from .vectorstore import _doc_shard_paths, _shard_paths, available, list_shards, shard_cache
+    if not available():
+        return 0
+    loaded = 0
+    for shards, paths_for in ((list_shards(documents=True), _doc_shard_paths), (list_shards(), _shard_paths)):
+        for shard in shards:
+            if shard_cache.nbytes >= shard_cache.budget:
+                return loaded
+            if shard_cache.get(paths_for(shard)) is not None:
+                loaded += 1
+    return loaded
+
+
+def warm_up() -> Dict[str, object]:
+    """Import heavy dependencies, load the tokenizer, embedding backend and OpenAI client and preload
+    index shards up to ``VECTOR_CACHE_MB``. Each step is best-effort."""
+    global last_warmup
+    from .context import count_tokens
+    from .embeddings import get_embedding_backend
+    from .vectorstore import shard_cache
+
+    result: Dict[str, object] = {}
+    with timed("warmup") as stage:
+        result["modules"] = [name for name in HEAVY_MODULES if optional_import(name) is not None]
+        count_tokens("warm up")
+        try:
+            get_embedding_backend()
+        except ValueError:
+            pass
+        if settings.OPENAI_API_KEY:
+            from .llm import get_client
+            get_client()
+        try:
+            result["shards"] = _preload_shards()
+        except Exception:
+            result["shards"] = 0
+        stage.bytes = shard_cache.nbytes
+        result["bytes"] = stage.bytes
+    last_warmup = result
+    return result
+
+
+def _warm_up_quietly() -> None:
+    try:
+        warm_up()
+    except Exception:
+        pass
+
+
+def start_warmup() -> Optional[threading.Thread]:
+    """Warm up in the background when enabled and this is a serving process."""
+    if not getattr(settings, 'WARMUP_ON_START', False) or not serving_process():
+        return None
+    thread = threading.Thread(target=_warm_up_quietly, name='ragnet-warmup', daemon=True)
+    thread.start()
+    return thread
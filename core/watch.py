@@ -0,0 +1,396 @@
+"""Filesystem watching for ``manage.py watch``.
+
+Watchers turn filesystem activity into ``(kind, path)`` changes: ``CHANGED`` for created, modified
+or moved-in files, ``DELETED`` for removed or moved-out files and ``DELETED_DIR`` for whole
+directories. ``InotifyWatcher`` uses Linux inotify through ``ctypes``; ``PollingWatcher`` diffs
+directory walks and is used for network mounts (where inotify sees no remote changes) and on other
+platforms. A ``Debouncer`` collapses bursts, and ``apply_changes`` feeds each batch through the same
+pipeline as ``/api/scan/`` before patching the vector index.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .metrics import collect
+from .models import Document
+from .scanner import ScanEntry, delete_paths, ingest_entries, iter_scan_entries, new_counts, scan_entry
+from .vectorstore import apply_index_changes, shard_for
+
+CHANGED = "changed"
+DELETED = "deleted"
+DELETED_DIR = "deleted_dir"
+# Emitted with a root when the watcher lost events (inotify queue overflow); the root needs a reconcile
+RESCAN = "rescan"
+
+Change = Tuple[str, str]
+
+# Filesystem types whose remote changes never reach local inotify
+NETWORK_FILESYSTEMS = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "glusterfs", "lustre",
+    "fuse.sshfs", "fuse.rclone", "fuse.s3fs", "davfs", "fuse.davfs2",
+}
+
+
+def _ignored(root: str, path: str) -> bool:
+    ignore_dirs = set(getattr(settings, 'SCAN_IGNORE_DIRS', set()))
+    rel = os.path.relpath(path, root)
+    return any(part in ignore_dirs for part in rel.split(os.sep))
+
+
+def filesystem_type(path: str) -> str:
+    """Type of the filesystem holding ``path`` per /proc/self/mounts ("" when unknown)."""
+    try:
+        with open("/proc/self/mounts", "r", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f if line.strip()]
+    except OSError:
+        return ""
+    path = os.path.realpath(path)
+    best, fstype = "", ""
+    for mount_point, kind in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        if (path == mount_point or path.startswith(mount_point.rstrip(os.sep) + os.sep)) and len(mount_point) >= len(best):
+            best, fstype = mount_point, kind
+    return fstype
+
+
+class Debouncer:
+    """Collects changes until no new ones arrived for ``quiet`` seconds (or ``max_delay`` passed).
+
+    The latest change per path wins, so a file written many times is ingested once and a file
+    created then deleted within the window is only deleted.
+    """
+
+    def __init__(self, quiet: float, max_delay: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.quiet = quiet
+        self.max_delay = max_delay if max_delay is not None else max(quiet * 10, 30.0)
+        self.clock = clock
+        self.pending: Dict[str, str] = {}
+        self._first: Optional[float] = None
+        self._last: Optional[float] = None
+
+    def add(self, kind: str, path: str) -> None:
+        now = self.clock()
+        if self._first is None:
+            self._first = now
+        self._last = now
+        if kind == DELETED_DIR:
+            prefix = path.rstrip(os.sep) + os.sep
+            for pending in [p for p in self.pending if p.startswith(prefix)]:
+                del self.pending[pending]
+        # Re-insert so the batch keeps the order of the latest changes
+        self.pending.pop(path, None)
+        self.pending[path] = kind
+
+    def timeout(self) -> Optional[float]:
+        """Seconds until the pending batch is due, or None when nothing is pending."""
+        if not self.pending:
+            return None
+        now = self.clock()
+        return max(0.0, min(self._last + self.quiet, self._first + self.max_delay) - now)
+
+    def ready(self) -> bool:
+        return self.timeout() == 0.0
+
+    def drain(self) -> Dict[str, str]:
+        batch, self.pending = self.pending, {}
+        self._first = self._last = None
+        return batch
+
+
+class PollingWatcher:
+    """Detects changes by comparing (mtime, size) snapshots of the roots every ``interval`` seconds."""
+
+    def __init__(self, roots: Sequence[str], interval: float, clock: Callable[[], float] = time.monotonic):
+        self.roots = list(roots)
+        self.interval = interval
+        self.clock = clock
+        self._snapshot = self._walk()
+        self._next = clock() + interval
+
+    def _walk(self) -> Dict[str, Tuple[int, int]]:
+        snapshot: Dict[str, Tuple[int, int]] = {}
+        ignore_dirs = set(getattr(settings, 'SCAN_IGNORE_DIRS', set()))
+        for root in self.roots:
+            for dirpath, dirs, files in os.walk(root):
+                dirs[:] = [d for d in dirs if d not in ignore_dirs]
+                for name in files:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def timeout(self) -> float:
+        return max(0.0, self._next - self.clock())
+
+    def poll(self) -> List[Change]:
+        if self.timeout() > 0:
+            return []
+        current = self._walk()
+        self._next = self.clock() + self.interval
+        changes = [(CHANGED, path) for path, sig in current.items() if self._snapshot.get(path) != sig]
+        changes += [(DELETED, path) for path in self._snapshot if path not in current]
+        self._snapshot = current
+        return changes
+
+    def close(self) -> None:
+        pass
+
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+_EVENT = struct.Struct("iIII")
+
+
+def _libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, "inotify_init1") else None
+
+
+def inotify_available() -> bool:
+    return _libc() is not None
+
+
+class InotifyWatcher:
+    """Recursive inotify watches on the roots. Raises OSError when watches can't be added (e.g. the
+    ``fs.inotify.max_user_watches`` limit), so callers can fall back to polling."""
+
+    def __init__(self, roots: Sequence[str]):
+        self._lib = _libc()
+        if self._lib is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.fd = self._lib.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths: Dict[int, str] = {}
+        self._wds: Dict[str, int] = {}
+        try:
+            for root in self.roots:
+                self._watch_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _root_of(self, path: str) -> str:
+        return next((r for r in self.roots if path == r or path.startswith(r.rstrip(os.sep) + os.sep)), path)
+
+    def _add_watch(self, path: str) -> None:
+        wd = self._lib.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return  # vanished or unreadable; nothing to watch
+            raise OSError(err, f"inotify_add_watch failed for {path}: {os.strerror(err)}")
+        self._paths[wd] = path
+        self._wds[path] = wd
+
+    def _watch_tree(self, top: str) -> List[str]:
+        # Returns the files already present, which a directory moved or created under a watch may contain
+        ignore_dirs = set(getattr(settings, 'SCAN_IGNORE_DIRS', set()))
+        files = []
+        for dirpath, dirs, names in os.walk(top):
+            dirs[:] = [d for d in dirs if d not in ignore_dirs]
+            self._add_watch(dirpath)
+            files.extend(os.path.join(dirpath, name) for name in names)
+        return files
+
+    def _forget_tree(self, top: str) -> None:
+        prefix = top.rstrip(os.sep) + os.sep
+        for path in [p for p in self._wds if p == top or p.startswith(prefix)]:
+            wd = self._wds.pop(path)
+            self._paths.pop(wd, None)
+            self._lib.inotify_rm_watch(self.fd, wd)
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def poll(self) -> List[Change]:
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        changes: List[Change] = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            raw_name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                changes.extend((RESCAN, root) for root in self.roots)
+                continue
+            base = self._paths.get(wd)
+            if base is None:
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                if self._wds.get(base) == wd:
+                    del self._wds[base]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if base in self.roots:
+                    changes.append((DELETED_DIR, base))
+                continue
+            path = os.path.join(base, os.fsdecode(raw_name))
+            if _ignored(self._root_of(path), path):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changes.extend((CHANGED, f) for f in self._watch_tree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    # Watches follow the inode, so a moved-away tree must stop reporting under its old path
+                    self._forget_tree(path)
+                    changes.append((DELETED_DIR, path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changes.append((CHANGED, path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                changes.append((DELETED, path))
+        return changes
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watchers(roots: Sequence[str], force_poll: bool = False, interval: Optional[float] = None,
+                    log: Callable[[str], None] = lambda message: None) -> list:
+    """inotify for local roots, polling for network mounts, everything polled when ``force_poll``
+    or when inotify is unavailable."""
+    interval = interval or float(getattr(settings, 'WATCH_POLL_INTERVAL', 30) or 30)
+    local, polled = [], []
+    for root in roots:
+        fstype = filesystem_type(root)
+        if force_poll or not inotify_available() or fstype in NETWORK_FILESYSTEMS:
+            polled.append(root)
+        else:
+            local.append(root)
+    watchers = []
+    if local:
+        try:
+            watchers.append(InotifyWatcher(local))
+        except OSError as e:
+            log(f"inotify unavailable ({e}); polling instead")
+            polled.extend(local)
+    if polled:
+        log(f"Polling every {interval:g}s: {', '.join(polled)}")
+        watchers.append(PollingWatcher(polled, interval))
+    return watchers
+
+
+def wait_for_changes(watchers: Sequence, timeout: float) -> List[Change]:
+    """Block up to ``timeout`` seconds for changes from any watcher."""
+    inotify = [w for w in watchers if isinstance(w, InotifyWatcher)]
+    polling = [w for w in watchers if isinstance(w, PollingWatcher)]
+    timeout = min([timeout] + [w.timeout() for w in polling])
+    if inotify:
+        select.select(inotify, [], [], timeout)
+    elif timeout > 0:
+        time.sleep(timeout)
+    changes: List[Change] = []
+    for watcher in watchers:
+        changes.extend(watcher.poll())
+    return changes
+
+
+def _is_current(entry: ScanEntry, known: Dict[str, Tuple[int, object]]) -> bool:
+    stored = known.get(entry.path)
+    if stored is None:
+        return False
+    size, modified_at = stored
+    current = entry.modified_at
+    if modified_at is not None and timezone.is_aware(modified_at):
+        current = timezone.make_aware(current)
+    return size == entry.size_bytes and modified_at == current
+
+
+def _stored_state(paths: Iterable[str], batch_size: int = 500) -> Dict[str, Tuple[int, object]]:
+    paths = list(paths)
+    state: Dict[str, Tuple[int, object]] = {}
+    # Batched to stay under the database's bound-parameter limit on large catch-ups
+    for start in range(0, len(paths), batch_size):
+        rows = Document.objects.filter(file_path__in=paths[start:start + batch_size])
+        state.update((path, (size, modified)) for path, size, modified in rows.values_list('file_path', 'size_bytes', 'modified_at'))
+    return state
+
+
+def reconcile(root: str) -> Dict[str, str]:
+    """Changes that bring the database in line with ``root`` (catch-up at start, or after lost events)."""
+    changes: Dict[str, str] = {}
+    on_disk: Set[str] = set()
+    for entry in iter_scan_entries(root):
+        on_disk.add(entry.path)
+        changes[entry.path] = CHANGED
+    prefix = root.rstrip(os.sep) + os.sep
+    for path in Document.objects.filter(file_path__startswith=prefix).values_list('file_path', flat=True).iterator():
+        if path not in on_disk:
+            changes[path] = DELETED
+    return changes
+
+
+def apply_changes(changes: Dict[str, str], contractor: str = "", project: str = "", mode: str = "concise") -> Dict[str, object]:
+    """Ingest changed files and delete removed ones, then patch the vector index.
+
+    Files whose size and modification time match the stored document are skipped, so touching
+    or re-saving an unchanged file costs no API calls.
+    """
+    deleted_dirs = [path for path, kind in changes.items() if kind == DELETED_DIR]
+    gone: List[str] = []
+    entries: List[ScanEntry] = []
+    known = _stored_state(path for path, kind in changes.items() if kind == CHANGED)
+    skipped = 0
+    for path, kind in changes.items():
+        if kind != CHANGED:
+            if kind == DELETED:
+                gone.append(path)
+            continue
+        entry = scan_entry(path)
+        if entry is None:
+            gone.append(path)  # deleted again before the batch ran
+        elif _is_current(entry, known):
+            skipped += 1
+        else:
+            entries.append(entry)
+
+    counts = new_counts()
+    with collect("watch") as breakdown:
+        deleted, removed_ids, added_ids, shards = delete_paths(gone, deleted_dirs) if gone or deleted_dirs else (0, [], [], set())
+        if entries:
+            store = ingest_entries(entries, contractor=contractor, project=project, mode=mode)
+            counts = store.counts
+            removed_ids += store.removed_chunk_ids
+            added_ids += store.added_chunk_ids
+            shards.add(shard_for(project, contractor))
+        if deleted or entries:
+            try:
+                apply_index_changes(removed_ids, added_ids, shards)
+            except Exception:
+                pass
+    return {**counts, "deleted": deleted, "skipped": skipped, "timings": breakdown.as_dict()}
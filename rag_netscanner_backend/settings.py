@@ -87,6 +87,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # `manage.py scan` workers write concurrently: wait up to SQLITE_TIMEOUT seconds for the
+        # lock, take it when a transaction starts (deferred upgrades fail instead of waiting) and
+        # use WAL so readers don't block the writer
+        'OPTIONS': {
+            'timeout': int(os.getenv('SQLITE_TIMEOUT', '30')),
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
     }
 }
 
@@ -135,6 +143,27 @@ if _cors_origins:
 
 # OpenAI
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+# Alternative API endpoint (proxy or compatible server); empty uses api.openai.com
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', '')
+# Embedding model used for chunks and queries. Imported vectors are only reused when they match it.
+OPENAI_EMBEDDING_MODEL = os.getenv('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
+# Embedding backend: "openai" (OPENAI_EMBEDDING_MODEL over the API) or "hashing" (local CPU
+# feature hashing, no network). Vectors are tagged with the model that made them; switch, then
+# run `manage.py reembed` to convert stored vectors.
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openai').lower()
+# Vector size of the hashing backend
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '512'))
+# Shared keep-alive connection pool for OpenAI clients (one per process / event loop)
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '100'))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_KEEPALIVE_CONNECTIONS', '20'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+# Gateway limits shared by every OpenAI call in the process. Buckets are re-sized from the
+# provider's x-ratelimit-* headers once responses arrive.
+OPENAI_RPM_LIMIT = int(os.getenv('OPENAI_RPM_LIMIT', '500'))
+OPENAI_TPM_LIMIT = int(os.getenv('OPENAI_TPM_LIMIT', '200000'))
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '32'))
+# Retries (with jittered backoff) on 429/5xx/timeouts before a call is treated as failed
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '6'))
 
 # Media files (for potential file uploads/previews later)
 MEDIA_URL = '/media/'
@@ -145,10 +174,68 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Directory holding the persisted FAISS indexes and id mappings
+VECTOR_INDEX_DIR = Path(os.getenv('VECTOR_INDEX_DIR', BASE_DIR / 'data' / 'faiss'))
+# Vectors are split into one index shard per "project", per "contractor", or "none" (one shard).
+# Queries filtered by that field only search the matching shards. Run `manage.py rebuild_index`
+# after changing it.
+VECTOR_SHARD_BY = os.getenv('VECTOR_SHARD_BY', 'project').lower()
+# Memory budget for loaded index shards per process; least recently used shards are evicted. Default 1024 MiB.
+VECTOR_CACHE_MB = float(os.getenv('VECTOR_CACHE_MB', '1024'))
+# Threads searching shards in parallel for unfiltered queries. Default 8.
+VECTOR_SEARCH_THREADS = int(os.getenv('VECTOR_SEARCH_THREADS', '8'))
+# Serving processes (WSGI/ASGI workers, runserver) import heavy dependencies and preload index
+# shards (up to VECTOR_CACHE_MB) in the background at startup, so the first question doesn't wait.
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'false').lower() in {'1', 'true', 'yes'}
+
 # Scan controls (to avoid huge or noisy inputs). Tunable via env.
 # Max single file size to read (in bytes). Default 10 MiB.
 SCAN_MAX_BYTES = int(os.getenv('SCAN_MAX_BYTES', '10485760'))
 # Max number of chunks stored per file (to cap token usage). Default 64.
 SCAN_MAX_CHUNKS = int(os.getenv('SCAN_MAX_CHUNKS', '64'))
+# Chunk size and overlap in tokens per format, as "<format>=<tokens>:<overlap>" pairs for pdf, markdown,
+# code, csv and text (see core/chunking.py). Unlisted formats keep their defaults. Compare settings with
+# `python manage.py chunk_eval <dir>`.
+CHUNK_PROFILES = os.getenv('CHUNK_PROFILES', '')
+# Files described/embedded concurrently during a scan. Default 8.
+SCAN_CONCURRENCY = int(os.getenv('SCAN_CONCURRENCY', '8'))
+# Worker processes used by `manage.py scan` (each runs SCAN_CONCURRENCY files at a time). Default: CPU count.
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', str(os.cpu_count() or 1)))
+# Files per checkpointed shard of `manage.py scan`. Default 256.
+SCAN_SHARD_FILES = int(os.getenv('SCAN_SHARD_FILES', '256'))
+# Near-duplicate chunks (MinHash similarity >= threshold) reuse an existing embedding and
+# are left out of the vector index and of ask contexts.
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() in {'1', 'true', 'yes'}
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.85'))
+# Images are downscaled to fit IMAGE_MAX_DIMENSION pixels and re-encoded as JPEG before vision
+# description (requires Pillow). Visually identical images share one cached description.
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', '1024'))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '80'))
+IMAGE_DESCRIPTION_CACHE = os.getenv('IMAGE_DESCRIPTION_CACHE', 'true').lower() in {'1', 'true', 'yes'}
 # Comma-separated directory names to ignore while scanning
 SCAN_IGNORE_DIRS = {d.strip() for d in os.getenv('SCAN_IGNORE_DIRS', 'node_modules,.git,.venv,__pycache__,dist,build,.next,.idea,.vscode').split(',') if d.strip()}
+
+# Watch mode (`manage.py watch`)
+# Comma-separated (or os.pathsep-separated) directories watched when none are given on the command line
+WATCH_ROOTS = [d.strip() for d in os.getenv('WATCH_ROOTS', '').replace(os.pathsep, ',').split(',') if d.strip()]
+# Quiet period before a burst of changes is ingested. Default 2 seconds.
+WATCH_DEBOUNCE_SECONDS = float(os.getenv('WATCH_DEBOUNCE_SECONDS', '2.0'))
+# Seconds between directory walks when polling (network mounts, no inotify). Default 30.
+WATCH_POLL_INTERVAL = float(os.getenv('WATCH_POLL_INTERVAL', '30'))
+
+# Import controls
+# Documents/chunks buffered before each bulk write during import. Default 1000.
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+# Max texts sent per embeddings API call. Default 256.
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '256'))
+
+# Ask controls
+# Token budget for retrieved context packed into the /api/ask/ prompt. Default 3000.
+ASK_CONTEXT_TOKENS = int(os.getenv('ASK_CONTEXT_TOKENS', '3000'))
+# Upper bound on the client-supplied k. Default 50.
+ASK_MAX_K = int(os.getenv('ASK_MAX_K', '50'))
+# Two-stage retrieval: shortlist documents by their description vector, then rank only
+# their chunks. Falls back to the flat chunk index when no document index exists.
+ASK_TWO_STAGE = os.getenv('ASK_TWO_STAGE', 'true').lower() in {'1', 'true', 'yes'}
+# Documents shortlisted in the first stage. Default 20.
+ASK_CANDIDATE_DOCS = int(os.getenv('ASK_CANDIDATE_DOCS', '20'))